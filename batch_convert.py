@@ -0,0 +1,357 @@
+"""
+Conversão em lote, fora do Telegram (monta pacote de figurinhas de uma pasta).
+
+Uso:
+    python batch_convert.py minha_pasta/                 # tudo da pasta (e subpastas) -> minha_pasta_stickers/
+    python batch_convert.py minha_pasta/ -o saida/ -j 4  # pasta de saída e nº de processos
+    python batch_convert.py pacote.jsonl                 # manifesto (inclui quotes)
+    python batch_convert.py minha_pasta/ --static        # vídeo/GIF vira figurinha estática
+    python batch_convert.py minha_pasta/ --force         # refaz o que já existe
+
+Imagens viram .webp (convert_to_sticker_webp); GIF/vídeo viram .webm
+(convert_to_animated_sticker_webm_budgeted, que garante o limite de 256 KB).
+Roda num pool de processos (um por núcleo por padrão) e não precisa de BOT_TOKEN.
+
+Pode interromper e rodar de novo: o que já tem saída é pulado (a saída só
+aparece com o nome final quando termina de gravar, então arquivo pela metade
+nunca conta como pronto).
+
+Manifesto: .json (lista) ou .jsonl (um objeto por linha), caminhos relativos à
+pasta do manifesto:
+    {"src": "fotos/gato.jpg"}
+    {"src": "clipes/pulo.mp4", "out": "pulo_estatico", "type": "static"}
+    {"type": "quote", "text": "kkkkkk verdade", "author": "Fulano", "avatar": "fotos/fulano.jpg", "out": "quote_fulano"}
+"type" é "static", "animated" ou "quote" (sem ele, escolhe pela extensão do src).
+Quote aceita ainda "theme" (dark/light) e "bg" (cor da bolha, #rrggbb).
+"""
+import argparse
+import json
+import mimetypes
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+import metrics
+
+ANIMATED_EXTS = {".gif", ".mp4", ".mov", ".m4v", ".mkv", ".webm", ".avi", ".3gp"}
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".svg", ".heic", ".ico"}
+OUT_EXT = {"static": ".webp", "animated": ".webm", "quote": ".webp"}
+
+
+class Task(NamedTuple):
+    kind: str                 # static / animated / quote
+    src: str | None           # arquivo de entrada (None no quote)
+    dst: str                  # arquivo de saída final
+    opts: dict                # extras do quote (text, author, avatar, theme, bg)
+
+
+# ---------------------------------------------------------------- montar a lista
+
+def _kind_for(path: str, static_only: bool) -> str | None:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ANIMATED_EXTS:
+        return "static" if static_only else "animated"
+    if ext in IMAGE_EXTS:
+        return "static"
+    return None
+
+
+def _dst_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def tasks_from_dir(src_dir: str, out_dir: str, static_only: bool = False) -> list[Task]:
+    """
+    Uma tarefa por mídia reconhecida em src_dir (recursivo), espelhando as subpastas em out_dir.
+    Saída é <nome>.webp/.webm; se duas entradas dariam o mesmo nome (a.jpg e a.png),
+    essas mantêm a extensão original (a.jpg.webp, a.png.webp) pra uma não sobrescrever a outra.
+    """
+    found = []
+    out_abs = os.path.abspath(out_dir)
+    for root, dirs, files in os.walk(src_dir):
+        # não entra na própria pasta de saída (se ela estiver dentro da entrada)
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != out_abs)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            kind = _kind_for(name, static_only)
+            if kind is None:
+                continue
+            found.append((kind, path, os.path.relpath(path, src_dir)))
+
+    def _plain(kind: str, rel: str) -> str:
+        return os.path.join(out_dir, os.path.splitext(rel)[0] + OUT_EXT[kind])
+
+    counts: dict[str, int] = {}
+    for kind, _, rel in found:
+        key = _dst_key(_plain(kind, rel))
+        counts[key] = counts.get(key, 0) + 1
+    tasks = []
+    for kind, path, rel in found:
+        dst = _plain(kind, rel)
+        if counts[_dst_key(dst)] > 1:
+            dst = os.path.join(out_dir, rel + OUT_EXT[kind])
+        tasks.append(Task(kind, path, dst, {}))
+    return tasks
+
+
+def _read_manifest(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith(".jsonl"):
+            entries = []
+            for n, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}:{n}: JSON inválido ({e.msg})") from None
+            return entries
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError(f"{path}: o manifesto .json precisa ser uma lista")
+    return entries
+
+
+def tasks_from_manifest(manifest: str, out_dir: str, static_only: bool = False) -> list[Task]:
+    base = os.path.dirname(os.path.abspath(manifest))
+    tasks = []
+    for n, entry in enumerate(_read_manifest(manifest), start=1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"{manifest}: item {n} não é um objeto")
+        kind = entry.get("type")
+        src = entry.get("src")
+        if src:
+            src = os.path.join(base, src)
+        if kind is None:
+            if not src:
+                raise ValueError(f"{manifest}: item {n} sem 'src' nem 'type'")
+            kind = _kind_for(src, static_only)
+            if kind is None:
+                raise ValueError(f"{manifest}: item {n}: não sei converter {entry['src']!r} (use 'type')")
+        elif kind == "animated" and static_only:
+            kind = "static"
+        if kind not in OUT_EXT:
+            raise ValueError(f"{manifest}: item {n}: type {kind!r} inválido (static/animated/quote)")
+
+        opts = {}
+        if kind == "quote":
+            if not entry.get("text"):
+                raise ValueError(f"{manifest}: item {n}: quote sem 'text'")
+            opts = {k: entry[k] for k in ("text", "author", "theme", "bg") if entry.get(k)}
+            if entry.get("avatar"):
+                opts["avatar"] = os.path.join(base, entry["avatar"])
+            src = None
+        elif not src:
+            raise ValueError(f"{manifest}: item {n}: falta 'src'")
+
+        name = entry.get("out") or (
+            os.path.splitext(entry["src"])[0] if src else f"quote_{n:04d}"
+        )
+        tasks.append(Task(kind, src, os.path.join(out_dir, os.path.splitext(name)[0] + OUT_EXT[kind]), opts))
+
+    seen: dict[str, int] = {}
+    for n, task in enumerate(tasks, start=1):
+        key = _dst_key(task.dst)
+        if key in seen:
+            raise ValueError(
+                f"{manifest}: itens {seen[key]} e {n} gravariam o mesmo arquivo "
+                f"({os.path.relpath(task.dst, out_dir)}); use 'out' pra dar nomes diferentes"
+            )
+        seen[key] = n
+    return tasks
+
+
+# ---------------------------------------------------------------- worker
+
+def _convert(task: Task) -> tuple[bytes, int, str]:
+    """(saída, bytes de entrada, observação)."""
+    import converter
+
+    if task.kind == "quote":
+        from PIL import Image
+        from quote_maker import make_quote_sticker
+
+        avatar = None
+        in_bytes = len(task.opts["text"].encode("utf-8"))
+        if task.opts.get("avatar"):
+            avatar = Image.open(task.opts["avatar"])
+            in_bytes += os.path.getsize(task.opts["avatar"])
+        data = make_quote_sticker(
+            task.opts["text"],
+            author_name=task.opts.get("author"),
+            avatar_img=avatar,
+            theme=task.opts.get("theme", "dark"),
+            bg_hex=task.opts.get("bg"),
+        )
+        return data, in_bytes, ""
+
+    with open(task.src, "rb") as f:
+        raw = f.read()
+    mime = mimetypes.guess_type(task.src)[0] or ""
+    name = os.path.basename(task.src)
+    if task.kind == "animated":
+        res = converter.convert_to_animated_sticker_webm_budgeted(raw, mime, name)
+        note = f"{res.bitrate} {res.fps}fps {res.seconds:g}s"
+        if res.attempts > 1:
+            note += f", {res.attempts} tentativas"
+        if not res.fits:
+            note += ", ACIMA DO LIMITE"
+        return res.data, len(raw), note
+    return converter.convert_to_sticker_webp(raw, mime, name), len(raw), ""
+
+
+def run_task(task: Task) -> dict:
+    """roda no worker: converte, grava a saída (atômico) e devolve os números."""
+    t0 = time.perf_counter()
+    (data, in_bytes, note), _, stages = metrics.run_collecting(_convert, task)
+    os.makedirs(os.path.dirname(task.dst) or ".", exist_ok=True)
+    part = f"{task.dst}.{os.getpid()}.part"
+    with open(part, "wb") as f:
+        f.write(data)
+    os.replace(part, task.dst)
+    return {
+        "in_bytes": in_bytes,
+        "out_bytes": len(data),
+        "seconds": time.perf_counter() - t0,
+        "stages": stages,
+        "note": note,
+    }
+
+
+# ---------------------------------------------------------------- main
+
+def _done(task: Task) -> bool:
+    try:
+        return os.path.getsize(task.dst) > 0
+    except OSError:
+        return False
+
+
+def _drop_partials(out_dir: str):
+    """apaga saídas pela metade de uma rodada interrompida."""
+    for root, _, files in os.walk(out_dir):
+        for name in files:
+            if name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+
+
+def _kb(n: float) -> str:
+    return f"{n / 1024:.1f} KB" if n < 1024 * 1024 else f"{n / 1024 / 1024:.1f} MB"
+
+
+def _label(task: Task) -> str:
+    if task.src:
+        return os.path.basename(task.src)
+    text = task.opts["text"]
+    return "quote " + repr(text if len(text) <= 24 else text[:23] + "…")
+
+
+def _summary(results: list[tuple[Task, dict]], skipped: int, failed: list[tuple[Task, str]], wall: float) -> str:
+    lines = [
+        "",
+        f"convertidas: {len(results)}  puladas (já existiam): {skipped}  falharam: {len(failed)}",
+        f"tempo total: {wall:.1f}s" + (f" ({len(results) / wall:.2f} figurinhas/s)" if results and wall > 0 else ""),
+    ]
+    for kind in ("static", "animated", "quote"):
+        rows = [r for t, r in results if t.kind == kind]
+        if not rows:
+            continue
+        secs = [r["seconds"] for r in rows]
+        outs = [r["out_bytes"] for r in rows]
+        ins = sum(r["in_bytes"] for r in rows)
+        lines.append(
+            f"  {kind:<8} {len(rows):>5}  entrada {_kb(ins)} -> saída {_kb(sum(outs))}"
+            f" (média {_kb(statistics.fmean(outs))}, maior {_kb(max(outs))})"
+            f"  tempo p50 {statistics.median(secs):.2f}s / máx {max(secs):.2f}s"
+        )
+    totals: dict[str, float] = {}
+    for _, r in results:
+        for name, dt in r["stages"]:
+            totals[name] = totals.get(name, 0.0) + dt
+    if totals:
+        lines.append("  etapas (soma nos workers): " + ", ".join(
+            f"{name} {dt:.1f}s" for name, dt in sorted(totals.items(), key=lambda kv: -kv[1])
+        ))
+    over = [t for t, r in results if "ACIMA DO LIMITE" in r["note"]]
+    if over:
+        lines.append(f"  {len(over)} figurinha(s) animada(s) não couberam em 256 KB:")
+        lines += [f"    {t.dst}" for t in over]
+    if failed:
+        lines.append("falhas:")
+        lines += [f"  {_label(t)}: {err}" for t, err in failed]
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="converte uma pasta (ou manifesto) em figurinhas, em paralelo")
+    ap.add_argument("src", help="pasta com as mídias ou manifesto .json/.jsonl")
+    ap.add_argument("-o", "--out", help="pasta de saída (padrão: <src>_stickers)")
+    ap.add_argument("-j", "--jobs", type=int, default=0, help="processos em paralelo (padrão: nº de núcleos)")
+    ap.add_argument("--static", action="store_true", help="GIF/vídeo vira figurinha estática (.webp)")
+    ap.add_argument("--force", action="store_true", help="refaz mesmo se a saída já existir")
+    args = ap.parse_args(argv)
+
+    src = args.src.rstrip("/\\") or args.src
+    is_dir = os.path.isdir(src)
+    if not is_dir and not os.path.isfile(src):
+        ap.error(f"não achei {src}")
+    out_dir = args.out or (src if is_dir else os.path.splitext(src)[0]) + "_stickers"
+
+    try:
+        if is_dir:
+            tasks = tasks_from_dir(src, out_dir, args.static)
+        else:
+            tasks = tasks_from_manifest(src, out_dir, args.static)
+    except (OSError, ValueError) as e:
+        print(f"erro: {e}", file=sys.stderr)
+        return 2
+
+    _drop_partials(out_dir)
+    todo = tasks if args.force else [t for t in tasks if not _done(t)]
+    skipped = len(tasks) - len(todo)
+    jobs = max(1, args.jobs or os.cpu_count() or 1)
+    print(f"{len(tasks)} mídia(s), {skipped} já pronta(s), {len(todo)} pra converter com {min(jobs, len(todo) or 1)} processo(s) -> {out_dir}")
+
+    results: list[tuple[Task, dict]] = []
+    failed: list[tuple[Task, str]] = []
+    t0 = time.perf_counter()
+    if todo:
+        width = len(str(len(todo)))
+        with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as pool:
+            futures = {pool.submit(run_task, t): t for t in todo}
+            try:
+                for n, fut in enumerate(as_completed(futures), start=1):
+                    task = futures[fut]
+                    prefix = f"[{n:>{width}}/{len(todo)}]"
+                    try:
+                        r = fut.result()
+                    except Exception as e:
+                        failed.append((task, str(e) or type(e).__name__))
+                        print(f"{prefix} ERRO {_label(task)}: {e}", flush=True)
+                        continue
+                    results.append((task, r))
+                    note = f" ({r['note']})" if r["note"] else ""
+                    print(
+                        f"{prefix} ok   {_label(task)} -> {os.path.relpath(task.dst, out_dir)}"
+                        f"  {_kb(r['out_bytes'])} em {r['seconds']:.2f}s{note}",
+                        flush=True,
+                    )
+            except KeyboardInterrupt:
+                # o que já terminou fica gravado; rodar de novo continua daqui
+                pool.shutdown(wait=False, cancel_futures=True)
+                print(f"\ninterrompido: {len(results)} pronta(s) nesta rodada, rode de novo pra continuar", file=sys.stderr)
+                return 130
+
+    print(_summary(results, skipped, failed, time.perf_counter() - t0))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
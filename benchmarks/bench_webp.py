@@ -0,0 +1,65 @@
+"""
+Compara tempo de encode e tamanho do WebP em cada perfil do webp_encoder.
+
+Uso: python benchmarks/bench_webp.py
+
+"auto" é o que o bot usa (pick_profile); "max" é o preset antigo (method=6, quality=95).
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+import quote_maker
+import webp_encoder
+from converter import fit_to_sticker_canvas
+
+REPEAT = 5
+
+
+def _fixtures() -> dict[str, Image.Image]:
+    quote = Image.open(io.BytesIO(quote_maker.make_quote_sticker(
+        "figurinha de teste com um texto de tamanho normal pra medir o encode " * 2,
+        author_name="Bench",
+        webp_profile="lossless",
+    ))).convert("RGBA")
+
+    m = Image.effect_mandelbrot((640, 480), (-2.0, -1.2, 1.0, 1.2), 200)
+    photo = Image.merge("RGB", (m, Image.effect_noise((640, 480), 40).convert("L"), m.rotate(180)))
+    photo = fit_to_sticker_canvas(photo)
+
+    logo = Image.new("RGBA", (512, 512), (0, 0, 0, 0))
+    d = ImageDraw.Draw(logo)
+    d.rectangle((60, 60, 452, 452), fill=(255, 79, 154, 255))
+    d.ellipse((140, 140, 372, 372), fill=(44, 28, 74, 255))
+
+    return {"quote": quote, "foto": photo, "logo": logo}
+
+
+def _bench(img: Image.Image, profile) -> tuple[float, int]:
+    best = float("inf")
+    size = 0
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        data = webp_encoder.encode_webp(img, profile)
+        best = min(best, time.perf_counter() - t0)
+        size = len(data)
+    return best, size
+
+
+def main():
+    print(f"{'imagem':<8} {'perfil':<10} {'ms':>8} {'KB':>8}")
+    for name, img in _fixtures().items():
+        auto = webp_encoder.pick_profile(img)
+        for label, profile in [("auto", None), *webp_encoder.PROFILES.items()]:
+            secs, size = _bench(img, profile)
+            shown = f"auto={auto.name}" if label == "auto" else label
+            print(f"{name:<8} {shown:<10} {secs * 1e3:>8.1f} {size / 1024:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
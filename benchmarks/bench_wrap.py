@@ -0,0 +1,52 @@
+"""
+Mede o tempo do _wrap_text (e da quote inteira) conforme o texto cresce.
+
+Uso: python benchmarks/bench_wrap.py
+
+Se a quebra de linha é linear, a coluna "µs/char" fica mais ou menos constante.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+import quote_maker
+
+SIZES = [500, 1000, 2000, 4000, 8000, 16000, 32000]
+REPEAT = 5
+
+
+def _best_of(fn, repeat: int = REPEAT) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    font = quote_maker._load_font(34)
+    max_w = 282
+
+    cases = {
+        "palavras": lambda n: ("meme bom demais " * n)[:n],
+        "palavra gigante": lambda n: "." * n,
+        "misto": lambda n: ("Olá ∑x² → 😀 ★ texto ... " * n)[:n],
+    }
+
+    print(f"{'caso':<16} {'chars':>7} {'wrap ms':>9} {'µs/char':>8} {'quote ms':>9}")
+    for label, make in cases.items():
+        for n in SIZES:
+            text = make(n)
+            wrap_s = _best_of(lambda: quote_maker._wrap_text(draw, text, font, max_w))
+            quote_s = _best_of(lambda: quote_maker.make_quote_sticker(text, author_name="Bench"), repeat=1)
+            print(f"{label:<16} {n:>7} {wrap_s * 1e3:>9.2f} {wrap_s * 1e6 / n:>8.2f} {quote_s * 1e3:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
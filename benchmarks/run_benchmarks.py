@@ -0,0 +1,387 @@
+"""
+Suíte de benchmark dos caminhos quentes de conversão e renderização.
+
+Uso:
+    python benchmarks/run_benchmarks.py                    # roda tudo, salva em benchmarks/results/
+    python benchmarks/run_benchmarks.py -k quote -n 20     # só casos com "quote" no nome, 20 rodadas
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/antes.json
+
+Tudo offline: as entradas (JPEG grande, PNG transparente, GIF com muitos frames,
+MP4/WebM curtos, SVG, textos de quote) são geradas na hora, com semente fixa.
+Cada caso roda num processo novo: "pico RSS" é o pico do processo inteiro
+(imports incluídos) e "+caso" é quanto o caso subiu acima do que já tinha.
+No Linux o pico vem do VmHWM, zerado no início do filho (o ru_maxrss é herdado
+do pai); as entradas são geradas em outro processo pra o pai continuar pequeno.
+O resultado vai pra um JSON (latências p50/p90/p99, pico de RSS, tamanho da saída)
+pra comparar entre versões.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SEED = 1234
+
+SHORT_QUOTE = "kkkkkk verdade"
+LONG_QUOTE = (
+    "Olá pessoal, isso aqui é um texto bem comprido pra testar a quebra de linha. "
+    "Ελληνικά κείμενα, русский текст, ᏣᎳᎩ ᎦᏬᏂᎯᏍᏗ, ∑ᵢ xᵢ² ≤ ∞, ★ ☂ ♞ ✈, 😀🔥👍 "
+    "e uma palavra gigante: " + "." * 120 + " "
+) * 12
+
+
+# ---------------------------------------------------------------- fixtures
+
+def _noise_image(size: tuple[int, int], mode: str, rnd: random.Random):
+    from PIL import Image
+
+    bands = len(mode)
+    raw = rnd.randbytes(size[0] * size[1] * bands)
+    noise = Image.frombytes(mode, size, raw)
+    # ruído puro não é realista: mistura com um gradiente pra parecer foto
+    grad = Image.linear_gradient("L").resize(size).convert(mode)
+    return Image.blend(grad, noise, 0.35)
+
+
+def _make_fixtures(out_dir: str) -> dict[str, str]:
+    """gera as entradas em out_dir e devolve {nome: caminho}."""
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(SEED)
+    paths = {}
+
+    def _save(name: str, data: bytes):
+        p = os.path.join(out_dir, name)
+        with open(p, "wb") as f:
+            f.write(data)
+        paths[name] = p
+
+    img = _noise_image((4000, 3000), "RGB", rnd)
+    bio = io.BytesIO()
+    img.save(bio, "JPEG", quality=90)
+    _save("photo_12mp.jpg", bio.getvalue())
+
+    img = _noise_image((1500, 1500), "RGBA", rnd)
+    mask = Image.new("L", img.size, 0)
+    ImageDraw.Draw(mask).ellipse((150, 150, 1350, 1350), fill=255)
+    img.putalpha(mask)
+    bio = io.BytesIO()
+    img.save(bio, "PNG")
+    _save("transparent.png", bio.getvalue())
+
+    frames = []
+    for i in range(60):
+        fr = Image.new("RGB", (480, 360), (20, 20, 30))
+        d = ImageDraw.Draw(fr)
+        d.ellipse((i * 6, 100, i * 6 + 120, 220), fill=(255, 79, 154))
+        d.text((10, 10), f"frame {i}", fill=(255, 255, 255))
+        frames.append(fr)
+    bio = io.BytesIO()
+    frames[0].save(bio, "GIF", save_all=True, append_images=frames[1:], duration=40, loop=0)
+    _save("anim_60f.gif", bio.getvalue())
+
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="800" height="600">']
+    for _ in range(200):
+        x, y, r = rnd.randint(0, 800), rnd.randint(0, 600), rnd.randint(5, 60)
+        color = "#%06x" % rnd.randint(0, 0xFFFFFF)
+        svg.append(f'<circle cx="{x}" cy="{y}" r="{r}" fill="{color}" fill-opacity="0.7"/>')
+    svg.append("</svg>")
+    _save("shapes.svg", "\n".join(svg).encode())
+
+    from ffmpeg_runner import FFMPEG_BIN
+
+    if FFMPEG_BIN:
+        src = "testsrc2=size=640x360:rate=30"
+        for name, codec in [("clip_4s.mp4", ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart"]),
+                            ("clip_4s.webm", ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-b:v", "500k"])]:
+            p = os.path.join(out_dir, name)
+            subprocess.run(
+                [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", src, "-t", "4", *codec, p],
+                check=True,
+            )
+            paths[name] = p
+
+    return paths
+
+
+# ---------------------------------------------------------------- casos
+
+# (nome, função, entrada, mime, iterações máximas)
+CASES = [
+    ("webp_jpeg_12mp", "convert_to_sticker_webp", "photo_12mp.jpg", "image/jpeg", None),
+    ("webp_png_transparent", "convert_to_sticker_webp", "transparent.png", "image/png", None),
+    ("webp_gif_first_frame", "convert_to_sticker_webp", "anim_60f.gif", "image/gif", None),
+    ("webp_svg", "convert_to_sticker_webp", "shapes.svg", "image/svg+xml", None),
+    ("webp_mp4_first_frame", "convert_to_sticker_webp", "clip_4s.mp4", "video/mp4", None),
+    ("webm_gif", "convert_to_animated_sticker_webm", "anim_60f.gif", "image/gif", 3),
+    ("webm_mp4", "convert_to_animated_sticker_webm", "clip_4s.mp4", "video/mp4", 3),
+    ("webm_webm", "convert_to_animated_sticker_webm", "clip_4s.webm", "video/webm", 3),
+    ("pil_from_svg", "pil_from_svg_bytes", "shapes.svg", None, None),
+    ("fit_canvas_12mp", "fit_to_sticker_canvas", "photo_12mp.jpg", None, None),
+    ("wrap_short", "_wrap_text", SHORT_QUOTE, None, None),
+    ("wrap_long", "_wrap_text", LONG_QUOTE, None, None),
+    ("quote_short", "make_quote_sticker", SHORT_QUOTE, None, None),
+    ("quote_long", "make_quote_sticker", LONG_QUOTE, None, None),
+]
+
+
+def _case_callable(func: str, source: str, mime: str | None, fixtures: dict[str, str]):
+    """devolve (fn sem argumentos que roda o caso, motivo_pra_pular | None)."""
+    import converter
+    import quote_maker
+    from PIL import Image, ImageDraw
+
+    if func in ("convert_to_sticker_webp", "convert_to_animated_sticker_webm", "pil_from_svg_bytes", "fit_to_sticker_canvas"):
+        if source not in fixtures:
+            return None, "ffmpeg não encontrado"
+        if source.endswith(".svg") and not converter.CAIRO_OK:
+            return None, "cairosvg indisponível"
+        if func == "convert_to_animated_sticker_webm" and not converter.FFMPEG_BIN:
+            return None, "ffmpeg não encontrado"
+        if func == "convert_to_sticker_webp" and mime.startswith("video/") and not (converter.FFMPEG_BIN or converter.CV2_OK):
+            return None, "sem ffmpeg/opencv"
+        with open(fixtures[source], "rb") as f:
+            data = f.read()
+
+    if func == "convert_to_sticker_webp":
+        return lambda: converter.convert_to_sticker_webp(data, mime, source), None
+    if func == "convert_to_animated_sticker_webm":
+        return lambda: converter.convert_to_animated_sticker_webm(data, mime, source), None
+    if func == "pil_from_svg_bytes":
+        return lambda: converter.pil_from_svg_bytes(data), None
+    if func == "fit_to_sticker_canvas":
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return lambda: converter.fit_to_sticker_canvas(img), None
+    if func == "_wrap_text":
+        draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+        font = quote_maker._load_font(34)
+        return lambda: quote_maker._wrap_text(draw, source, font, 282), None
+    if func == "make_quote_sticker":
+        return lambda: quote_maker.make_quote_sticker(source, author_name="Bench"), None
+    raise ValueError(func)
+
+
+def _proc_status_kb(field: str) -> int | None:
+    """VmRSS / VmHWM do /proc/self/status (só Linux)."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """zera o pico (VmHWM) pro RSS atual. ru_maxrss não serve: o filho herda o pico do pai."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb() -> int | None:
+    peak = _proc_status_kb("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS devolve bytes, Linux devolve KB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _output_size(result) -> int | None:
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, list):
+        return len(result)  # _wrap_text: nº de linhas
+    return None
+
+
+def _run_case(case: tuple, fixtures: dict[str, str], iterations: int, warmup: int, conn):
+    """roda dentro de um processo novo e manda o resultado pelo pipe."""
+    name, func, source, mime, max_iter = case
+    _reset_peak_rss()
+    try:
+        fn, skip = _case_callable(func, source, mime, fixtures)
+        if skip:
+            conn.send({"name": name, "skipped": skip})
+            return
+        # pico dos imports; depois zera de novo pra medir só o caso
+        setup_peak = _peak_rss_kb()
+        if _reset_peak_rss():
+            rss_before = _proc_status_kb("VmRSS")
+        else:
+            rss_before = setup_peak
+        result = None
+        for _ in range(warmup):
+            result = fn()
+        n = min(iterations, max_iter or iterations)
+        times = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            result = fn()
+            times.append((time.perf_counter() - t0) * 1000)
+        conn.send({
+            "name": name,
+            "function": func,
+            "iterations": n,
+            "ms": _summary(times),
+            "rss_before_kb": rss_before,
+            "peak_rss_kb": max(filter(None, (setup_peak, _peak_rss_kb())), default=None),
+            "case_peak_rss_kb": _peak_rss_kb(),
+            "output_size": _output_size(result),
+        })
+    except Exception as e:
+        conn.send({"name": name, "error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def _fixtures_child(out_dir: str, conn):
+    try:
+        conn.send(_make_fixtures(out_dir))
+    finally:
+        conn.close()
+
+
+def _build_fixtures(ctx, out_dir: str) -> dict[str, str]:
+    """gera as entradas num processo à parte: o pai fica pequeno e não infla o RSS dos casos."""
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_fixtures_child, args=(out_dir, child))
+    proc.start()
+    child.close()
+    try:
+        return parent.recv()
+    except EOFError:
+        raise RuntimeError("falhou ao gerar as entradas do benchmark") from None
+    finally:
+        proc.join()
+
+
+def _percentile(sorted_vals: list[float], p: float) -> float:
+    if len(sorted_vals) == 1:
+        return sorted_vals[0]
+    k = (len(sorted_vals) - 1) * p
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def _summary(times: list[float]) -> dict:
+    s = sorted(times)
+    return {
+        "min": round(s[0], 3),
+        "p50": round(_percentile(s, 0.50), 3),
+        "p90": round(_percentile(s, 0.90), 3),
+        "p99": round(_percentile(s, 0.99), 3),
+        "max": round(s[-1], 3),
+        "mean": round(statistics.fmean(s), 3),
+    }
+
+
+# ---------------------------------------------------------------- main
+
+def _compare(current: list[dict], baseline_path: str, threshold: float):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {c["name"]: c for c in json.load(f)["cases"] if "ms" in c}
+    print(f"\ncomparando com {baseline_path} (limite {threshold:.0%}):")
+    regressions = 0
+    for c in current:
+        old = baseline.get(c["name"])
+        if not old or "ms" not in c:
+            continue
+        ratio = c["ms"]["p50"] / old["ms"]["p50"] if old["ms"]["p50"] else 1.0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESSÃO"
+            regressions += 1
+        print(f"  {c['name']:<24} p50 {old['ms']['p50']:>9.2f} -> {c['ms']['p50']:>9.2f} ms ({ratio:>5.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="benchmark das conversões e da quote")
+    ap.add_argument("-n", "--iterations", type=int, default=10, help="rodadas por caso (vídeo usa no máx. 3)")
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("-k", "--filter", default="", help="só casos cujo nome contém isso")
+    ap.add_argument("-o", "--output", help="arquivo JSON de saída (padrão: benchmarks/results/<data>.json)")
+    ap.add_argument("--compare", help="JSON de uma rodada anterior pra comparar")
+    ap.add_argument("--threshold", type=float, default=0.20, help="piora de p50 considerada regressão (0.20 = 20%%)")
+    args = ap.parse_args(argv)
+
+    cases = [c for c in CASES if args.filter in c[0]]
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="dinasticker_bench_") as fixture_dir:
+        print("gerando entradas...")
+        fixtures = _build_fixtures(ctx, fixture_dir)
+
+        print(f"{'caso':<24} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'pico RSS MB':>12} {'+caso MB':>9} {'saída':>9}")
+        for case in cases:
+            parent, child = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_run_case, args=(case, fixtures, args.iterations, args.warmup, child))
+            proc.start()
+            child.close()
+            res = parent.recv() if parent.poll(None) else {"name": case[0], "error": "sem resposta"}
+            proc.join()
+            results.append(res)
+
+            if "skipped" in res:
+                print(f"{res['name']:<24} pulado: {res['skipped']}")
+            elif "error" in res:
+                print(f"{res['name']:<24} erro: {res['error']}")
+            else:
+                ms = res["ms"]
+                rss = delta = "-"
+                if res["peak_rss_kb"]:
+                    rss = f"{res['peak_rss_kb'] / 1024:.1f}"
+                    delta = f"{(res['case_peak_rss_kb'] - res['rss_before_kb']) / 1024:.1f}"
+                out = res["output_size"] if res["output_size"] is not None else "-"
+                print(f"{res['name']:<24} {ms['p50']:>9.2f} {ms['p90']:>9.2f} {ms['p99']:>9.2f} {rss:>12} {delta:>9} {out:>9}")
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "iterations": args.iterations,
+        "cases": results,
+    }
+    out_path = args.output
+    if not out_path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nresultado salvo em {out_path}")
+
+    if args.compare:
+        regressions = _compare(results, args.compare, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,13 @@
 import asyncio
 import io
+import json
 import os
-import sqlite3
 import time
-import subprocess
-import shutil
 from datetime import datetime, timezone
+from typing import NamedTuple
 
-from PIL import Image, ImageOps
 from dotenv import load_dotenv
 
-try:
-    import cairosvg
-    CAIRO_OK = True
-except Exception:
-    CAIRO_OK = False
-
-try:
-    import cv2
-    import numpy as np
-    CV2_OK = True
-except Exception:
-    CV2_OK = False
-
 from telegram import Update, InputFile
 from telegram.constants import ChatMemberStatus
 from telegram.ext import (
@@ -31,9 +16,38 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
     ChatMemberHandler,
+    MessageHandler,
+    filters,
 )
 
 from quote_maker import make_quote_sticker
+from converter import (
+    CAIRO_OK,
+    DATA_DIR,
+    STICKER_SIZE,
+    convert_to_sticker_webp,
+    convert_to_animated_sticker_webm_budgeted_async,
+    conversion_params,
+    remux_webm_without_audio_async,
+    WEBM_MAX_BYTES,
+)
+from ffmpeg_runner import FFmpegError
+from sticker_probe import passthrough_action
+from single_flight import SingleFlight
+from scheduler import FairScheduler, RateLimited
+from serve_config import ServeSettings, load_serve_settings, webhook_kwargs
+from storage import Storage
+import sticker_pack
+from sticker_pack import PackError, RecentMedia
+import scratch
+from scratch import SCRATCH, ScratchQuotaExceeded
+from sticker_cache import StickerCache
+from profile_cache import fetch_quote_profile
+import media_download
+from media_download import MediaTooLarge
+from executor import ConversionBusy, ConversionExecutor
+import metrics
+from metrics import stage
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__)) 
 load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"), override=True)
@@ -42,15 +56,16 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 ALLOWED_CHAT_ID = int(os.getenv("ALLOWED_CHAT_ID", "0"))
 
-# grupos permitidos afiliados ao dinastia
+# grupos permitidos afiliados ao dinastia: só a carga inicial da tabela allowed_chats;
+# depois disso a lista é mantida no banco (/permitir e /bloquear)
 ALLOWED_EXTRA_CHAT_IDS = {
-    -1003291183043,  # DINASTWOLF
-    -1003126092312,  # DINAST.I
-    -1003411843217,  # DINASTV
-    -1003115970654,  # DINASTMUSIC
-    -1002590261571,  # DINASTCINE
-    -1002965380104,  # D. HOTEL
-    -1002563751719,  # DINASTIA
+    -1003291183043: "DINASTWOLF",
+    -1003126092312: "DINAST.I",
+    -1003411843217: "DINASTV",
+    -1003115970654: "DINASTMUSIC",
+    -1002590261571: "DINASTCINE",
+    -1002965380104: "D. HOTEL",
+    -1002563751719: "DINASTIA",
 }
 
 # mapa de cores p/o comando /fig <cor>
@@ -84,105 +99,47 @@ COLOR_MAP = {
     "white":  "#f9fafb",
 }
 
-from pathlib import Path
+if not BOT_TOKEN:
+    raise RuntimeError("defina BOT_TOKEN no .env")
 
+DB_PATH = os.path.join(DATA_DIR, "groups.db")
 
-def _is_valid_ffmpeg(path_str: str) -> bool:
-    if not path_str:
-        return False
-    p = Path(path_str.strip().strip('"').strip("'"))
-    if os.path.sep not in str(p) and os.path.altsep not in str(p):
-        return shutil.which(str(p)) is not None
-    return p.is_file()
+# banco: grupos, file_id das figurinhas e chats permitidos
+STORAGE = Storage(DB_PATH, seed_chat_ids=ALLOWED_EXTRA_CHAT_IDS)
 
+# pool de processos das conversões (config via CONV_WORKERS / CONV_QUEUE_MAX / CONV_TIMEOUT)
+CONVERTER = ConversionExecutor.from_env()
 
-FFMPEG_BIN = os.getenv("FFMPEG_BIN", "").strip().strip('"')
+# cache das figurinhas prontas (memória + data/sticker_cache)
+STICKER_CACHE = StickerCache.from_env(os.path.join(DATA_DIR, "sticker_cache"))
 
-if FFMPEG_BIN and os.path.isfile(FFMPEG_BIN):
-    pass
-else:
-    FFMPEG_BIN = shutil.which("ffmpeg") or shutil.which("ffmpeg.exe") or FFMPEG_BIN
+# conversões de mídia em andamento, por (file_unique_id, opções)
+INFLIGHT = SingleFlight()
 
-if not FFMPEG_BIN and os.name == "nt":
-    try:
-        out = subprocess.check_output(
-            ["powershell", "-NoProfile", "-Command", "(Get-Command ffmpeg).Source"],
-            text=True
-        ).strip()
-        if out:
-            FFMPEG_BIN = out
-    except Exception:
-        pass
-
-if not FFMPEG_BIN:
-    try:
-        subprocess.run(["ffmpeg", "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-        FFMPEG_BIN = "ffmpeg"
-    except Exception:
-        pass
+# mídias recentes de cada chat (álbum / rajada pro /pack; PACK_* no .env)
+RECENT_MEDIA = RecentMedia()
 
-print("FFmpeg detectado:", FFMPEG_BIN or "NÃO ENCONTRADO")
+# fila justa por chat + limite de /fig por chat/usuário (SCHED_* / RATE_* no .env)
+SCHEDULER = FairScheduler.from_env(default_slots=CONVERTER.workers * 2)
 
-if not BOT_TOKEN:
-    raise RuntimeError("defina BOT_TOKEN no .env")
-
-def ensure_dir(path: str):
-    try:
-        os.makedirs(path, exist_ok=True)
-    except FileExistsError:
-        if os.path.isfile(path):
-            os.replace(path, path + ".bak")
-            os.makedirs(path, exist_ok=True)
-        else:
-            raise
-    return path
-
-DATA_DIR = ensure_dir(os.path.join(BASE_DIR, "data"))
-TMP_DIR  = ensure_dir(os.path.join(DATA_DIR, "stickers_tmp"))
-
-DB_PATH = os.path.join(DATA_DIR, "groups.db")
+metrics.gauge("dinasticker_conversion_pending", "conversões rodando + na fila", lambda: CONVERTER.pending)
+metrics.gauge("dinasticker_conversion_queued", "conversões esperando worker", lambda: CONVERTER.queued)
+metrics.gauge("dinasticker_sched_running", "figurinhas em andamento", lambda: SCHEDULER.running)
+metrics.gauge("dinasticker_sched_queued", "figurinhas na fila", lambda: SCHEDULER.queued)
+for _kind in ("quote", "static", "animated"):
+    metrics.gauge(
+        f"dinasticker_sched_queued_{_kind}",
+        f"na fila ({_kind})",
+        lambda k=_kind: SCHEDULER.queued_by_kind()[k],
+    )
+# uso do espaço temporário: lido do livro-caixa numa thread, uma vez por /stats ou /metrics
+metrics.collector(SCRATCH.refresh_usage)
+metrics.gauge("dinasticker_scratch_bytes", "bytes no espaço temporário das conversões", lambda: SCRATCH.last_usage[1])
+metrics.gauge("dinasticker_scratch_files", "arquivos no espaço temporário das conversões", lambda: SCRATCH.last_usage[0])
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS groups (
-            chat_id INTEGER PRIMARY KEY,
-            title TEXT,
-            chat_type TEXT,
-            joined_at TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-def upsert_group(chat_id: int, title: str, chat_type: str):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO groups (chat_id, title, chat_type, joined_at)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(chat_id) DO UPDATE SET
-            title=excluded.title,
-            chat_type=excluded.chat_type
-    """, (chat_id, title or "", chat_type or "", datetime.now(timezone.utc).isoformat()))
-    conn.commit()
-    conn.close()
-
-def delete_group(chat_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM groups WHERE chat_id = ?", (chat_id,))
-    conn.commit()
-    conn.close()
-
-def list_groups():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT chat_id, title, chat_type FROM groups ORDER BY title COLLATE NOCASE")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    """abre o banco (WAL, conexão única) e aplica as migrações pendentes."""
+    STORAGE.open()
 
 
 SUPPORTED_MIME = {
@@ -211,8 +168,8 @@ def is_allowed_chat(chat_id: int) -> bool:
     if chat_id == ALLOWED_CHAT_ID:
         return True
 
-    # GPS AFILIADOS
-    return chat_id in ALLOWED_EXTRA_CHAT_IDS
+    # GPS AFILIADOS (set em memória, recarregado se o banco mudar)
+    return STORAGE.is_allowed(chat_id)
 
 async def reply_only_in_allowed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """retorna True se pode responder; caso contrário, ignora."""
@@ -223,162 +180,69 @@ async def reply_only_in_allowed(update: Update, context: ContextTypes.DEFAULT_TY
         return True
     return False
 
-def pil_from_svg_bytes(svg_bytes: bytes) -> Image.Image:
-    """converte SVG -> PNG em memória e abre no Pillow."""
-    if not CAIRO_OK:
-        raise RuntimeError("SVG não habilitado. Instale cairosvg.")
-    png_bytes = cairosvg.svg2png(bytestring=svg_bytes)
-    return Image.open(io.BytesIO(png_bytes)).convert("RGBA")
-
-def fit_to_sticker_canvas(img: Image.Image, size: int = 512) -> Image.Image:
-    """redimensiona mantendo proporção e centraliza em canvas 512x512 transparente."""
-    img = img.convert("RGBA")
-    img.thumbnail((size, size), Image.LANCZOS)
-    canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-    x = (size - img.width) // 2
-    y = (size - img.height) // 2
-    canvas.paste(img, (x, y), img)
-    return canvas
-
-def convert_to_sticker_webp(input_bytes: bytes, mime_type: str, filename: str | None = None) -> bytes:
-    """converte bytes de imagem (ou 1º frame de vídeo/animation) em WebP 512x512."""
-    mime_type = (mime_type or "").lower()
-    ext = (os.path.splitext(filename or "")[1] or "").lower()
-
-    if mime_type == "image/svg+xml" or ext == ".svg":
-        img = pil_from_svg_bytes(input_bytes)
-
-    elif mime_type.startswith("video/") or ext in {".mp4", ".mov", ".mkv", ".webm"}:
-        if not CV2_OK:
-            raise RuntimeError("eu recebi uma animação (mp4), mas o suporte a vídeo nao ta habilitado. dica: instale opencv-python")
-        tmp_in = os.path.join(TMP_DIR, f"anim_{int(time.time()*1000)}{ext or '.mp4'}")
-        with open(tmp_in, "wb") as f:
-            f.write(input_bytes)
-        cap = cv2.VideoCapture(tmp_in)
-        ok, frame = cap.read()
-        cap.release()
-        try:
-            os.remove(tmp_in)
-        except Exception:
-            pass
-        if not ok or frame is None:
-            raise RuntimeError("eu nao consegui ler o primeiro frame da animação")
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
-        img = Image.fromarray(frame)
+class MediaRef(NamedTuple):
+    """mídia encontrada na mensagem, ainda sem baixar."""
+    file_id: str
+    file_unique_id: str
+    mime: str
+    name: str
+    file_size: int | None = None
 
-    else:
-        img = Image.open(io.BytesIO(input_bytes))
-        try:
-            if getattr(img, "is_animated", False):
-                img.seek(0)
-        except Exception:
-            pass
-        img = img.convert("RGBA")
-
-    sticker_img = fit_to_sticker_canvas(img, 512)
-    out = io.BytesIO()
-    sticker_img.save(out, format="WEBP", method=6, quality=95)
-    out.seek(0)
-    return out.read()
-
-def convert_to_animated_sticker_webm(
-    input_bytes: bytes,
-    mime_type: str,
-    filename: str | None = None,
-    *,
-    max_seconds: int = 3,
-    max_size: int = 512,
-    fps: int = 30,
-    bitrate: str = "300k"
-) -> bytes:
+def media_of(m) -> MediaRef | None:
     """
-    Converte GIF/MP4/WebM em figurinha animada (video sticker .webm VP9) 512x512, sem áudio, ~3s.
-    Requer FFmpeg no PATH. Se não houver, levanta erro amigável.
+    Mídia de uma mensagem (foto, documento suportado, GIF ou vídeo), sem baixar nada:
+    só os ids, o tipo e o tamanho (se o Telegram informar).
+    Em foto, pega o menor tamanho que ainda cobre a figurinha (512 px), não o maior.
     """
-    if not FFMPEG_BIN:
-        raise RuntimeError("FFmpeg não encontrado. Instale (winget/choco/scoop) ou defina FFMPEG_BIN no .env apontando para o ffmpeg.exe.")
-
-    mime_type = (mime_type or "").lower()
-    ext = (os.path.splitext(filename or "")[1] or "").lower()
-    if not ext:
-        ext = ".mp4" if mime_type.startswith("video/") else (".gif" if mime_type == "image/gif" else ".mp4")
-
-    ts = int(time.time() * 1000)
-    in_path  = os.path.join(TMP_DIR, f"in_{ts}{ext}")
-    out_path = os.path.join(TMP_DIR, f"sticker_{ts}.webm")
-    with open(in_path, "wb") as f:
-        f.write(input_bytes)
-
-    vf = f"scale={max_size}:{max_size}:force_original_aspect_ratio=decrease:flags=lanczos," \
-         f"pad={max_size}:{max_size}:(ow-iw)/2:(oh-ih)/2:color=0x00000000,fps={fps}"
-
-    ff = FFMPEG_BIN.replace("\\", "/")
-    inp = in_path.replace("\\", "/")
-    outp = out_path.replace("\\", "/")
-
-
-    cmd = [
-        ff, "-y", "-hide_banner", "-loglevel", "error",
-        "-i", inp,
-        "-t", str(max_seconds),
-        "-an",
-        "-vf", vf,
-        "-c:v", "libvpx-vp9",
-        "-pix_fmt", "yuva420p",
-        "-b:v", bitrate,
-        outp
-    ]
+    if m.photo:
+        photo = media_download.pick_photo_size(m.photo, STICKER_SIZE)
+        return MediaRef(photo.file_id, photo.file_unique_id, "image/jpeg", "photo.jpg", photo.file_size)
 
-    try:
-        subprocess.run(cmd, check=True)
-        with open(out_path, "rb") as f:
-            data = f.read()
-        return data
-    finally:
-        for p in (in_path, out_path):
-            try:
-                if os.path.exists(p) and p.endswith(".webm") is False:  # mantém o .webm se falhar antes de ler
-                    os.remove(p)
-            except Exception:
-                pass
+    if m.document and (m.document.mime_type in SUPPORTED_MIME or (m.document.file_name and os.path.splitext(m.document.file_name)[1].lower() in SUPPORTED_EXT)):
+        mime = m.document.mime_type or ""
+        name = m.document.file_name or "image"
+        return MediaRef(m.document.file_id, m.document.file_unique_id, mime, name, m.document.file_size)
+
+    if m.animation:
+        mime = getattr(m.animation, "mime_type", None) or "video/mp4"
+        name = getattr(m.animation, "file_name", None) or "animation.mp4"
+        return MediaRef(m.animation.file_id, m.animation.file_unique_id, mime, name, m.animation.file_size)
+
+    if m.video:
+        # vídeo de álbum chega como video (não document)
+        mime = m.video.mime_type or "video/mp4"
+        name = m.video.file_name or "video.mp4"
+        return MediaRef(m.video.file_id, m.video.file_unique_id, mime, name, m.video.file_size)
+
+    return None
 
-async def extract_media_bytes_and_meta(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def find_media(msg) -> MediaRef | None:
     """
     Procura imagem no comando (/fig) priorizando:
      1) mensagem respondida (reply)
      2) a própria mensagem do comando (se vier com arquivo)
-    Retorna (bytes, mime_type, filename) ou (None, None, None)
     """
-    bot = context.bot
-    msg = update.effective_message
-
     candidates = []
     if msg and msg.reply_to_message:
         candidates.append(msg.reply_to_message)
     candidates.append(msg)
 
     for m in candidates:
-        if m.photo:
-            photo = m.photo[-1] 
-            file = await bot.get_file(photo.file_id)
-            data = await file.download_as_bytearray()
-            return bytes(data), "image/jpeg", "photo.jpg"
-
-        if m.document and (m.document.mime_type in SUPPORTED_MIME or (m.document.file_name and os.path.splitext(m.document.file_name)[1].lower() in SUPPORTED_EXT)):
-            file = await bot.get_file(m.document.file_id)
-            data = await file.download_as_bytearray()
-            mime = m.document.mime_type or ""
-            name = m.document.file_name or "image"
-            return bytes(data), mime, name
-
-        if m.animation:
-            file = await bot.get_file(m.animation.file_id)
-            data = await file.download_as_bytearray()
-            mime = getattr(m.animation, "mime_type", None) or "video/mp4"
-            name = getattr(m.animation, "file_name", None) or "animation.mp4"
-            return bytes(data), mime, name
-
-    return None, None, None
+        media = media_of(m)
+        if media:
+            return media
+    return None
+
+def is_animated_media(media: MediaRef) -> bool:
+    """GIF/vídeo vira figurinha de vídeo (.webm); o resto, estática (.webp)."""
+    mime = (media.mime or "").lower()
+    ext = (os.path.splitext(media.name or "")[1] or "").lower()
+    return mime.startswith("video/") or ext in {".mp4", ".mov", ".mkv", ".webm"} or mime == "image/gif" or ext == ".gif"
+
+async def download_media(bot, media: MediaRef) -> bytearray:
+    """baixa a mídia com o limite do tipo (MediaTooLarge se passar, às vezes antes de baixar)."""
+    limit = media_download.max_bytes_for(media.mime, media.name)
+    return await media_download.download(bot, media.file_id, max_bytes=limit, file_size=media.file_size)
 
 def build_quote_from_chain(msg, max_depth: int, reply_mode: bool):
     """
@@ -439,6 +303,99 @@ async def ping_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = f"🏓 Pong!\n• processamento: {dt_ms:.1f} ms\n• entrega: {delivery_ms:.0f} ms"
     await update.effective_message.reply_text(text)
 
+class DownloadFailed(RuntimeError):
+    """falha ao baixar a mídia do Telegram (a mensagem de erro pro usuário é outra)."""
+
+async def admit_or_reply(update: Update, kind: str) -> bool:
+    """gasta uma ficha do chat/usuário; se acabou, responde e devolve False (dono não tem limite)."""
+    user = update.effective_user
+    if user and is_owner(user.id):
+        return True
+    try:
+        SCHEDULER.admit(update.effective_chat.id, user.id if user else None)
+        return True
+    except RateLimited as e:
+        metrics.CONVERSIONS.inc(type=kind, result="rate_limited")
+        await update.effective_message.reply_text(str(e))
+        return False
+
+async def build_media_sticker(bot, media: MediaRef, animated: bool) -> bytes:
+    """
+    Baixa a mídia e devolve os bytes da figurinha: passa direto se já for figurinha
+    válida, senão procura no cache e, por último, converte.
+    Roda uma vez por mídia+opções mesmo com vários /fig simultâneos (INFLIGHT).
+    """
+    kind = "animated" if animated else "static"
+    mime, name = media.mime, media.name
+    try:
+        with stage("download"):
+            data = await download_media(bot, media)
+    except MediaTooLarge:
+        raise
+    except Exception as e:
+        raise DownloadFailed(str(e)) from e
+
+    cache_key = StickerCache.make_key(data, conversion_params(animated))
+
+    # já é figurinha válida (WebP 512 / WebM VP9 curto)? manda sem reencodar
+    sticker_bytes = None
+    with stage("probe"):
+        action = passthrough_action(data, animated)
+    if action == "as_is":
+        sticker_bytes = data
+        metrics.CONVERSIONS.inc(type=kind, result="passthrough")
+    elif action == "remux":
+        try:
+            with stage("remux", exclude_waits=True):
+                remuxed = await remux_webm_without_audio_async(data)
+        except FFmpegError:
+            remuxed = b""
+        if remuxed and len(remuxed) <= WEBM_MAX_BYTES:
+            sticker_bytes = remuxed
+            metrics.CONVERSIONS.inc(type=kind, result="remux")
+
+    if sticker_bytes is None:
+        with stage("cache"):
+            sticker_bytes = await asyncio.to_thread(STICKER_CACHE.get, cache_key)
+        if sticker_bytes is not None:
+            metrics.CONVERSIONS.inc(type=kind, result="cache")
+    if sticker_bytes is None:
+        if animated:
+            # ffmpeg já roda fora do loop (asyncio subprocess com limite/timeout próprios);
+            # reencoda com bitrate/fps menores até caber nos 256 KB do Telegram
+            with stage("convert_animated", exclude_waits=True):
+                result = await convert_to_animated_sticker_webm_budgeted_async(data, mime, name)
+            if result.attempts > 1 or not result.fits:
+                print(
+                    f"webm: {len(result.data) // 1024} KB em {result.attempts} tentativa(s) "
+                    f"({result.bitrate}, {result.fps} fps, {result.seconds}s)"
+                    + ("" if result.fits else " — ainda acima do limite")
+                )
+            sticker_bytes = result.data
+        else:
+            # medida dentro do worker (a fila do pool vira a etapa queue_wait)
+            try:
+                sticker_bytes = await CONVERTER.run(metrics.staged("convert_static", convert_to_sticker_webp), data, mime, name)
+            except ScratchQuotaExceeded as e:
+                # recusa no worker: conta aqui, uma vez (os /fig que pegaram carona no INFLIGHT recebem a mesma)
+                SCRATCH.record_rejection(e)
+                raise
+        await asyncio.to_thread(STICKER_CACHE.put, cache_key, sticker_bytes)
+        metrics.CONVERSIONS.inc(type=kind, result="converted")
+    return sticker_bytes
+
+async def media_sticker(bot, chat_id: int, media: MediaRef, animated: bool) -> bytes:
+    """build_media_sticker pela fila justa do chat, juntando pedidos iguais simultâneos."""
+    kind = "animated" if animated else "static"
+    # vários /fig na mesma mídia ao mesmo tempo: um só download/conversão pra todos
+    flight_key = (media.file_unique_id, json.dumps(conversion_params(animated), sort_keys=True))
+    if INFLIGHT.running(flight_key):
+        metrics.CONVERSIONS.inc(type=kind, result="shared")
+    return await INFLIGHT.run(
+        flight_key,
+        lambda: SCHEDULER.run(chat_id, kind, lambda: build_media_sticker(bot, media, animated)),
+    )
+
 async def fig_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reply_only_in_allowed(update, context):
         return
@@ -465,37 +422,64 @@ async def fig_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if color_name:
         bg_hex = COLOR_MAP.get(color_name)
 
-    data, mime, name = await extract_media_bytes_and_meta(update, context)
+    media = find_media(msg)
 
-    if data:
-        if (mime or "").lower() == "image/svg+xml" and not CAIRO_OK:
+    if media:
+        if (media.mime or "").lower() == "image/svg+xml" and not CAIRO_OK:
             await msg.reply_text(
                 "recebi um SVG, mas a conversão de SVG está desabilitada. dica: instala `cairosvg` pra ativar"
             )
             return
 
-        ext = (os.path.splitext(name or "")[1] or "").lower()
-        is_video_like = (mime or "").lower().startswith("video/") or ext in {".mp4", ".mov", ".mkv", ".webm"}
-        is_gif = (mime or "").lower() == "image/gif" or ext == ".gif"
+        animated = is_animated_media(media)
+        kind = "animated" if animated else "static"
+        options = json.dumps(conversion_params(animated), sort_keys=True)
+
+        # já convertemos essa mídia antes? reenvia o sticker pelo file_id (sem download/conversão/upload)
+        known_file_id = await STORAGE.get_sticker_file_id(media.file_unique_id, options)
+        if known_file_id:
+            try:
+                with stage("upload"):
+                    await msg.reply_sticker(sticker=known_file_id)
+                metrics.CONVERSIONS.inc(type=kind, result="file_id")
+                return
+            except Exception:
+                await STORAGE.delete_sticker_file_id(media.file_unique_id, options)
+
+        # reenvio pelo file_id é de graça; ficha só quando vai baixar/converter
+        if not await admit_or_reply(update, kind):
+            return
 
         try:
-            if is_video_like or is_gif:
-                sticker_bytes = convert_to_animated_sticker_webm(data, mime, name)
-                bio = io.BytesIO(sticker_bytes)
-                bio.name = "sticker.webm"
-            else:
-                sticker_bytes = convert_to_sticker_webp(data, mime, name)
-                bio = io.BytesIO(sticker_bytes)
-                bio.name = "sticker.webp"
+            sticker_bytes = await media_sticker(context.bot, msg.chat_id, media, animated)
+            bio = io.BytesIO(sticker_bytes)
+            bio.name = "sticker.webm" if animated else "sticker.webp"
+        except MediaTooLarge as e:
+            metrics.CONVERSIONS.inc(type=kind, result="too_large")
+            await msg.reply_text(str(e))
+            return
+        except DownloadFailed as e:
+            metrics.CONVERSIONS.inc(type=kind, result="error")
+            await msg.reply_text(f"eu não consegui baixar esse arquivo. motivo: {e}")
+            return
+        except (ConversionBusy, ScratchQuotaExceeded) as e:
+            metrics.CONVERSIONS.inc(type=kind, result="busy")
+            await msg.reply_text(str(e))
+            return
         except Exception as e:
+            metrics.CONVERSIONS.inc(type=kind, result="error")
             await msg.reply_text(f"eu não consegui converter essa imagem em fig. motivo: {e}")
             return
 
         try:
-            await msg.reply_sticker(sticker=InputFile(bio))
+            with stage("upload"):
+                sent = await msg.reply_sticker(sticker=InputFile(bio))
+            if sent and sent.sticker:
+                await STORAGE.save_sticker_file_id(media.file_unique_id, options, sent.sticker.file_id)
         except Exception as e:
             try:
                 bio.seek(0)
+                metrics.PHOTO_FALLBACKS.inc()
                 await msg.reply_photo(
                     photo=InputFile(bio),
                     caption="enviei como imagem porque o Telegram não permitiu a conversão pra fig."
@@ -513,79 +497,176 @@ async def fig_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # tenta pegar avatar + emoji de status premium
+    if not await admit_or_reply(update, "quote"):
+        return
+
+    # mensagem “principal” da quote (a que você está respondendo; se não tiver, usa a sua)
+    base_msg = msg.reply_to_message if msg.reply_to_message else msg
+    user = base_msg.from_user
+
+    # avatar + emoji de status premium, buscados em paralelo e com prazo
     avatar_img = None
     badge_img = None
-    try:
-        # mensagem “principal” da quote (a que você está respondendo; se não tiver, usa a sua)
-        base_msg = msg.reply_to_message if msg.reply_to_message else msg
-        user = base_msg.from_user
-
-        if user:
-            # nome base (pra garantir que venha igual o do Telegram)
-            display_name = user.first_name or ""
-            if user.last_name:
-                display_name += f" {user.last_name}"
-            # se o build_quote não definiu autor, usa o nome completo
-            if not author_name:
-                author_name = display_name
-
-            status_emoji = ""
-
-            # tenta descobrir o emoji de status premium (custom emoji) como IMAGEM
-            try:
-                chat_info = await context.bot.get_chat(user.id)
-                emoji_id = getattr(chat_info, "emoji_status_custom_emoji_id", None)
-                if emoji_id:
-                    stickers = await context.bot.get_custom_emoji_stickers([emoji_id])
-                    if stickers:
-                        st = stickers[0]
-                        f = await context.bot.get_file(st.file_id)
-                        badge_bytes = await f.download_as_bytearray()
-                        badge_img = Image.open(io.BytesIO(badge_bytes)).convert("RGBA")
-            except Exception:
-                badge_img = None
-
-            if getattr(user, "is_premium", False) and badge_img is None:
-                if author_name:
-                    author_name = f"{author_name} 💎"
-                else:
-                    author_name = "💎"
-
-            # baixa a foto de perfil (se tiver)
-            photos = await context.bot.get_user_profile_photos(user.id, limit=1)
-            if photos.total_count > 0:
-                first_photo_sizes = photos.photos[0]
-                best_photo = first_photo_sizes[-1]
-                file = await context.bot.get_file(best_photo.file_id)
-                photo_bytes = await file.download_as_bytearray()
-                avatar_img = Image.open(io.BytesIO(photo_bytes)).convert("RGBA")
-    except Exception:
-        # se qualquer coisa der errado, só segue sem avatar
-        avatar_img = None
-        badge_img = None
+    if user:
+        # nome base (pra garantir que venha igual o do Telegram)
+        display_name = user.first_name or ""
+        if user.last_name:
+            display_name += f" {user.last_name}"
+        # se o build_quote não definiu autor, usa o nome completo
+        if not author_name:
+            author_name = display_name
+
+        with stage("profile"):
+            avatar_img, badge_img = await fetch_quote_profile(context.bot, user.id)
+
+        if getattr(user, "is_premium", False) and badge_img is None:
+            if author_name:
+                author_name = f"{author_name} 💎"
+            else:
+                author_name = "💎"
 
     try:
-        sticker_bytes = make_quote_sticker(
+        # convert_quote é medida no worker; fila do scheduler e do pool ficam em sched_wait/queue_wait
+        sticker_bytes = await SCHEDULER.run(msg.chat_id, "quote", lambda: CONVERTER.run(
+            metrics.staged("convert_quote", make_quote_sticker),
             text=quote_text,
             author_name=author_name,
             avatar_img=avatar_img,
             badge_img=badge_img,
             theme="dark",
             bg_hex=bg_hex,
-        )
+        ))
         bio = io.BytesIO(sticker_bytes)
         bio.name = "quote.webp"
-        await msg.reply_sticker(sticker=InputFile(bio))
+        with stage("upload"):
+            await msg.reply_sticker(sticker=InputFile(bio))
+        metrics.CONVERSIONS.inc(type="quote", result="converted")
+    except ConversionBusy as e:
+        metrics.CONVERSIONS.inc(type="quote", result="busy")
+        await msg.reply_text(str(e))
     except Exception as e:
+        metrics.CONVERSIONS.inc(type="quote", result="error")
         await msg.reply_text(f"não consegui gerar a fig de quote: {e}")
 
+async def remember_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """guarda as mídias que passam pelo chat (o /pack acha o álbum inteiro por aqui)."""
+    msg = update.effective_message
+    chat = update.effective_chat
+    if not msg or not chat or not is_allowed_chat(chat.id):
+        return
+    media = media_of(msg)
+    if media:
+        user = update.effective_user
+        RECENT_MEDIA.add(
+            chat.id, msg.message_id, user.id if user else None,
+            msg.date.timestamp(), msg.media_group_id, media,
+        )
+
+def pack_items(target) -> list[MediaRef]:
+    """
+    Mídias do /pack: o álbum da mensagem respondida, senão a rajada de mídias
+    do mesmo usuário em volta dela, senão só ela (quando o bot não viu as outras).
+    """
+    chat_id = target.chat_id
+    items = []
+    if target.media_group_id:
+        items = RECENT_MEDIA.album(chat_id, target.media_group_id)
+    if not items:
+        items = RECENT_MEDIA.burst(chat_id, target.message_id)
+    if not items:
+        media = media_of(target)
+        items = [media] if media else []
+    if not CAIRO_OK:
+        items = [m for m in items if (m.mime or "").lower() != "image/svg+xml"]
+    return items[:sticker_pack.PACK_MAX_ITEMS]
+
+async def pack_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await reply_only_in_allowed(update, context):
+        return
+
+    msg = update.effective_message
+    user = update.effective_user
+    target = msg.reply_to_message
+    if not user or not target:
+        await msg.reply_text(
+            "Uso: responda a um álbum (ou a uma de várias mídias seguidas) com /pack [título do pacote]"
+        )
+        return
+
+    items = pack_items(target)
+    if not items:
+        await msg.reply_text("não achei imagem/gif/vídeo nessa mensagem pra montar o pacote")
+        return
+    if not await admit_or_reply(update, "pack"):
+        return
+
+    try:
+        name = sticker_pack.pack_name(user.id, context.bot.username)
+    except PackError as e:
+        await msg.reply_text(str(e))
+        return
+    title = sticker_pack.pack_title(" ".join(context.args or []), f"Figurinhas de {user.first_name}")
+    status = await msg.reply_text(f"montando o pacote com {len(items)} figurinha(s)...")
+
+    last_edit = 0.0
+
+    async def progress(done: int, total: int):
+        nonlocal last_edit
+        now = time.monotonic()
+        if done == total or now - last_edit < 3:
+            return
+        last_edit = now
+        try:
+            await status.edit_text(f"montando o pacote: {done}/{total}...")
+        except Exception:
+            pass
+
+    # a primeira ficha já foi paga no admit_or_reply; cada item seguinte paga a
+    # sua (esperando a ficha, em vez de furar o limite de /fig do usuário)
+    charged = [not is_owner(user.id)]
+
+    async def convert(media: MediaRef) -> tuple[bytes, bool]:
+        if charged[0]:
+            charged[0] = False
+        elif not is_owner(user.id):
+            await SCHEDULER.acquire(msg.chat_id, user.id, sticker_pack.PACK_RATE_MAX_WAIT)
+        animated = is_animated_media(media)
+        return await media_sticker(context.bot, msg.chat_id, media, animated), animated
+
+    try:
+        with stage("pack"):
+            result = await sticker_pack.build_pack(
+                context.bot, user.id, name, title, items, convert, on_progress=progress,
+            )
+    except PackError as e:
+        metrics.CONVERSIONS.inc(type="pack", result="error")
+        await status.edit_text(f"não consegui montar o pacote: {e}")
+        return
+    except Exception as e:
+        metrics.CONVERSIONS.inc(type="pack", result="error")
+        await status.edit_text(f"deu erro montando o pacote: {e}")
+        return
+
+    metrics.CONVERSIONS.inc(type="pack", result="converted" if result.added else "error")
+    lines = [
+        f"{'criei o pacote' if result.created else 'adicionei ao pacote'}: "
+        f"{result.added} figurinha(s), {result.total} no total",
+        f"https://t.me/addstickers/{result.name}",
+    ]
+    if result.skipped:
+        lines.append(f"{result.skipped} ficaram de fora (limite de {sticker_pack.PACK_MAX_STICKERS} por pacote)")
+    for pos, reason in result.failed[:5]:
+        lines.append(f"• item {pos}: {reason}")
+    if len(result.failed) > 5:
+        lines.append(f"• e mais {len(result.failed) - 5} com erro")
+    await status.edit_text("\n".join(lines))
+
 async def vergrupos_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not user or not is_owner(user.id):
         return  
 
-    rows = list_groups()
+    rows = await STORAGE.list_groups()
     if not rows:
         await update.effective_message.reply_text("ainda não estou em nenhum grupo.")
         return
@@ -595,6 +676,38 @@ async def vergrupos_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parts.append(f"\nNome: {title or '(sem título)'}\nID: {chat_id}\nTipo: {chat_type}")
     await update.effective_message.reply_text("\n".join(parts))
 
+async def cache_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or not is_owner(user.id):
+        return
+
+    st = STICKER_CACHE.stats()
+    text = (
+        "Cache de figurinhas\n"
+        f"• hits: {st['hits_mem']} memória / {st['hits_disk']} disco\n"
+        f"• misses: {st['misses']} (taxa de acerto {st['hit_rate'] * 100:.1f}%)\n"
+        f"• memória: {st['mem_items']} itens, {st['mem_bytes'] / 1024 / 1024:.1f} MB\n"
+        f"• disco: {st['disk_items']} itens, {st['disk_bytes'] / 1024 / 1024:.1f} MB\n"
+        f"• despejos: {st['evictions']}"
+    )
+    sc = await asyncio.to_thread(SCRATCH.stats)
+    text += (
+        "\n\nEspaço temporário\n"
+        f"• pasta: {sc['root']} ({'RAM' if sc['in_ram'] else 'disco'})\n"
+        f"• agora: {sc['files']} arquivos, {sc['bytes'] / 1024 / 1024:.1f} MB"
+        f" de {sc['quota_bytes'] / 1024 / 1024:.0f} MB\n"
+        f"• sobras apagadas: {sc['swept']} / recusas por cota: {sc['quota_rejections']}"
+    )
+    await update.effective_message.reply_text(text)
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or not is_owner(user.id):
+        return
+
+    await metrics.collect()
+    await update.effective_message.reply_text(metrics.stats_text())
+
 async def sair_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not user or not is_owner(user.id):
@@ -614,13 +727,58 @@ async def sair_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         ok = await context.bot.leave_chat(target_id)
         if ok:
-            delete_group(target_id)
+            await STORAGE.delete_group(target_id)
             await update.effective_message.reply_text(f"saí do grupo {target_id}.")
         else:
             await update.effective_message.reply_text(f"eu não consegui sair do grupo {target_id}.")
     except Exception as e:
         await update.effective_message.reply_text(f"erro ao sair do grupo {target_id}: {e}")
 
+def _target_chat(update: Update, args: list[str]) -> tuple[int | None, str]:
+    """id do chat alvo dos comandos /permitir e /bloquear: o do argumento ou, sem argumento num grupo, o próprio grupo."""
+    chat = update.effective_chat
+    if args:
+        try:
+            return int(args[0]), " ".join(args[1:])
+        except ValueError:
+            return None, ""
+    if chat and chat.type != "private":
+        return chat.id, chat.title or ""
+    return None, ""
+
+async def permitir_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or not is_owner(user.id):
+        return
+
+    args = context.args or []
+    chat_id, note = _target_chat(update, args)
+    if chat_id is None:
+        rows = await STORAGE.list_allowed()
+        parts = ["Uso: /permitir id_do_grupo [nome] (ou /permitir dentro do grupo)", f"\nPermitidos: {len(rows)}"]
+        for cid, cnote in rows:
+            parts.append(f"• {cnote or '(sem nome)'}: {cid}")
+        await update.effective_message.reply_text("\n".join(parts))
+        return
+
+    await STORAGE.allow_chat(chat_id, note, added_by=user.id)
+    await update.effective_message.reply_text(f"pronto, o chat {chat_id} agora pode usar o bot.")
+
+async def bloquear_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or not is_owner(user.id):
+        return
+
+    chat_id, _ = _target_chat(update, context.args or [])
+    if chat_id is None:
+        await update.effective_message.reply_text("Uso: /bloquear id_do_grupo (ou /bloquear dentro do grupo)")
+        return
+
+    if await STORAGE.block_chat(chat_id):
+        await update.effective_message.reply_text(f"o chat {chat_id} não pode mais usar o bot.")
+    else:
+        await update.effective_message.reply_text(f"o chat {chat_id} não estava na lista.")
+
 async def my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """atualiza DB quando o bot entra/sai de grupos."""
     chat = update.effective_chat
@@ -631,24 +789,78 @@ async def my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_type = chat.type or ""
 
     if new_status in (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR):
-        upsert_group(chat.id, title, chat_type)
+        await STORAGE.upsert_group(chat.id, title, chat_type)
     elif new_status in (ChatMemberStatus.LEFT, ChatMemberStatus.KICKED):
-        delete_group(chat.id)
-
-def main():
-    init_db()
-    app: Application = ApplicationBuilder().token(BOT_TOKEN).build()
+        await STORAGE.delete_group(chat.id)
+
+METRICS_SERVER = None
+JANITOR_TASK = None
+
+async def post_init(app: Application):
+    global METRICS_SERVER, JANITOR_TASK
+    CONVERTER.start()
+    # faxina do espaço temporário (sobras de job que morreu no meio)
+    JANITOR_TASK = asyncio.create_task(scratch.janitor(SCRATCH))
+    # recarrega a lista de chats permitidos se o banco mudar por fora
+    await STORAGE.start()
+    # endpoint /metrics (formato Prometheus) só se METRICS_PORT estiver no .env
+    METRICS_SERVER = await metrics.start_http_server()
+
+async def post_shutdown(app: Application):
+    if JANITOR_TASK is not None:
+        JANITOR_TASK.cancel()
+    CONVERTER.shutdown()
+    await media_download.close()
+    await STORAGE.close()
+    if METRICS_SERVER is not None:
+        METRICS_SERVER.close()
+        await METRICS_SERVER.wait_closed()
+
+def build_application(token: str, settings: ServeSettings) -> Application:
+    """monta o Application com os handlers (sem iniciar; main() escolhe polling ou webhook)."""
+    app: Application = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(settings.concurrent_updates)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start_cmd))
     app.add_handler(CommandHandler("ping", ping_cmd))
     app.add_handler(CommandHandler("fig", fig_cmd))
+    app.add_handler(CommandHandler("pack", pack_cmd))
     app.add_handler(CommandHandler("vergrupos", vergrupos_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
     app.add_handler(CommandHandler("sair", sair_cmd))
+    app.add_handler(CommandHandler("permitir", permitir_cmd))
+    app.add_handler(CommandHandler("bloquear", bloquear_cmd))
+    app.add_handler(CommandHandler("cache", cache_cmd))
 
     app.add_handler(ChatMemberHandler(my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
+    # grupo à parte: roda junto com os comandos, só anota as mídias pro /pack
+    app.add_handler(
+        MessageHandler(filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.Document.ALL, remember_media),
+        group=-1,
+    )
+    return app
 
-    print("Bot rodando... Ctrl+C para parar.")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+def main():
+    init_db()
+    settings = load_serve_settings()
+    app = build_application(BOT_TOKEN, settings)
+
+    if settings.webhook:
+        print(f"Bot rodando via webhook em {settings.listen}:{settings.port}/{settings.url_path} "
+              f"({settings.concurrent_updates} updates simultâneos)... Ctrl+C para parar.")
+        app.run_webhook(**webhook_kwargs(settings))
+    else:
+        print(f"Bot rodando ({settings.concurrent_updates} updates simultâneos)... Ctrl+C para parar.")
+        app.run_polling(
+            allowed_updates=list(settings.allowed_updates),
+            drop_pending_updates=settings.drop_pending_updates,
+        )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,544 @@
+import asyncio
+import importlib.util
+import io
+import os
+import time
+from typing import NamedTuple
+
+from PIL import Image
+from dotenv import load_dotenv
+
+try:
+    import cairosvg
+    CAIRO_OK = True
+except Exception:
+    CAIRO_OK = False
+
+# opencv só é usado se não tiver ffmpeg (e só é importado nessa hora: pesa ~200 MB)
+CV2_OK = importlib.util.find_spec("cv2") is not None
+
+from metrics import stage
+from webp_encoder import WEBP_MAX_BYTES, encode_webp
+from ffmpeg_runner import FFMPEG_BIN, FFMPEG_TIMEOUT, FFmpegError, require_ffmpeg, run_ffmpeg, run_ffmpeg_sync
+from scratch import SCRATCH, ScratchJob
+
+# funções de conversão separadas do bot.py: os workers do pool de conversão
+# importam só este módulo (sem precisar de BOT_TOKEN nem do telegram)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"), override=True)
+
+def ensure_dir(path: str):
+    try:
+        os.makedirs(path, exist_ok=True)
+    except FileExistsError:
+        if os.path.isfile(path):
+            os.replace(path, path + ".bak")
+            os.makedirs(path, exist_ok=True)
+        else:
+            raise
+    return path
+
+DATA_DIR = ensure_dir(os.path.join(BASE_DIR, "data"))
+
+# parâmetros padrão de encode (também entram na chave do cache de figurinhas)
+STICKER_SIZE = 512
+# versão da escolha de perfil do webp_encoder (muda a chave do cache se mudar)
+WEBP_ENCODER = "adaptive-1"
+WEBM_SECONDS = 3
+WEBM_FPS = 30
+WEBM_BITRATE = "300k"
+WEBM_CODEC = "libvpx-vp9"
+WEBM_PIX_FMT = "yuva420p"
+# limite do Telegram pra figurinha de vídeo
+WEBM_MAX_BYTES = 256 * 1024
+# no máximo quantos encodes pra caber no limite
+WEBM_MAX_ATTEMPTS = 4
+# tempo total (s) da escada de encodes; cada tentativa só ganha o que sobrou
+WEBM_BUDGET_SECONDS = float(os.getenv("WEBM_BUDGET_SECONDS", "45"))
+# frame do vídeo usado na figurinha estática: "first" (o 1º) ou "thumb" (o mais
+# representativo dos primeiros VIDEO_THUMB_FRAMES, evita o frame 0 preto de fade-in)
+VIDEO_FRAME = os.getenv("VIDEO_FRAME", "first").strip().lower()
+VIDEO_THUMB_FRAMES = int(os.getenv("VIDEO_THUMB_FRAMES", "30"))
+# orçamento de pixels do decode de imagem (depois da redução do JPEG); acima disso recusa sem decodificar
+MAX_IMAGE_PIXELS = int(float(os.getenv("MAX_IMAGE_MPIXELS", "25")) * 1_000_000)
+# modos que o resize do Pillow reduz com filtro de verdade (P/1 caem pro NEAREST)
+RESIZE_MODES = {"RGB", "RGBA", "L", "LA"}
+
+def conversion_params(animated: bool) -> dict:
+    """parâmetros que definem o resultado de uma conversão (pra chave do cache)."""
+    if animated:
+        return {
+            "kind": "webm",
+            "max_seconds": WEBM_SECONDS,
+            "max_size": STICKER_SIZE,
+            "fps": WEBM_FPS,
+            "bitrate": WEBM_BITRATE,
+            "codec": WEBM_CODEC,
+            "pix_fmt": WEBM_PIX_FMT,
+            "max_bytes": WEBM_MAX_BYTES,
+        }
+    return {
+        "kind": "webp",
+        "size": STICKER_SIZE,
+        "encoder": WEBP_ENCODER,
+        "max_bytes": WEBP_MAX_BYTES,
+        "frame": VIDEO_FRAME,
+    }
+
+def pil_from_svg_bytes(svg_bytes: bytes) -> Image.Image:
+    """converte SVG -> PNG em memória e abre no Pillow."""
+    if not CAIRO_OK:
+        raise RuntimeError("SVG não habilitado. Instale cairosvg.")
+    png_bytes = cairosvg.svg2png(bytestring=svg_bytes)
+    return Image.open(io.BytesIO(png_bytes)).convert("RGBA")
+
+def _fit_size(wh: tuple[int, int], size: int) -> tuple[int, int]:
+    """tamanho que cabe em size x size mantendo a proporção (nunca amplia)."""
+    w, h = wh
+    scale = min(size / w, size / h)
+    if scale >= 1:
+        return w, h
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+def _open_image(input_bytes: bytes, size: int) -> Image.Image:
+    """
+    Abre a imagem pro tamanho da figurinha sem decodificar em resolução cheia quando dá.
+
+    JPEG: o draft faz o decoder entregar direto em 1/2, 1/4 ou 1/8 (ainda >= 2x o
+    tamanho final). Depois confere o orçamento de pixels antes do decode de fato.
+    """
+    try:
+        img = Image.open(io.BytesIO(input_bytes))
+    except Image.DecompressionBombError:
+        raise ValueError("essa imagem tem pixels demais pra virar figurinha") from None
+    try:
+        if getattr(img, "is_animated", False):
+            img.seek(0)
+    except Exception:
+        pass
+
+    tw, th = _fit_size(img.size, size)
+    img.draft(None, (tw * 2, th * 2))
+    if img.width * img.height > MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"essa imagem é grande demais ({img.width}x{img.height}, limite de {MAX_IMAGE_PIXELS / 1e6:g} MP)"
+        )
+    img.load()
+    return img
+
+def fit_to_sticker_canvas(img: Image.Image, size: int = 512) -> Image.Image:
+    """
+    Redimensiona mantendo proporção e centraliza em canvas 512x512 transparente.
+    Reduz no modo original (reduce + LANCZOS) e só converte pra RGBA já pequena.
+    """
+    if img.mode not in RESIZE_MODES:
+        img = img.convert("RGBA")
+    target = _fit_size(img.size, size)
+    if target != img.size:
+        img.draft(None, (target[0] * 2, target[1] * 2))
+        img = img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+    img = img.convert("RGBA")
+    canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    x = (size - img.width) // 2
+    y = (size - img.height) // 2
+    canvas.paste(img, (x, y), img)
+    return canvas
+
+def convert_to_sticker_webp(input_bytes: bytes, mime_type: str, filename: str | None = None) -> bytes:
+    """converte bytes de imagem (ou 1º frame de vídeo/animation) em WebP 512x512."""
+    mime_type = (mime_type or "").lower()
+    ext = (os.path.splitext(filename or "")[1] or "").lower()
+
+    with stage("decode"):
+        if mime_type == "image/svg+xml" or ext == ".svg":
+            img = pil_from_svg_bytes(input_bytes)
+
+        elif mime_type.startswith("video/") or ext in {".mp4", ".mov", ".mkv", ".webm"}:
+            img = extract_frame(input_bytes, mime_type, filename)
+
+        else:
+            img = _open_image(input_bytes, STICKER_SIZE)
+
+    with stage("resize"):
+        sticker_img = fit_to_sticker_canvas(img, STICKER_SIZE)
+    # perfil (sem perdas / chapado / foto) escolhido pela imagem, respeitando os 512 KB
+    return encode_webp(sticker_img)
+
+# containers que o ffmpeg só lê direito com seek (índice/moov no fim do arquivo)
+SEEK_CONTAINERS = {".mp4", ".mov", ".m4v", ".3gp", ".avi"}
+
+def _mp4_is_streamable(data: bytes) -> bool:
+    """True se o 'moov' vem antes do 'mdat' (faststart): aí dá pra ler do stdin sem seek."""
+    pos = 0
+    n = len(data)
+    while pos + 8 <= n:
+        size = int.from_bytes(data[pos:pos + 4], "big")
+        box = data[pos + 4:pos + 8]
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        if size == 1:
+            if pos + 16 > n:
+                return False
+            size = int.from_bytes(data[pos + 8:pos + 16], "big")
+        if size < 8:
+            return False
+        pos += size
+    return False
+
+def needs_seekable_input(input_bytes: bytes, mime_type: str, filename: str | None = None) -> bool:
+    """decide se a entrada precisa ir pra arquivo temporário (em vez de stdin)."""
+    mime_type = (mime_type or "").lower()
+    ext = (os.path.splitext(filename or "")[1] or "").lower()
+    if input_bytes[4:8] == b"ftyp":
+        return not _mp4_is_streamable(input_bytes)
+    if ext in SEEK_CONTAINERS or mime_type in {"video/mp4", "video/quicktime", "video/x-msvideo"}:
+        return True
+    return False
+
+def _ffmpeg_input(job: ScratchJob, input_bytes: bytes, mime_type: str, filename: str | None, ext: str):
+    """
+    Entrada do ffmpeg: "pipe:0" + bytes pro stdin, ou (se o container precisar de
+    seek) o arquivo na pasta do job, gravado uma vez só por job. devolve (entrada, stdin_bytes).
+    """
+    if not needs_seekable_input(input_bytes, mime_type, filename):
+        return "pipe:0", input_bytes
+    in_path = job.path("input" + ext)
+    if not os.path.exists(in_path):
+        job.write("input" + ext, input_bytes)
+    return in_path.replace("\\", "/"), None
+
+def _frame_with_cv2(input_bytes: bytes, ext: str) -> Image.Image:
+    """caminho antigo (sem ffmpeg): grava o vídeo e lê o 1º frame com o opencv."""
+    import cv2
+
+    with SCRATCH.job() as job:
+        cap = cv2.VideoCapture(job.write("input" + (ext or ".mp4"), input_bytes))
+        ok, frame = cap.read()
+        cap.release()
+    if not ok or frame is None:
+        raise RuntimeError("eu nao consegui ler o primeiro frame da animação")
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA))
+
+def extract_frame(
+    input_bytes: bytes,
+    mime_type: str,
+    filename: str | None = None,
+    *,
+    pick: str = VIDEO_FRAME,
+    max_size: int = STICKER_SIZE,
+) -> Image.Image:
+    """
+    Tira um frame do vídeo direto da memória: ffmpeg lendo do stdin e devolvendo
+    um PNG (já reduzido pra caber em max_size) pelo stdout, com -frames:v 1.
+
+    pick="first": o 1º frame; pick="thumb": o filtro thumbnail escolhe o frame
+    mais representativo dos primeiros VIDEO_THUMB_FRAMES.
+    Sem ffmpeg, cai pro opencv (se estiver instalado).
+    """
+    ext = (os.path.splitext(filename or "")[1] or "").lower()
+    if not FFMPEG_BIN:
+        if CV2_OK:
+            return _frame_with_cv2(input_bytes, ext)
+        raise RuntimeError("eu recebi um vídeo, mas não tenho ffmpeg (nem opencv) pra ler o frame")
+
+    # reduz antes do thumbnail (ele guarda os N frames na memória)
+    vf = f"scale='min(iw,{max_size})':'min(ih,{max_size})':force_original_aspect_ratio=decrease:flags=lanczos"
+    if pick == "thumb":
+        vf += f",thumbnail=n={VIDEO_THUMB_FRAMES}"
+    with SCRATCH.job() as job:
+        inp, stdin_bytes = _ffmpeg_input(job, input_bytes, mime_type, filename, ext or ".mp4")
+        args = [
+            "-hide_banner", "-loglevel", "error",
+            "-i", inp,
+            "-an", "-vf", vf,
+            "-frames:v", "1",
+            "-f", "image2pipe", "-c:v", "png", "-compression_level", "0",
+            "pipe:1",
+        ]
+        png = run_ffmpeg_sync(args, input_bytes=stdin_bytes)
+    if not png:
+        raise RuntimeError("eu nao consegui ler o primeiro frame da animação")
+    img = Image.open(io.BytesIO(png))
+    img.load()
+    return img
+
+def _webm_job(
+    job: ScratchJob,
+    input_bytes: bytes,
+    mime_type: str,
+    filename: str | None,
+    *,
+    pipe: bool,
+    max_seconds: int,
+    max_size: int,
+    fps: int,
+    bitrate: str,
+    maxrate: str | None = None,
+):
+    """
+    Monta o job do ffmpeg. devolve (args, stdin_bytes, out_path).
+
+    pipe=True: entrada pelo stdin e WebM saindo pelo stdout; só grava a entrada
+    em arquivo (na pasta do job) se o container precisar de seek (mp4/mov sem faststart etc).
+    pipe=False: modo antigo, entrada e saída em arquivos na pasta do job.
+    """
+    mime_type = (mime_type or "").lower()
+    ext = (os.path.splitext(filename or "")[1] or "").lower()
+    if not ext:
+        ext = ".mp4" if mime_type.startswith("video/") else (".gif" if mime_type == "image/gif" else ".mp4")
+
+    if pipe:
+        inp, stdin_bytes = _ffmpeg_input(job, input_bytes, mime_type, filename, ext)
+    else:
+        inp, stdin_bytes = job.write("input" + ext, input_bytes).replace("\\", "/"), None
+
+    out_path = None
+    if pipe:
+        outp = "pipe:1"
+    else:
+        out_path = job.path("out.webm")
+        outp = out_path.replace("\\", "/")
+
+    vf = f"scale={max_size}:{max_size}:force_original_aspect_ratio=decrease:flags=lanczos," \
+         f"pad={max_size}:{max_size}:(ow-iw)/2:(oh-ih)/2:color=0x00000000,fps={fps}"
+
+    args = [
+        "-y", "-hide_banner", "-loglevel", "error",
+        "-i", inp,
+        "-t", str(max_seconds),
+        "-an",
+        "-vf", vf,
+        "-c:v", WEBM_CODEC,
+        "-pix_fmt", WEBM_PIX_FMT,
+        "-b:v", bitrate,
+    ]
+    if maxrate:
+        # bitrate "apertado": o encoder não pode estourar muito acima da média
+        args += ["-maxrate", maxrate, "-bufsize", maxrate]
+    args += ["-f", "webm", outp]
+    return args, stdin_bytes, out_path
+
+def _webm_output(stdout: bytes, out_path: str | None) -> bytes:
+    if out_path is None:
+        if not stdout:
+            raise FFmpegError("ffmpeg não gerou nenhum frame")
+        return stdout
+    with open(out_path, "rb") as f:
+        return f.read()
+
+def convert_to_animated_sticker_webm(
+    input_bytes: bytes,
+    mime_type: str,
+    filename: str | None = None,
+    *,
+    pipe: bool = True,
+    max_seconds: int = WEBM_SECONDS,
+    max_size: int = STICKER_SIZE,
+    fps: int = WEBM_FPS,
+    bitrate: str = WEBM_BITRATE
+) -> bytes:
+    """
+    Converte GIF/MP4/WebM em figurinha animada (video sticker .webm VP9) 512x512, sem áudio, ~3s.
+    Requer FFmpeg no PATH. Se não houver, levanta erro amigável.
+    Versão bloqueante (pool de processos / scripts); o bot usa convert_to_animated_sticker_webm_async.
+    """
+    require_ffmpeg()
+    with SCRATCH.job() as job:
+        args, stdin_bytes, out_path = _webm_job(
+            job, input_bytes, mime_type, filename,
+            pipe=pipe, max_seconds=max_seconds, max_size=max_size, fps=fps, bitrate=bitrate,
+        )
+        stdout = run_ffmpeg_sync(args, input_bytes=stdin_bytes)
+        return _webm_output(stdout, out_path)
+
+async def convert_to_animated_sticker_webm_async(
+    input_bytes: bytes,
+    mime_type: str,
+    filename: str | None = None,
+    *,
+    pipe: bool = True,
+    max_seconds: int = WEBM_SECONDS,
+    max_size: int = STICKER_SIZE,
+    fps: int = WEBM_FPS,
+    bitrate: str = WEBM_BITRATE
+) -> bytes:
+    """mesma conversão do convert_to_animated_sticker_webm, mas via run_ffmpeg (assíncrono, com limite e timeout)."""
+    require_ffmpeg()
+    # mexer no disco (pasta do job, gravar entrada, ler saída) fica fora do loop
+    async with SCRATCH.job_async() as job:
+        args, stdin_bytes, out_path = await asyncio.to_thread(
+            _webm_job, job, input_bytes, mime_type, filename,
+            pipe=pipe, max_seconds=max_seconds, max_size=max_size, fps=fps, bitrate=bitrate,
+        )
+        stdout = await run_ffmpeg(args, input_bytes=stdin_bytes)
+        return await asyncio.to_thread(_webm_output, stdout, out_path)
+
+
+async def remux_webm_without_audio_async(input_bytes: bytes) -> bytes:
+    """copia só a faixa de vídeo do WebM (sem reencodar), tirando o áudio."""
+    require_ffmpeg()
+    args = [
+        "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-map", "0:v:0", "-c:v", "copy", "-an",
+        "-f", "webm", "pipe:1",
+    ]
+    return _webm_output(await run_ffmpeg(args, input_bytes=input_bytes), None)
+
+
+class WebmResult(NamedTuple):
+    """resultado do encode com orçamento de bytes."""
+    data: bytes
+    attempts: int
+    fits: bool       # False = nem a última tentativa coube no limite
+    bitrate: str
+    fps: int
+    seconds: float
+
+def _parse_kbps(bitrate: str) -> int:
+    b = bitrate.strip().lower()
+    if b.endswith("k"):
+        return int(float(b[:-1]))
+    if b.endswith("m"):
+        return int(float(b[:-1]) * 1000)
+    return max(1, int(float(b) / 1000))
+
+def _budget_attempts(max_bytes: int, max_seconds: float, fps: int, bitrate: str):
+    """
+    Escada de tentativas do encode com orçamento. É um gerador que recebe (via send)
+    o tamanho da saída anterior e devolve a próxima configuração (kbps, fps, segundos).
+
+    1ª: bitrate padrão, limitado ao que o orçamento comporta;
+    2ª: bitrate corrigido pela proporção orçamento/tamanho obtido;
+    3ª: idem + fps menor;
+    4ª: idem + duração menor.
+    """
+    budget_kbps = int(max_bytes * 8 / 1000 / max_seconds * 0.9)
+    kbps = min(_parse_kbps(bitrate), budget_kbps)
+    seconds = max_seconds
+    for attempt in range(1, WEBM_MAX_ATTEMPTS + 1):
+        last_size = yield kbps, fps, seconds
+        if not last_size:
+            return
+        # estimativa pelo tamanho real (com 10% de folga)
+        kbps = max(32, int(kbps * max_bytes / last_size * 0.9))
+        if attempt >= 2:
+            fps = max(15, int(fps * 0.8))
+        if attempt >= 3:
+            seconds = max(1.0, round(seconds * 0.8, 2))
+
+def _attempt_timeout(deadline: float, last_elapsed: float) -> float | None:
+    """
+    Timeout da próxima tentativa da escada: o que falta até `deadline` (no máximo
+    FFMPEG_TIMEOUT). None se o que falta não cobre nem o tempo da tentativa anterior.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0 or remaining < last_elapsed:
+        return None
+    return min(FFMPEG_TIMEOUT, remaining)
+
+def convert_to_animated_sticker_webm_budgeted(
+    input_bytes: bytes,
+    mime_type: str,
+    filename: str | None = None,
+    *,
+    max_bytes: int = WEBM_MAX_BYTES,
+    max_seconds: int = WEBM_SECONDS,
+    max_size: int = STICKER_SIZE,
+    fps: int = WEBM_FPS,
+    bitrate: str = WEBM_BITRATE,
+    budget_seconds: float = WEBM_BUDGET_SECONDS,
+) -> WebmResult:
+    """
+    Igual ao convert_to_animated_sticker_webm, mas garante (tentando de novo com
+    bitrate/fps/duração menores) que a saída caiba em max_bytes. Para na primeira
+    que couber, ou quando o que sobra de budget_seconds não dá pra outra tentativa
+    (aí devolve a última, com fits=False).
+    """
+    require_ffmpeg()
+    plan = _budget_attempts(max_bytes, max_seconds, fps, bitrate)
+    step = next(plan)
+    attempts = 0
+    deadline = time.monotonic() + budget_seconds
+    timeout = _attempt_timeout(deadline, 0.0) or FFMPEG_TIMEOUT
+    result = None
+    # uma pasta pro laço todo: se a entrada precisar ir pra arquivo, grava uma vez só
+    with SCRATCH.job() as job:
+        while True:
+            kbps, cur_fps, seconds = step
+            attempts += 1
+            args, stdin_bytes, out_path = _webm_job(
+                job, input_bytes, mime_type, filename, pipe=True,
+                max_seconds=seconds, max_size=max_size, fps=cur_fps, bitrate=f"{kbps}k", maxrate=f"{kbps}k",
+            )
+            started = time.monotonic()
+            try:
+                out = run_ffmpeg_sync(args, input_bytes=stdin_bytes, timeout=timeout)
+            except FFmpegError:
+                # estourou o prazo da escada: fica com a tentativa anterior
+                if result is None or time.monotonic() < deadline:
+                    raise
+                return result
+            data = _webm_output(out, out_path)
+            result = WebmResult(data, attempts, len(data) <= max_bytes, f"{kbps}k", cur_fps, seconds)
+            if result.fits:
+                return result
+            try:
+                step = plan.send(len(data))
+            except StopIteration:
+                return result
+            timeout = _attempt_timeout(deadline, time.monotonic() - started)
+            if timeout is None:
+                return result
+
+async def convert_to_animated_sticker_webm_budgeted_async(
+    input_bytes: bytes,
+    mime_type: str,
+    filename: str | None = None,
+    *,
+    max_bytes: int = WEBM_MAX_BYTES,
+    max_seconds: int = WEBM_SECONDS,
+    max_size: int = STICKER_SIZE,
+    fps: int = WEBM_FPS,
+    bitrate: str = WEBM_BITRATE,
+    budget_seconds: float = WEBM_BUDGET_SECONDS,
+) -> WebmResult:
+    """versão assíncrona (run_ffmpeg) do convert_to_animated_sticker_webm_budgeted."""
+    require_ffmpeg()
+    plan = _budget_attempts(max_bytes, max_seconds, fps, bitrate)
+    step = next(plan)
+    attempts = 0
+    deadline = time.monotonic() + budget_seconds
+    timeout = _attempt_timeout(deadline, 0.0) or FFMPEG_TIMEOUT
+    result = None
+    # uma pasta pro laço todo: se a entrada precisar ir pra arquivo, grava uma vez só
+    async with SCRATCH.job_async() as job:
+        while True:
+            kbps, cur_fps, seconds = step
+            attempts += 1
+            args, stdin_bytes, out_path = await asyncio.to_thread(
+                _webm_job, job, input_bytes, mime_type, filename, pipe=True,
+                max_seconds=seconds, max_size=max_size, fps=cur_fps, bitrate=f"{kbps}k", maxrate=f"{kbps}k",
+            )
+            started = time.monotonic()
+            try:
+                out = await run_ffmpeg(args, input_bytes=stdin_bytes, timeout=timeout)
+            except FFmpegError:
+                # estourou o prazo da escada: fica com a tentativa anterior
+                if result is None or time.monotonic() < deadline:
+                    raise
+                return result
+            data = _webm_output(out, out_path)
+            result = WebmResult(data, attempts, len(data) <= max_bytes, f"{kbps}k", cur_fps, seconds)
+            if result.fits:
+                return result
+            try:
+                step = plan.send(len(data))
+            except StopIteration:
+                return result
+            timeout = _attempt_timeout(deadline, time.monotonic() - started)
+            if timeout is None:
+                return result
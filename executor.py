@@ -0,0 +1,126 @@
+import asyncio
+import functools
+import os
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+
+class ConversionBusy(RuntimeError):
+    """fila de conversões cheia; o handler deve pedir pra tentar depois."""
+
+
+class ConversionTimeout(RuntimeError):
+    """a conversão passou do tempo limite."""
+
+
+class ConversionExecutor:
+    """
+    Pool de processos para as conversões pesadas (Pillow, WebP, ffmpeg).
+
+    - `workers` processos rodam em paralelo (um por núcleo por padrão);
+    - no máximo `queue_max` jobs ficam esperando além dos que já estão rodando,
+      o resto recebe ConversionBusy na hora;
+    - cada job tem um tempo limite: ao estourar, os processos do pool são mortos
+      (é o único jeito de parar um job travado) e o pool é recriado; os outros
+      jobs que estavam nesse pool são reenviados uma vez pro pool novo.
+
+    O handler só faz `await executor.run(func, ...)`, então o loop do bot
+    continua atendendo outros updates enquanto a conversão roda.
+
+    As etapas medidas dentro do worker (metrics.stage) voltam junto com o
+    resultado e entram nas métricas do processo do bot, além do tempo de fila.
+    """
+
+    def __init__(self, workers: int | None = None, queue_max: int | None = None, timeout: float = 60.0):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_max = max(0, queue_max if queue_max is not None else self.workers * 4)
+        self.timeout = timeout
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending = 0
+        # pools mortos por timeout (job de outro pool que caiu junto pode tentar de novo)
+        self._killed: weakref.WeakSet = weakref.WeakSet()
+        self.restarts = 0
+
+    @classmethod
+    def from_env(cls) -> "ConversionExecutor":
+        """lê CONV_WORKERS / CONV_QUEUE_MAX / CONV_TIMEOUT do ambiente (.env)."""
+        workers = int(os.getenv("CONV_WORKERS", "0")) or None
+        queue_max = os.getenv("CONV_QUEUE_MAX", "").strip()
+        timeout = float(os.getenv("CONV_TIMEOUT", "60"))
+        return cls(workers, int(queue_max) if queue_max else None, timeout)
+
+    @property
+    def pending(self) -> int:
+        """jobs rodando + esperando na fila."""
+        return self._pending
+
+    @property
+    def queued(self) -> int:
+        """jobs esperando um worker livre."""
+        return max(0, self._pending - self.workers)
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @staticmethod
+    def _kill(pool: ProcessPoolExecutor):
+        """mata os processos do pool (inclusive o do job travado) e espera eles saírem."""
+        procs = list((getattr(pool, "_processes", None) or {}).values())
+        for p in procs:
+            p.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+        for p in procs:
+            p.join(5)
+            if p.is_alive():
+                p.kill()
+                p.join()
+
+    async def run(self, fn, *args, timeout: float | None = None, **kwargs):
+        """roda fn(*args, **kwargs) num worker e devolve o resultado."""
+        if self._pending >= self.workers + self.queue_max:
+            raise ConversionBusy("tô com muitas figurinhas na fila agora, tenta de novo daqui a pouco")
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            job = functools.partial(metrics.run_collecting, fn, *args, **kwargs)
+            for attempt in (1, 2):
+                self.start()
+                pool = self._pool
+                submitted = time.time()
+                try:
+                    result, started, stages = await asyncio.wait_for(
+                        loop.run_in_executor(pool, job), timeout or self.timeout
+                    )
+                    metrics.STAGE_SECONDS.observe(max(0.0, started - submitted), stage="queue_wait")
+                    metrics.record_stages(stages)
+                    return result
+                except asyncio.TimeoutError:
+                    # wait_for só para de esperar; o worker continua preso no job.
+                    # mata o pool (a vaga só é liberada depois que os processos saem)
+                    if self._pool is pool:
+                        self._pool = None
+                        self.restarts += 1
+                        self._killed.add(pool)
+                        await asyncio.to_thread(self._kill, pool)
+                    raise ConversionTimeout("a conversão demorou demais e foi interrompida") from None
+                except BrokenProcessPool:
+                    if pool in self._killed and attempt == 1:
+                        # caiu junto com um job que estourou o tempo: tenta no pool novo
+                        continue
+                    # algum worker morreu (ex.: falta de memória): recria o pool no próximo job
+                    if self._pool is pool:
+                        self.shutdown()
+                    raise RuntimeError("o processo de conversão caiu, tenta de novo") from None
+        finally:
+            self._pending -= 1
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import random
+import subprocess
+import shutil
+import time
+
+from dotenv import load_dotenv
+
+from metrics import stage, wait_stage
+
+try:
+    import fcntl
+except ImportError:  # windows: sem trava entre processos (ver _SlotLimiter)
+    fcntl = None
+
+# roda o ffmpeg de forma assíncrona (asyncio subprocess) ou bloqueante (workers do
+# pool), com limite de processos simultâneos na máquina toda, timeout de parede e
+# kill se o job for cancelado
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"), override=True)
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "").strip().strip('"')
+
+if FFMPEG_BIN and os.path.isfile(FFMPEG_BIN):
+    pass
+else:
+    FFMPEG_BIN = shutil.which("ffmpeg") or shutil.which("ffmpeg.exe") or FFMPEG_BIN
+
+if not FFMPEG_BIN and os.name == "nt":
+    try:
+        out = subprocess.check_output(
+            ["powershell", "-NoProfile", "-Command", "(Get-Command ffmpeg).Source"],
+            text=True
+        ).strip()
+        if out:
+            FFMPEG_BIN = out
+    except Exception:
+        pass
+
+if not FFMPEG_BIN:
+    try:
+        subprocess.run(["ffmpeg", "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        FFMPEG_BIN = "ffmpeg"
+    except Exception:
+        pass
+
+print("FFmpeg detectado:", FFMPEG_BIN or "NÃO ENCONTRADO")
+
+
+# no máximo 1 ffmpeg por núcleo ao mesmo tempo; o resto espera vaga
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", "0")) or (os.cpu_count() or 1)
+# tempo máximo (segundos) de um ffmpeg antes de ser morto
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "30"))
+# arquivos de trava das vagas (compartilhados entre o bot, os workers e o batch_convert)
+FFMPEG_SLOT_DIR = os.path.join(BASE_DIR, "data", "ffmpeg_slots")
+
+# fila do próprio processo (tasks do bot esperam aqui, sem ficar sondando as travas)
+_FFMPEG_SEM = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+
+
+class _SlotLimiter:
+    """
+    FFMPEG_CONCURRENCY vagas entre processos: cada vaga é um arquivo com flock.
+    O bot (run_ffmpeg) e os workers do pool (run_ffmpeg_sync, ex.: frame de vídeo
+    pra figurinha estática) disputam as mesmas vagas. Se o processo morrer, o
+    sistema solta a trava sozinho.
+    Sem fcntl (windows) não há trava entre processos: aí o ffmpeg dos workers
+    fica limitado só pelo CONV_WORKERS, além das FFMPEG_CONCURRENCY vagas do bot.
+    """
+
+    def __init__(self, slots: int, lock_dir: str):
+        self.slots = max(1, slots)
+        self.lock_dir = lock_dir
+
+    def try_acquire(self):
+        """devolve o arquivo da vaga (trava) ou None se estão todas ocupadas."""
+        if fcntl is None:
+            return True
+        os.makedirs(self.lock_dir, exist_ok=True)
+        order = list(range(self.slots))
+        random.shuffle(order)
+        for i in order:
+            f = open(os.path.join(self.lock_dir, f"slot_{i}.lock"), "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except OSError:
+                f.close()
+        return None
+
+    @staticmethod
+    def release(slot):
+        if slot is True or slot is None:
+            return
+        try:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+        finally:
+            slot.close()
+
+    def acquire(self):
+        delay = 0.02
+        while (slot := self.try_acquire()) is None:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        return slot
+
+    async def acquire_async(self):
+        delay = 0.02
+        while (slot := self.try_acquire()) is None:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        return slot
+
+
+_SLOTS = _SlotLimiter(FFMPEG_CONCURRENCY, FFMPEG_SLOT_DIR)
+
+
+class FFmpegError(RuntimeError):
+    """o ffmpeg falhou, estourou o tempo ou não está instalado."""
+
+
+def require_ffmpeg():
+    if not FFMPEG_BIN:
+        raise FFmpegError("FFmpeg não encontrado. Instale (winget/choco/scoop) ou defina FFMPEG_BIN no .env apontando para o ffmpeg.exe.")
+
+
+def _error_from_stderr(returncode: int, stderr: bytes) -> FFmpegError:
+    """pega as últimas linhas do stderr do ffmpeg, que é onde fica o motivo real do erro."""
+    lines = [ln.strip() for ln in (stderr or b"").decode("utf-8", "replace").splitlines() if ln.strip()]
+    if not lines:
+        return FFmpegError(f"ffmpeg saiu com código {returncode}")
+    return FFmpegError("ffmpeg: " + " | ".join(lines[-3:])[:400])
+
+
+def _kill(proc):
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run_ffmpeg(args: list[str], *, input_bytes: bytes | None = None, timeout: float | None = None) -> bytes:
+    """
+    Roda `ffmpeg <args>` e devolve o stdout.
+
+    - espera vaga (FFMPEG_CONCURRENCY na máquina toda, contando os workers do pool);
+    - mata o processo se passar de `timeout` (padrão FFMPEG_TIMEOUT) ou se a task for cancelada;
+    - código de saída != 0 vira FFmpegError com o fim do stderr.
+    """
+    require_ffmpeg()
+    timeout = timeout or FFMPEG_TIMEOUT
+
+    async with _FFMPEG_SEM:
+        with wait_stage("ffmpeg_wait"):
+            slot = await _SLOTS.acquire_async()
+        try:
+            out, err, proc = await _run_async(args, input_bytes, timeout)
+        finally:
+            _SLOTS.release(slot)
+
+    if proc.returncode != 0:
+        raise _error_from_stderr(proc.returncode, err)
+    return out
+
+
+async def _run_async(args: list[str], input_bytes: bytes | None, timeout: float):
+    """sobe o ffmpeg e espera (com timeout); mata o processo em timeout/cancelamento."""
+    with stage("ffmpeg"):
+        proc = await asyncio.create_subprocess_exec(
+            FFMPEG_BIN, *args,
+            stdin=asyncio.subprocess.PIPE if input_bytes is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(input_bytes), timeout)
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            raise FFmpegError(f"ffmpeg passou de {timeout:.0f}s e foi interrompido") from None
+        except BaseException:
+            # cancelamento (ou qualquer outra coisa): não deixa encoder zumbi
+            _kill(proc)
+            await asyncio.shield(proc.wait())
+            raise
+    return out, err, proc
+
+
+def run_ffmpeg_sync(args: list[str], *, input_bytes: bytes | None = None, timeout: float | None = None) -> bytes:
+    """versão bloqueante do run_ffmpeg, pra quem roda fora do loop (workers do pool)."""
+    require_ffmpeg()
+    timeout = timeout or FFMPEG_TIMEOUT
+    with wait_stage("ffmpeg_wait"):
+        slot = _SLOTS.acquire()
+    try:
+        with stage("ffmpeg"):
+            res = subprocess.run(
+                [FFMPEG_BIN, *args],
+                input=input_bytes,
+                stdin=None if input_bytes is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=timeout,
+            )
+    except subprocess.TimeoutExpired:
+        raise FFmpegError(f"ffmpeg passou de {timeout:.0f}s e foi interrompido") from None
+    finally:
+        _SLOTS.release(slot)
+    if res.returncode != 0:
+        raise _error_from_stderr(res.returncode, res.stderr)
+    return res.stdout
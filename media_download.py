@@ -0,0 +1,138 @@
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+# download das mídias do /fig com limite de tamanho:
+# - recusa antes de baixar se o file_size (do update ou do get_file) já passa do limite;
+# - baixa em streaming direto pra um único bytearray (sem a cópia do bytes(...))
+#   e corta no meio se passar do limite (file_size pode faltar ou mentir);
+# - limite separado por tipo (imagem / svg / vídeo-gif), configurável no .env.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"), override=True)
+
+MB = 1024 * 1024
+MAX_IMAGE_BYTES = int(float(os.getenv("DOWNLOAD_MAX_IMAGE_MB", "10")) * MB)
+MAX_SVG_BYTES = int(float(os.getenv("DOWNLOAD_MAX_SVG_MB", "1")) * MB)
+# a Bot API nem entrega arquivos acima de 20 MB
+MAX_VIDEO_BYTES = int(float(os.getenv("DOWNLOAD_MAX_VIDEO_MB", "20")) * MB)
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+CHUNK_SIZE = 64 * 1024
+
+VIDEO_EXT = {".mp4", ".mov", ".mkv", ".webm", ".avi", ".gif"}
+
+
+def _mb(n: int) -> str:
+    return f"{round(n / MB, 1):g} MB"
+
+
+class MediaTooLarge(ValueError):
+    """arquivo acima do limite do tipo; a mensagem já vem pronta pro usuário."""
+
+    def __init__(self, size: int | None, limit: int):
+        self.size = size
+        self.limit = limit
+        if size:
+            msg = f"esse arquivo é grande demais ({_mb(size)}, o limite é {_mb(limit)})"
+        else:
+            msg = f"esse arquivo passou do limite de {_mb(limit)}"
+        super().__init__(msg)
+
+
+def max_bytes_for(mime_type: str, filename: str | None = None) -> int:
+    """limite de download pro tipo da mídia."""
+    mime_type = (mime_type or "").lower()
+    ext = (os.path.splitext(filename or "")[1] or "").lower()
+    if mime_type == "image/svg+xml" or ext == ".svg":
+        return MAX_SVG_BYTES
+    if mime_type.startswith("video/") or mime_type == "image/gif" or ext in VIDEO_EXT:
+        return MAX_VIDEO_BYTES
+    return MAX_IMAGE_BYTES
+
+
+def pick_photo_size(sizes, side: int, *, fit: bool = True):
+    """
+    Menor PhotoSize que ainda serve pra `side` (ou a maior, se nenhuma servir).
+
+    fit=True: o maior lado cobre `side` (imagem vai caber numa caixa side x side, ex.: figurinha);
+    fit=False: o menor lado cobre `side` (imagem vai ser recortada/esticada num quadrado, ex.: avatar).
+    """
+    pick = max if fit else min
+    ordered = sorted(sizes, key=lambda p: p.width * p.height)
+    for ps in ordered:
+        if pick(ps.width, ps.height) >= side:
+            return ps
+    return ordered[-1]
+
+
+_client: httpx.AsyncClient | None = None
+
+
+def _http() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(DOWNLOAD_TIMEOUT, connect=10.0))
+    return _client
+
+
+async def close():
+    """fecha o cliente HTTP compartilhado (post_shutdown do bot)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _stream_into(url: str, max_bytes: int, size_hint: int | None) -> bytearray:
+    async with _http().stream("GET", url) as resp:
+        resp.raise_for_status()
+        length = int(resp.headers.get("content-length") or 0)
+        if length > max_bytes:
+            raise MediaTooLarge(length, max_bytes)
+
+        # já reserva o tamanho conhecido e vai preenchendo no lugar
+        expected = length or size_hint or 0
+        buf = bytearray(expected)
+        view = memoryview(buf)
+        pos = 0
+        async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+            end = pos + len(chunk)
+            if end > max_bytes:
+                raise MediaTooLarge(None, max_bytes)
+            if end <= expected:
+                view[pos:end] = chunk
+            else:
+                view.release()
+                del buf[pos:]
+                buf += chunk
+                view = memoryview(buf)
+                expected = end
+            pos = end
+        view.release()
+    if pos < len(buf):
+        del buf[pos:]
+    return buf
+
+
+async def download(bot, file_id: str, *, max_bytes: int, file_size: int | None = None) -> bytearray:
+    """
+    Baixa o arquivo respeitando max_bytes. Devolve o bytearray do download
+    (sem cópia extra); MediaTooLarge se passar do limite.
+    """
+    if file_size and file_size > max_bytes:
+        raise MediaTooLarge(file_size, max_bytes)
+
+    f = await bot.get_file(file_id)
+    if f.file_size and f.file_size > max_bytes:
+        raise MediaTooLarge(f.file_size, max_bytes)
+
+    path = f.file_path or ""
+    if not path.startswith(("http://", "https://")):
+        # Bot API local (arquivo já está no disco): deixa o PTB ler
+        buf = await f.download_as_bytearray()
+        if len(buf) > max_bytes:
+            raise MediaTooLarge(len(buf), max_bytes)
+        return buf
+
+    return await _stream_into(path, max_bytes, f.file_size or file_size)
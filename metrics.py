@@ -0,0 +1,345 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# métricas simples em memória (histogramas, contadores, gauges) no formato texto do
+# Prometheus, sem dependência nova. Exposto via /stats (dono) e, se METRICS_PORT
+# estiver definido, num endpoint HTTP local (GET /metrics).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels_key(labelnames: tuple[str, ...], labels: dict) -> tuple:
+    return tuple(str(labels.get(n, "")) for n in labelnames)
+
+
+def _fmt_labels(labelnames: tuple[str, ...], key: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(self.values().items()):
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {v:g}")
+        return out
+
+
+class Gauge:
+    """valor lido na hora (callback), ex.: tamanho da fila."""
+
+    def __init__(self, name: str, help_text: str, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def value(self) -> float:
+        try:
+            return float(self.fn())
+        except Exception:
+            return 0.0
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value():g}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # chave -> [contagem por bucket (+Inf no fim), soma, total]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(self.labelnames, labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[key] = s
+            s[0][idx] += 1
+            s[1] += value
+            s[2] += 1
+
+    def snapshot(self) -> dict[tuple, tuple[list[int], float, int]]:
+        with self._lock:
+            return {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+
+    def quantile(self, q: float, counts: list[int], total: int) -> float:
+        """estimativa do quantil pelos buckets (interpolação linear, como o histogram_quantile)."""
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, c in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if seen + c >= rank and c:
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+            lower = upper
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total_sum, total) in sorted(self.snapshot().items()):
+            acc = 0
+            for i, b in enumerate(self.buckets):
+                acc += counts[i]
+                le = 'le="%g"' % b
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {acc}")
+            inf = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, inf)} {total}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total_sum:.6f}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {total}")
+        return out
+
+
+_REGISTRY: list = []
+
+
+def _register(metric):
+    _REGISTRY.append(metric)
+    return metric
+
+
+def gauge(name: str, help_text: str, fn) -> Gauge:
+    """registra um gauge lido por callback (ex.: lambda: EXECUTOR.pending)."""
+    return _register(Gauge(name, help_text, fn))
+
+
+# coletas com I/O (ex.: ler um arquivo) que alimentam gauges: rodam uma vez por
+# render, numa thread, e o callback do gauge só lê o valor guardado
+_COLLECTORS: list = []
+
+
+def collector(fn):
+    """registra fn() pra rodar fora do loop antes de cada render/stats_text."""
+    _COLLECTORS.append(fn)
+    return fn
+
+
+async def collect():
+    for fn in _COLLECTORS:
+        try:
+            await asyncio.to_thread(fn)
+        except Exception:
+            pass
+
+
+STAGE_SECONDS = _register(Histogram(
+    "dinasticker_stage_seconds",
+    "duração de cada etapa do /fig (download, decode, resize, encode, ffmpeg, upload...)",
+    ("stage",),
+))
+CONVERSIONS = _register(Counter(
+    "dinasticker_conversions_total",
+    "figurinhas pedidas por tipo e resultado",
+    ("type", "result"),
+))
+ERRORS = _register(Counter(
+    "dinasticker_errors_total",
+    "erros por etapa",
+    ("stage",),
+))
+PHOTO_FALLBACKS = _register(Counter(
+    "dinasticker_photo_fallbacks_total",
+    "figurinhas que o Telegram recusou e foram enviadas como foto",
+))
+
+
+# ---------------------------------------------------------------- etapas
+
+# dentro de um worker do pool: lista onde as etapas do job atual são anotadas
+_job_stages: list | None = None
+
+
+# esperas (wait_stage) em andamento descontam das etapas abertas com exclude_waits
+_open_waits: contextvars.ContextVar[tuple] = contextvars.ContextVar("_open_waits", default=())
+
+
+class stage:
+    """
+    Mede uma etapa: `with stage("encode"): ...`
+
+    Grava no histograma do processo atual; dentro de um job do pool de conversão
+    (run_collecting) também anota a etapa pra ser devolvida ao processo do bot.
+
+    exclude_waits=True: o tempo das wait_stage de dentro (fila, vaga do ffmpeg)
+    não entra nesta etapa, só o trabalho de verdade.
+    """
+
+    def __init__(self, name: str, *, exclude_waits: bool = False):
+        self.name = name
+        self.exclude_waits = exclude_waits
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        self._waited = None
+        if self.exclude_waits:
+            self._waited = [0.0]
+            self._token = _open_waits.set(_open_waits.get() + (self._waited,))
+        return self
+
+    def _elapsed(self) -> float:
+        dt = time.perf_counter() - self._t0
+        if self._waited is not None:
+            _open_waits.reset(self._token)
+            dt = max(0.0, dt - self._waited[0])
+        return dt
+
+    def __exit__(self, exc_type, exc, tb):
+        dt = self._elapsed()
+        STAGE_SECONDS.observe(dt, stage=self.name)
+        if _job_stages is not None:
+            _job_stages.append((self.name, dt))
+        if exc_type is not None and not issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            ERRORS.inc(stage=self.name)
+        return False
+
+
+class wait_stage(stage):
+    """etapa de espera (fila, vaga): medida à parte e descontada das etapas com exclude_waits."""
+
+    def _elapsed(self) -> float:
+        dt = super()._elapsed()
+        for cell in _open_waits.get():
+            cell[0] += dt
+        return dt
+
+
+def _run_staged(name: str, fn, *args, **kwargs):
+    with stage(name, exclude_waits=True):
+        return fn(*args, **kwargs)
+
+
+def staged(name: str, fn):
+    """fn medida como a etapa `name` dentro do worker (só o trabalho, sem a fila do pool)."""
+    return functools.partial(_run_staged, name, fn)
+
+
+def run_collecting(fn, *args, **kwargs):
+    """
+    Roda fn no worker anotando as etapas. Devolve (resultado, início em epoch, etapas).
+    O ConversionExecutor usa isso e repassa as etapas pro registro do processo principal.
+    """
+    global _job_stages
+    started = time.time()
+    _job_stages = []
+    try:
+        result = fn(*args, **kwargs)
+        return result, started, _job_stages
+    finally:
+        _job_stages = None
+
+
+def record_stages(stages: list[tuple[str, float]]):
+    for name, dt in stages:
+        STAGE_SECONDS.observe(dt, stage=name)
+
+
+# ---------------------------------------------------------------- saída
+
+def render() -> str:
+    lines = []
+    for m in _REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+def stats_text() -> str:
+    """resumo legível pro /stats."""
+    parts = ["Etapas (n / média / p50 / p90):"]
+    for (stage_name,), (counts, total_sum, total) in sorted(STAGE_SECONDS.snapshot().items()):
+        if not total:
+            continue
+        p50 = STAGE_SECONDS.quantile(0.5, counts, total)
+        p90 = STAGE_SECONDS.quantile(0.9, counts, total)
+        parts.append(
+            f"• {stage_name}: {total} / {total_sum / total * 1000:.0f} ms / {p50 * 1000:.0f} ms / {p90 * 1000:.0f} ms"
+        )
+
+    conv = CONVERSIONS.values()
+    if conv:
+        parts.append("\nFigurinhas:")
+        for (kind, result), v in sorted(conv.items()):
+            parts.append(f"• {kind} {result}: {v:g}")
+
+    errs = ERRORS.values()
+    if errs:
+        parts.append("\nErros:")
+        for (stage_name,), v in sorted(errs.items()):
+            parts.append(f"• {stage_name}: {v:g}")
+
+    fallbacks = PHOTO_FALLBACKS.values().get((), 0)
+    parts.append(f"\nEnviadas como foto: {fallbacks:g}")
+
+    gauges = [m for m in _REGISTRY if isinstance(m, Gauge)]
+    if gauges:
+        parts.append("")
+        for g in gauges:
+            parts.append(f"{g.help}: {g.value():g}")
+
+    return "\n".join(parts)
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # descarta os headers
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            await collect()
+            body = render().encode()
+            head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+        else:
+            body = b"not found\n"
+            head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+        writer.write((head + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode() + body)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server() -> asyncio.AbstractServer | None:
+    """sobe o endpoint /metrics se METRICS_PORT estiver no .env (por padrão só em 127.0.0.1)."""
+    port = int(os.getenv("METRICS_PORT", "0") or 0)
+    if not port:
+        return None
+    host = os.getenv("METRICS_HOST", "127.0.0.1")
+    server = await asyncio.start_server(_handle_http, host, port)
+    print(f"métricas em http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,150 @@
+import asyncio
+import io
+import os
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+import media_download
+from quote_maker import AVATAR_SIZE
+
+# cache de avatar e emoji de status (premium) usados nas figurinhas de quote.
+# - avatar: por user_id, guarda o file_unique_id da foto e a imagem já reduzida;
+#   dentro do TTL não chama a API; depois do TTL só confere se a foto mudou
+#   (get_user_profile_photos) e baixa de novo só se mudou.
+# - emoji de status: por user_id, com o mesmo TTL (vem do get_chat).
+# - badge: por custom_emoji_id, sem TTL (a imagem de um custom emoji não muda).
+
+AVATAR_TTL = float(os.getenv("AVATAR_TTL", "600"))
+PROFILE_CACHE_MAX = int(os.getenv("PROFILE_CACHE_MAX", "512"))
+BADGE_SIZE = 64
+# tempo máximo de cada busca (avatar / badge) e de todas juntas, em segundos
+PROFILE_FETCH_TIMEOUT = float(os.getenv("PROFILE_FETCH_TIMEOUT", "2.5"))
+PROFILE_FETCH_DEADLINE = float(os.getenv("PROFILE_FETCH_DEADLINE", "3"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU limitado em itens; cada entrada vence `ttl` segundos depois de gravada."""
+
+    def __init__(self, max_items: int, ttl: float | None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def lookup(self, key):
+        """devolve (valor, ainda_válido) ou (_MISSING, False) se não tem nada."""
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING, False
+        self._data.move_to_end(key)
+        stored_at, value = item
+        fresh = self.ttl is None or (time.monotonic() - stored_at) < self.ttl
+        return value, fresh
+
+    def put(self, key, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# user_id -> (file_unique_id | None, imagem | None)
+AVATARS = TTLCache(PROFILE_CACHE_MAX, AVATAR_TTL)
+# user_id -> custom_emoji_id | None
+EMOJI_STATUS = TTLCache(PROFILE_CACHE_MAX, AVATAR_TTL)
+# custom_emoji_id -> imagem | None
+BADGES = TTLCache(PROFILE_CACHE_MAX, None)
+
+
+async def _download(bot, file_id: str) -> bytearray:
+    return await media_download.download(bot, file_id, max_bytes=media_download.MAX_IMAGE_BYTES)
+
+
+async def get_avatar(bot, user_id: int) -> Image.Image | None:
+    """avatar do usuário já reduzido pro tamanho da quote (ou None se não tiver foto)."""
+    cached, fresh = AVATARS.lookup(user_id)
+    if fresh:
+        return cached[1]
+
+    photos = await bot.get_user_profile_photos(user_id, limit=1)
+    if photos.total_count <= 0 or not photos.photos:
+        AVATARS.put(user_id, (None, None))
+        return None
+
+    photo = media_download.pick_photo_size(photos.photos[0], AVATAR_SIZE, fit=False)
+    if cached is not _MISSING and cached[0] == photo.file_unique_id:
+        # mesma foto de antes: só renova o prazo
+        AVATARS.put(user_id, cached)
+        return cached[1]
+
+    data = await _download(bot, photo.file_id)
+    img = Image.open(io.BytesIO(data)).convert("RGBA").resize((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+    AVATARS.put(user_id, (photo.file_unique_id, img))
+    return img
+
+
+async def get_emoji_status_badge(bot, user_id: int) -> Image.Image | None:
+    """imagem do emoji de status premium (custom emoji) do usuário, se tiver."""
+    emoji_id, fresh = EMOJI_STATUS.lookup(user_id)
+    if not fresh:
+        chat_info = await bot.get_chat(user_id)
+        emoji_id = getattr(chat_info, "emoji_status_custom_emoji_id", None)
+        EMOJI_STATUS.put(user_id, emoji_id)
+    if not emoji_id:
+        return None
+
+    badge, _ = BADGES.lookup(emoji_id)
+    if badge is not _MISSING:
+        return badge
+
+    badge = None
+    stickers = await bot.get_custom_emoji_stickers([emoji_id])
+    if stickers:
+        data = await _download(bot, stickers[0].file_id)
+        try:
+            badge = Image.open(io.BytesIO(data)).convert("RGBA")
+            badge.thumbnail((BADGE_SIZE, BADGE_SIZE), Image.LANCZOS)
+        except Exception:
+            # emoji animado (tgs/webm) não abre no Pillow: fica sem badge
+            badge = None
+    BADGES.put(emoji_id, badge)
+    return badge
+
+
+async def _fetch_or_none(coro, timeout: float):
+    """roda uma busca com tempo limite; erro ou demora viram None (quote segue sem aquilo)."""
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        return None
+
+
+async def fetch_quote_profile(bot, user_id: int) -> tuple[Image.Image | None, Image.Image | None]:
+    """
+    Busca avatar e badge ao mesmo tempo (são independentes).
+
+    Cada busca tem seu tempo limite (PROFILE_FETCH_TIMEOUT) e as duas juntas têm
+    um prazo total (PROFILE_FETCH_DEADLINE). O que não chegar a tempo fica None:
+    a quote sai com o avatar de iniciais e/ou sem badge em vez de esperar.
+    """
+    avatar_task = asyncio.create_task(_fetch_or_none(get_avatar(bot, user_id), PROFILE_FETCH_TIMEOUT))
+    badge_task = asyncio.create_task(_fetch_or_none(get_emoji_status_badge(bot, user_id), PROFILE_FETCH_TIMEOUT))
+    tasks = {avatar_task, badge_task}
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=PROFILE_FETCH_DEADLINE)
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+    avatar_img = avatar_task.result() if avatar_task in done else None
+    badge_img = badge_task.result() if badge_task in done else None
+    return avatar_img, badge_img
@@ -1,129 +1,344 @@
 from PIL import Image, ImageDraw, ImageFont
-import io
+import math
+import struct
+import unicodedata
+from bisect import bisect_right
+from itertools import accumulate
 from pathlib import Path 
 
+from webp_encoder import encode_webp
+
 # pasta onde ficarão as fontes extras
 FONT_DIR = Path(__file__).resolve().parent / "fonts"
 
-# tenta carregar uma fonte decente; ajuste o caminho se quiser uma ttf no repo
-def _load_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+# tamanho do avatar redondo ao lado da bolha
+AVATAR_SIZE = 140
+
+# ordem de prioridade das fontes: primeiro na pasta ./fonts, depois no sistema.
+# cada caractere é desenhado com a primeira fonte da lista que tem o glifo dele.
+FONT_CANDIDATES = [
+    
+    "NotoSansCherokee-Regular.ttf",   
+    "NotoSansMath-Regular.ttf",
+    "NotoSansSymbols2-Regular.ttf",
+    "NotoEmoji-Regular.ttf",
+    "NotoSans-Regular.ttf",
+    "Symbola.ttf",                    
+    "Quicksand-Regular.ttf",
+    "Oswald-Regular.ttf",
+    "Lora-Regular.ttf",
+    "Merriweather_120pt-Regular.ttf",
+    "Ponnala-Regular.ttf",
+    "seguiemj.ttf",        
+    "DejaVuSans.ttf",
+    "DejaVuSansMono.ttf",
+    "DejaVuSansCondensed.ttf",
+    "Arial.ttf",
+    "arial.ttf",
+]
+
+# limite de palavras com largura guardada por FontStack (o dicionário é zerado ao encher)
+_MAX_CACHED_WIDTHS = 20000
+
+# caracteres que não mudam de fonte: grudam no pedaço anterior (seletores de variação, ZWJ)
+_STICKY_CHARS = {0x200D, 0xFE0E, 0xFE0F}
+
+def _u16(data: bytes, pos: int) -> int:
+    return struct.unpack_from(">H", data, pos)[0]
+
+def _u32(data: bytes, pos: int) -> int:
+    return struct.unpack_from(">I", data, pos)[0]
+
+def _read_cmap(path: str) -> frozenset[int]:
     """
-    Tenta várias fontes, primeiro na pasta ./fonts, depois no sistema.
-    Prioridade: Noto / Symbola / DejaVu / Arial.
+    Lê a tabela 'cmap' do arquivo TTF/OTF e devolve os codepoints que têm glifo.
+    Só entende os subformatos 4 (BMP) e 12 (unicode completo), que é o que as fontes usam.
     """
-    candidates = [
-        
-        "NotoSansCherokee-Regular.ttf",   
-        "NotoSansMath-Regular.ttf",
-        "NotoSansSymbols2-Regular.ttf",
-        "NotoEmoji-Regular.ttf",
-        "NotoSans-Regular.ttf",
-        "Symbola.ttf",                    
-        "Quicksand-Regular.ttf",
-        "Oswald-Regular.ttf",
-        "Lora-Regular.ttf",
-        "Merriweather_120pt-Regular.ttf",
-        "Ponnala-Regular.ttf",
-        "seguiemj.ttf",        
-        "DejaVuSans.ttf",
-        "DejaVuSansMono.ttf",
-        "DejaVuSansCondensed.ttf",
-        "Arial.ttf",
-        "arial.ttf",
-    ]
-
-    for name in candidates:
-        font_path = FONT_DIR / name
+    with open(path, "rb") as f:
+        data = f.read()
+
+    base = _u32(data, 12) if data[:4] == b"ttcf" else 0
+    cmap = None
+    for i in range(_u16(data, base + 4)):
+        rec = base + 12 + 16 * i
+        if data[rec:rec + 4] == b"cmap":
+            cmap = _u32(data, rec + 8)
+            break
+    if cmap is None:
+        return frozenset()
+
+    covered: set[int] = set()
+    seen = set()
+    for i in range(_u16(data, cmap + 2)):
+        platform, _encoding, offset = struct.unpack_from(">HHI", data, cmap + 4 + 8 * i)
+        if platform not in (0, 3) or offset in seen:
+            continue
+        seen.add(offset)
+        sub = cmap + offset
+        fmt = _u16(data, sub)
+
+        if fmt == 4:
+            seg_x2 = _u16(data, sub + 6)
+            ends = sub + 14
+            starts = ends + seg_x2 + 2
+            deltas = starts + seg_x2
+            range_offsets = deltas + seg_x2
+            for s in range(0, seg_x2, 2):
+                start, end = _u16(data, starts + s), _u16(data, ends + s)
+                delta = _u16(data, deltas + s)
+                ro = _u16(data, range_offsets + s)
+                for cp in range(start, min(end, 0xFFFE) + 1):
+                    if ro == 0:
+                        glyph = (cp + delta) & 0xFFFF
+                    else:
+                        gpos = range_offsets + s + ro + 2 * (cp - start)
+                        if gpos + 2 > len(data):
+                            continue
+                        glyph = _u16(data, gpos)
+                        if glyph:
+                            glyph = (glyph + delta) & 0xFFFF
+                    if glyph:
+                        covered.add(cp)
+
+        elif fmt == 12:
+            for g in range(_u32(data, sub + 12)):
+                start, end, _glyph = struct.unpack_from(">III", data, sub + 16 + 12 * g)
+                covered.update(range(start, end + 1))
+
+    return frozenset(covered)
+
+
+class FontStack:
+    """
+    As fontes do FontManager num tamanho só (carregadas sob demanda, uma vez).
+    Quebra o texto em pedaços (runs) e cada pedaço usa a fonte que cobre seus caracteres.
+    """
+
+    def __init__(self, manager: "FontManager", size: int):
+        self.manager = manager
+        self.size = size
+        self._fonts: dict[int, ImageFont.FreeTypeFont | ImageFont.ImageFont] = {}
+        self._advances: dict[str, float] = {}
+        self._widths: dict[str, float] = {}
+        self.primary = self.font(0)
         try:
-            return ImageFont.truetype(str(font_path), size)
-        except Exception:
-            pass
+            self.ascent, self.descent = self.primary.getmetrics()
+        except AttributeError:
+            self.ascent, self.descent = self.size, 0
 
+    def font(self, idx: int):
+        f = self._fonts.get(idx)
+        if f is None:
+            if idx < len(self.manager.paths):
+                f = ImageFont.truetype(self.manager.paths[idx], self.size)
+            else:
+                f = ImageFont.load_default()
+            self._fonts[idx] = f
+        return f
+
+    def runs(self, text: str) -> list[tuple[str, ImageFont.FreeTypeFont | ImageFont.ImageFont]]:
+        """divide o texto em [(pedaço, fonte)]."""
+        out = []
+        cur_idx = None
+        start = 0
+        for i, ch in enumerate(text):
+            cp = ord(ch)
+            if cur_idx is not None and (cp in _STICKY_CHARS or unicodedata.combining(ch)):
+                continue
+            idx = self.manager.font_index(cp)
+            if idx != cur_idx:
+                if cur_idx is not None:
+                    out.append((text[start:i], self.font(cur_idx)))
+                cur_idx = idx
+                start = i
+        if cur_idx is not None:
+            out.append((text[start:], self.font(cur_idx)))
+        return out
+
+    def advance(self, ch: str) -> float:
+        """avanço de um caractere (cacheado)."""
+        adv = self._advances.get(ch)
+        if adv is None:
+            adv = self.font(self.manager.font_index(ord(ch))).getlength(ch)
+            self._advances[ch] = adv
+        return adv
+
+    def text_width(self, token: str) -> float:
+        """largura de uma palavra pela soma dos avanços (cacheada por palavra)."""
+        w = self._widths.get(token)
+        if w is None:
+            w = sum(self.advance(ch) for ch in token)
+            if len(self._widths) >= _MAX_CACHED_WIDTHS:
+                self._widths.clear()
+            self._widths[token] = w
+        return w
+
+    def length(self, text: str) -> float:
+        """largura (avanço) do texto somando os pedaços de cada fonte."""
+        return sum(font.getlength(run) for run, font in self.runs(text))
+
+    def draw(self, draw: ImageDraw.ImageDraw, xy, text: str, fill):
+        """desenha o texto com fallback por caractere, todas as fontes na mesma linha de base."""
+        x, y = xy
+        baseline = y + self.ascent
+        for run, font in self.runs(text):
+            draw.text((x, baseline), run, font=font, fill=fill, anchor="ls")
+            x += font.getlength(run)
+
+
+class FontManager:
+    """
+    Carrega cada fonte uma vez por processo: resolve os caminhos, lê o cmap
+    (índice de cobertura) e guarda um FontStack por tamanho.
+    """
+
+    def __init__(self, candidates: list[str] = FONT_CANDIDATES):
+        self.paths: list[str] = []
+        self.coverage: list[frozenset[int]] = []
+        for name in candidates:
+            path = self._resolve(name)
+            if not path or path in self.paths:
+                continue
+            try:
+                cov = _read_cmap(path)
+            except Exception:
+                continue
+            self.paths.append(path)
+            self.coverage.append(cov)
+        self._char_index: dict[int, int] = {}
+        self._stacks: dict[int, FontStack] = {}
+
+    @staticmethod
+    def _resolve(name: str) -> str | None:
+        font_path = FONT_DIR / name
+        if font_path.is_file():
+            return str(font_path)
         try:
-            return ImageFont.truetype(name, size)
+            # deixa o Pillow procurar nas pastas de fonte do sistema
+            return ImageFont.truetype(name, 10).path
         except Exception:
-            continue
-
-    return ImageFont.load_default()
+            return None
+
+    def font_index(self, cp: int) -> int:
+        """índice da primeira fonte que tem o glifo (ou 0, a principal, se nenhuma tiver)."""
+        idx = self._char_index.get(cp)
+        if idx is None:
+            idx = 0
+            for i, cov in enumerate(self.coverage):
+                if cp in cov:
+                    idx = i
+                    break
+            self._char_index[cp] = idx
+        return idx
+
+    def stack(self, size: int) -> FontStack:
+        st = self._stacks.get(size)
+        if st is None:
+            st = FontStack(self, size)
+            self._stacks[size] = st
+        return st
+
+
+_FONT_MANAGER: FontManager | None = None
+
+def _font_manager() -> FontManager:
+    global _FONT_MANAGER
+    if _FONT_MANAGER is None:
+        _FONT_MANAGER = FontManager()
+    return _FONT_MANAGER
+
+def _load_font(size: int) -> FontStack:
+    """fontes no tamanho pedido (cacheado por processo), com fallback por caractere."""
+    return _font_manager().stack(size)
 
 def _wrap_text(
     draw: ImageDraw.ImageDraw,
     text: str,
-    font: ImageFont.ImageFont,
+    font: FontStack,
     max_w: int
 ):
     """
     Quebra o texto em várias linhas:
+    - cada "\n" começa uma linha nova (cadeia de respostas vem junta com \n);
     - tenta primeiro por palavras (normal);
     - se uma "palavra" sozinha estourar max_w (ex.: ".............." gigante),
       ela é quebrada em pedaços menores para caber na bolha.
+
+    As larguras vêm do cache de avanços do FontStack (cada palavra é medida uma
+    vez só), então o custo cresce linear com o tamanho do texto.
     """
     text = text.replace("\r", "")
-    words = text.split(" ")
     lines: list[str] = []
-    cur = ""
+    space_w = font.advance(" ")
 
-    def _width(s: str) -> int:
-        if not s:
-            return 0
-        try:
-            bbox = draw.textbbox((0, 0), s, font=font)
-            return bbox[2] - bbox[0]
-        except AttributeError:
-            return draw.textsize(s, font=font)[0]
+    for paragraph in text.split("\n"):
+        cur = ""
+        cur_w = 0.0
 
-    for w in words:
-        if w == "":
-            test = (cur + " ").rstrip()
-            if _width(test) <= max_w or not cur:
-                cur = test
-            else:
-                if cur:
-                    lines.append(cur)
-                cur = ""
-            continue
+        for w in paragraph.split(" "):
+            if w == "":
+                continue
 
-        w_px = _width(w)
+            w_px = font.text_width(w)
 
-        if w_px > max_w:
-            if cur:
-                lines.append(cur)
-                cur = ""
-            tmp = ""
-            for ch in w:
-                test = tmp + ch
-                if _width(test) <= max_w or not tmp:
-                    tmp = test
-                else:
-                    lines.append(tmp)
-                    tmp = ch
-            if tmp:
-                cur = tmp
-        else:
-            test = (cur + " " + w).strip()
-            if _width(test) <= max_w or not cur:
-                cur = test
+            if w_px > max_w:
+                if cur:
+                    lines.append(cur)
+                pieces = _split_long_word(w, font, max_w)
+                lines.extend(pieces[:-1])
+                cur = pieces[-1]
+                cur_w = font.text_width(cur)
+            elif not cur:
+                cur = w
+                cur_w = w_px
+            elif cur_w + space_w + w_px <= max_w:
+                cur = cur + " " + w
+                cur_w += space_w + w_px
             else:
                 lines.append(cur)
                 cur = w
+                cur_w = w_px
 
-    if cur:
         lines.append(cur)
 
-    if not lines:
-        lines = [""]
+    # sem linhas vazias sobrando no fim (texto terminado em \n)
+    while len(lines) > 1 and not lines[-1]:
+        lines.pop()
 
     return lines
 
-def _measure(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.ImageFont):
-    """ mede largura/altura de uma string respeitando Pillow novo/antigo """
+def _split_long_word(word: str, font: FontStack, max_w: int) -> list[str]:
+    """quebra uma palavra maior que max_w em pedaços (soma acumulada + busca binária)."""
+    cum = list(accumulate((font.advance(ch) for ch in word), initial=0.0))
+    pieces = []
+    i = 0
+    n = len(word)
+    while i < n:
+        # maior j com largura(word[i:j]) <= max_w; pelo menos 1 caractere por pedaço
+        j = bisect_right(cum, cum[i] + max_w) - 1
+        j = max(j, i + 1)
+        pieces.append(word[i:j])
+        i = j
+    return pieces
+
+def _measure(draw: ImageDraw.ImageDraw, text: str, font: FontStack):
+    """ mede largura (avanço) e altura (tinta) de uma string, somando as fontes de cada pedaço """
     if not text:
         return 0, 0
-    try:
-        bbox = draw.textbbox((0, 0), text, font=font)
-        return bbox[2] - bbox[0], bbox[3] - bbox[1]
-    except AttributeError:
-        return draw.textsize(text, font=font)
+    top, bottom = _ink_extent(text, font)
+    return math.ceil(font.length(text)), bottom - top
+
+def _ink_extent(text: str, font: FontStack):
+    """topo/base da tinta relativos à linha de base (topo negativo = acima dela)."""
+    top, bottom = 0, 0
+    for run, f in font.runs(text):
+        try:
+            bbox = f.getbbox(run, anchor="ls")
+        except (TypeError, ValueError, AttributeError):
+            continue
+        top = min(top, bbox[1])
+        bottom = max(bottom, bbox[3])
+    return top, bottom
 
 def _circle_avatar(avatar_img: Image.Image, size: int) -> Image.Image:
     av = avatar_img.convert("RGBA").resize((size, size), Image.LANCZOS)
@@ -153,12 +368,56 @@ def _initials_avatar(initials: str, size: int) -> Image.Image:
     # texto centralizado
     font = _load_font(int(size * 0.45))
     w, h = _measure(draw, initials, font)
+    top, _ = _ink_extent(initials, font)
     x = (size - w) // 2
-    y = (size - h) // 2 - 2
-    draw.text((x, y), initials, font=font, fill=(245, 246, 248, 255))
+    baseline = (size - h) // 2 - 2 - top
+    font.draw(draw, (x, baseline - font.ascent), initials, fill=(245, 246, 248, 255))
 
     return img
 
+def _line_gap(size: int) -> int:
+    """espaço entre linhas proporcional à fonte (8px no tamanho padrão 34)."""
+    return max(2, round(size * 8 / 34))
+
+def _text_block(draw: ImageDraw.ImageDraw, text: str, font: FontStack, max_w: int):
+    """quebra o texto e mede o bloco: (linhas, altura da linha, espaço entre linhas, altura total)."""
+    lines = _wrap_text(draw, text, font, max_w)
+    line_h = font.primary.getbbox("Ag")[3]
+    gap = _line_gap(font.size)
+    return lines, line_h, gap, len(lines) * line_h + (len(lines) - 1) * gap
+
+def _fit_font_size(draw: ImageDraw.ImageDraw, text: str, max_w: int, max_h: int, min_size: int, max_size: int) -> int:
+    """
+    Busca binária do maior tamanho de fonte cujo texto quebrado cabe em max_h.
+    Cada tentativa só quebra/mede (fontes e larguras vêm do cache), sem desenhar nada.
+    """
+    if _text_block(draw, text, _load_font(max_size), max_w)[3] <= max_h:
+        return max_size
+
+    lo, hi = min_size, max_size - 1
+    best = min_size
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if _text_block(draw, text, _load_font(mid), max_w)[3] <= max_h:
+            best = mid
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+def _truncate_lines(lines: list[str], font: FontStack, max_w: int, max_h: int, line_h: int, gap: int) -> list[str]:
+    """mantém só as linhas que cabem em max_h; a última ganha reticências."""
+    keep = max(1, (max_h + gap) // (line_h + gap))
+    if keep >= len(lines):
+        return lines
+    lines = lines[:keep]
+    last = lines[-1].rstrip()
+    ellipsis_w = font.text_width("…")
+    while last and font.text_width(last) + ellipsis_w > max_w:
+        last = last[:-1]
+    lines[-1] = last.rstrip() + "…"
+    return lines
+
 def make_quote_sticker(
     text: str,
     author_name: str | None = None,
@@ -170,6 +429,10 @@ def make_quote_sticker(
     txt_hex: str | None = None,# cor do texto
     show_avatar: bool = True,
     canvas_size: int = 512,
+    auto_fit: bool = True,     # diminui a fonte até o texto caber no canvas
+    font_size: int = 34,       # tamanho do texto (máximo, com auto_fit)
+    min_font_size: int = 16,
+    webp_profile: str | None = None,  # None = escolhe pela imagem
 ) -> bytes:
     # canvas transparente 512x512
     W = H = canvas_size
@@ -209,25 +472,15 @@ def make_quote_sticker(
             fg = tuple(int(txt_hex[i:i+2], 16) for i in (0, 2, 4)) + (255,)
 
     P = 6                              
-    AV = 140 if show_avatar else 0    
+    AV = AVATAR_SIZE if show_avatar else 0    
     GAP = 24 if AV else 0
     INNER_X = 22                    
     INNER_Y = 18                         
 
     font_name = _load_font(28)
-    font_text = _load_font(34)
 
     max_text_w = W - 2 * P - AV - GAP - 2 * INNER_X
 
-    lines = _wrap_text(draw, text, font_text, max_text_w)
-
-    line_h = font_text.getbbox("Ag")[3]
-    text_width_max = 0
-    for ln in lines:
-        w, _ = _measure(draw, ln, font_text)
-        if w > text_width_max:
-            text_width_max = w
-
     name_w = 0
     name_h = 0
     name_text_h = 0
@@ -239,11 +492,27 @@ def make_quote_sticker(
             badge_extra = font_name.size + 4  
             name_w += badge_extra + 8       
 
-    content_w = max(text_width_max, name_w)
+    # altura que sobra pro texto dentro da bolha sem sair do canvas
+    max_text_h = H - 2 * P - 2 * INNER_Y - name_h
 
-    text_block_h = 0
-    if lines:
-        text_block_h = len(lines) * line_h + (len(lines) - 1) * 8
+    text_size = font_size
+    if auto_fit:
+        text_size = _fit_font_size(draw, text, max_text_w, max_text_h, min_font_size, font_size)
+    font_text = _load_font(text_size)
+
+    lines, line_h, line_gap, text_block_h = _text_block(draw, text, font_text, max_text_w)
+    if auto_fit and text_block_h > max_text_h:
+        # nem no tamanho mínimo cabe: corta as linhas que sobram e termina com "…"
+        lines = _truncate_lines(lines, font_text, max_text_w, max_text_h, line_h, line_gap)
+        text_block_h = len(lines) * line_h + (len(lines) - 1) * line_gap
+
+    text_width_max = 0
+    for ln in lines:
+        w, _ = _measure(draw, ln, font_text)
+        if w > text_width_max:
+            text_width_max = w
+
+    content_w = max(text_width_max, name_w)
 
     box_h = max(AV, INNER_Y + name_h + text_block_h + INNER_Y)
 
@@ -283,7 +552,7 @@ def make_quote_sticker(
 
     if author_name:
         # desenha o nome
-        draw.text((cur_x, cur_y), author_name, font=font_name, fill=meta)
+        font_name.draw(draw, (cur_x, cur_y), author_name, fill=meta)
 
         if badge_img is not None:
             badge_size = font_name.size + 4
@@ -297,14 +566,12 @@ def make_quote_sticker(
         cur_y += name_h
 
     for i, ln in enumerate(lines):
-        draw.text(
-            (cur_x, cur_y + i * (line_h + 8)),
+        font_text.draw(
+            draw,
+            (cur_x, cur_y + i * (line_h + line_gap)),
             ln,
-            font=font_text,
             fill=fg
         )
 
-    bio = io.BytesIO()
-    out.save(bio, "WEBP", quality=95, method=6)
-    bio.seek(0)
-    return bio.read()
\ No newline at end of file
+    # bolha de quote é arte chapada: cai nos presets rápidos (sem perdas / flat)
+    return encode_webp(out, webp_profile)
\ No newline at end of file
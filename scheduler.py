@@ -0,0 +1,216 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+from executor import ConversionBusy
+from metrics import wait_stage
+
+# fila das figurinhas entre o /fig e os conversores:
+# - token bucket por chat e por usuário (segura flood de /fig);
+# - no máximo `slots` figurinhas em andamento; o resto espera na fila;
+# - a fila é justa: por prioridade (quote antes de estática antes de vídeo) e,
+#   dentro da mesma prioridade, um job de cada chat por vez (round-robin);
+# - fila cheia = ConversionBusy na hora (o bot responde "tenta de novo").
+
+# menor número = sai primeiro
+PRIORITY = {"quote": 0, "static": 1, "animated": 2}
+
+
+class RateLimited(RuntimeError):
+    """chat ou usuário passou do limite de figurinhas por minuto."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"calma aí, muita figurinha seguida. tenta de novo em {math.ceil(retry_after)}s")
+
+
+class TokenBucket:
+    """`rate` fichas por segundo, acumulando até `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        """segundos até ter 1 ficha (0 se já tem)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        slots: int,
+        max_queue: int,
+        chat_per_min: float = 20,
+        chat_burst: float = 10,
+        user_per_min: float = 6,
+        user_burst: float = 4,
+    ):
+        self.slots = max(1, slots)
+        self.max_queue = max(0, max_queue)
+        self.chat_rate = (chat_per_min / 60, chat_burst)
+        self.user_rate = (user_per_min / 60, user_burst)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._user_buckets: dict[int, TokenBucket] = {}
+        # prioridade -> chat_id -> fila de futures esperando vaga
+        self._queues: dict[int, OrderedDict[int, deque]] = {p: OrderedDict() for p in sorted(set(PRIORITY.values()))}
+        self._running = 0
+        self._queued = 0
+
+    @classmethod
+    def from_env(cls, default_slots: int) -> "FairScheduler":
+        """lê SCHED_SLOTS / SCHED_QUEUE_MAX / RATE_CHAT_* / RATE_USER_* do ambiente (.env)."""
+        slots = int(os.getenv("SCHED_SLOTS", "0")) or default_slots
+        return cls(
+            slots,
+            int(os.getenv("SCHED_QUEUE_MAX", str(slots * 8))),
+            float(os.getenv("RATE_CHAT_PER_MIN", "20")),
+            float(os.getenv("RATE_CHAT_BURST", "10")),
+            float(os.getenv("RATE_USER_PER_MIN", "6")),
+            float(os.getenv("RATE_USER_BURST", "4")),
+        )
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def queued_by_kind(self) -> dict[str, int]:
+        by_prio = {p: sum(len(q) for q in chats.values()) for p, chats in self._queues.items()}
+        return {kind: by_prio[p] for kind, p in PRIORITY.items()}
+
+    def queued_by_chat(self) -> dict[int, int]:
+        out: dict[int, int] = {}
+        for chats in self._queues.values():
+            for chat_id, q in chats.items():
+                out[chat_id] = out.get(chat_id, 0) + len(q)
+        return out
+
+    # ------------------------------------------------------------ limite de taxa
+
+    def _bucket(self, table: dict, key: int, rate: tuple[float, float], now: float) -> TokenBucket:
+        b = table.get(key)
+        if b is None:
+            if len(table) > 4096:
+                # esquece quem já está com o balde cheio (não faz diferença guardar)
+                for k in [k for k, v in table.items() if v.full(now)]:
+                    del table[k]
+            b = table[key] = TokenBucket(*rate)
+        return b
+
+    def admit(self, chat_id: int, user_id: int | None):
+        """gasta uma ficha do chat e do usuário; RateLimited se algum estiver sem."""
+        now = time.monotonic()
+        buckets = [self._bucket(self._chat_buckets, chat_id, self.chat_rate, now)]
+        if user_id is not None:
+            buckets.append(self._bucket(self._user_buckets, user_id, self.user_rate, now))
+        wait = max(b.wait_time(now) for b in buckets)
+        if wait > 0:
+            raise RateLimited(wait)
+        for b in buckets:
+            b.take()
+
+    async def acquire(self, chat_id: int, user_id: int | None, max_wait: float):
+        """
+        Como o admit, mas espera a ficha (até max_wait segundos) em vez de recusar.
+        Usado por pedidos com vários itens (/pack), que pagam uma ficha por item.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            now = time.monotonic()
+            buckets = [self._bucket(self._chat_buckets, chat_id, self.chat_rate, now)]
+            if user_id is not None:
+                buckets.append(self._bucket(self._user_buckets, user_id, self.user_rate, now))
+            wait = max(b.wait_time(now) for b in buckets)
+            if wait <= 0:
+                for b in buckets:
+                    b.take()
+                return
+            if now + wait > deadline:
+                raise RateLimited(wait)
+            await asyncio.sleep(wait)
+
+    # ------------------------------------------------------------ fila justa
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        for chats in self._queues.values():
+            while chats:
+                chat_id, q = next(iter(chats.items()))
+                fut = q.popleft()
+                if q:
+                    chats.move_to_end(chat_id)
+                else:
+                    del chats[chat_id]
+                self._queued -= 1
+                if not fut.done():
+                    return fut
+        return None
+
+    def _release(self):
+        fut = self._next_waiter()
+        if fut is None:
+            self._running -= 1
+        else:
+            # passa a vaga direto pro próximo (running continua igual)
+            fut.set_result(None)
+
+    def _remove(self, prio: int, chat_id: int, fut: asyncio.Future):
+        q = self._queues[prio].get(chat_id)
+        if q is None:
+            return
+        try:
+            q.remove(fut)
+        except ValueError:
+            return
+        self._queued -= 1
+        if not q:
+            del self._queues[prio][chat_id]
+
+    async def run(self, chat_id: int, kind: str, factory):
+        """espera vaga (respeitando prioridade/round-robin) e roda `await factory()`."""
+        prio = PRIORITY.get(kind, max(PRIORITY.values()))
+        if self._running < self.slots and not self._queued:
+            self._running += 1
+        else:
+            if self._queued >= self.max_queue:
+                raise ConversionBusy("tô com muitas figurinhas na fila agora, tenta de novo daqui a pouco")
+            fut = asyncio.get_running_loop().create_future()
+            self._queues[prio].setdefault(chat_id, deque()).append(fut)
+            self._queued += 1
+            try:
+                with wait_stage("sched_wait"):
+                    await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # já tinha ganhado a vaga quando foi cancelado: devolve
+                    self._release()
+                else:
+                    self._remove(prio, chat_id, fut)
+                raise
+        try:
+            return await factory()
+        finally:
+            self._release()
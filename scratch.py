@@ -0,0 +1,354 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # windows: a trava vale só dentro do processo
+    fcntl = None
+
+from dotenv import load_dotenv
+
+# espaço temporário das conversões (entrada do ffmpeg que precisa de seek, saída
+# em arquivo, vídeo pro opencv):
+# - cada job ganha uma pasta própria (mkdtemp), apagada inteira no fim do job;
+# - usa /dev/shm (RAM) quando existe e dá pra escrever, senão data/stickers_tmp;
+# - cota total em bytes: gravar além dela dá ScratchQuotaExceeded. a conferência
+#   e a reserva (arquivo já criado com o tamanho final) acontecem sob uma trava de
+#   arquivo, então o bot e os workers do pool não passam juntos da cota;
+# - o uso vem de um livro-caixa (.quota.ledger: bytes/arquivos reservados por job),
+#   atualizado na reserva e no fim do job; só a faxina percorre a pasta de verdade
+#   (e corrige o livro com o que o ffmpeg gravou sem reservar ou job que morreu);
+# - faxina (janitor) apaga o que ficou pra trás (job que morreu no meio, arquivos
+#   do esquema antigo) mais velho que SCRATCH_MAX_AGE, ao iniciar e de tempos em tempos.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"), override=True)
+
+LEGACY_DIR = os.path.join(BASE_DIR, "data", "stickers_tmp")
+SHM_DIR = "/dev/shm"
+LOCK_NAME = ".quota.lock"
+LEDGER_NAME = ".quota.ledger"
+# chave do livro-caixa pros arquivos soltos na raiz (fora de pasta de job)
+LOOSE_KEY = "."
+
+SCRATCH_QUOTA_MB = float(os.getenv("SCRATCH_QUOTA_MB", "512"))
+SCRATCH_MAX_AGE = float(os.getenv("SCRATCH_MAX_AGE", "3600"))
+SCRATCH_JANITOR_SECONDS = float(os.getenv("SCRATCH_JANITOR_SECONDS", "600"))
+
+
+class ScratchQuotaExceeded(RuntimeError):
+    """espaço temporário cheio; o job deve falhar com mensagem de tentar depois."""
+
+    def __init__(self, message: str, pid: int | None = None):
+        super().__init__(message)
+        # processo que recusou (o bot só conta as recusas que vieram dos workers)
+        self.pid = os.getpid() if pid is None else pid
+
+    def __reduce__(self):
+        return self.__class__, (str(self), self.pid)
+
+
+def _writable_dir(path: str) -> bool:
+    try:
+        os.makedirs(path, exist_ok=True)
+        fd, probe = tempfile.mkstemp(dir=path)
+        os.close(fd)
+        os.remove(probe)
+        return True
+    except OSError:
+        return False
+
+
+def _pick_root() -> str:
+    configured = os.getenv("SCRATCH_DIR", "").strip()
+    if configured:
+        return configured
+    shm = os.path.join(SHM_DIR, "dinasticker")
+    if os.path.isdir(SHM_DIR) and _writable_dir(shm):
+        return shm
+    return LEGACY_DIR
+
+
+def _internal(name: str) -> bool:
+    """trava e livro-caixa da cota (nunca contam nem são apagados pela faxina)."""
+    return name.startswith(".quota")
+
+
+def _tree_usage(path: str) -> tuple[int, int]:
+    """(arquivos, bytes) de tudo dentro de path."""
+    files = 0
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif not _internal(entry.name):
+                        files += 1
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    return files, total
+
+
+class ScratchJob:
+    """pasta de um job; os arquivos somem junto com ela no fim do `with`."""
+
+    def __init__(self, space: "ScratchSpace", path: str):
+        self.space = space
+        self.dir = path
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def write(self, name: str, data: bytes) -> str:
+        """grava data em name (respeitando a cota) e devolve o caminho."""
+        p = self.path(name)
+        with self.space.reserve(p, len(data)) as f:
+            f.write(data)
+        return p
+
+
+class ScratchSpace:
+    def __init__(self, root: str, quota_bytes: int, max_age: float):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self.in_ram = os.path.realpath(root).startswith(SHM_DIR + os.sep)
+        self.jobs = 0
+        self.swept = 0
+        self.quota_rejections = 0
+        # última leitura do livro-caixa (os gauges leem daqui, sem I/O)
+        self.last_usage = (0, 0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ScratchSpace":
+        """lê SCRATCH_DIR / SCRATCH_QUOTA_MB / SCRATCH_MAX_AGE do ambiente (.env)."""
+        return cls(_pick_root(), int(SCRATCH_QUOTA_MB * 1024 * 1024), SCRATCH_MAX_AGE)
+
+    def usage(self) -> tuple[int, int]:
+        """(arquivos, bytes) reservados agora, pelo livro-caixa."""
+        with self._quota_lock():
+            return self._totals(self._load_ledger())
+
+    def refresh_usage(self):
+        """relê o livro-caixa pra last_usage (rodar fora do loop, antes de mostrar as métricas)."""
+        self.usage()
+
+    def _totals(self, ledger: dict) -> tuple[int, int]:
+        self.last_usage = (sum(v[0] for v in ledger.values()), sum(v[1] for v in ledger.values()))
+        return self.last_usage
+
+    def _ledger_path(self) -> str:
+        return os.path.join(self.root, LEDGER_NAME)
+
+    def _scan(self) -> dict[str, list[int]]:
+        """uso real de cada pasta de job (e dos arquivos soltos na raiz): percorre tudo."""
+        found: dict[str, list[int]] = {}
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return found
+        for entry in entries:
+            if _internal(entry.name):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    found[entry.name] = list(_tree_usage(entry.path))
+                else:
+                    loose = found.setdefault(LOOSE_KEY, [0, 0])
+                    loose[0] += 1
+                    loose[1] += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+        return found
+
+    def _load_ledger(self) -> dict[str, list[int]]:
+        """lê o livro-caixa (com a trava); sem ele ainda (1ª vez, /dev/shm depois de reiniciar) monta percorrendo a pasta."""
+        try:
+            with open(self._ledger_path(), encoding="utf-8") as f:
+                ledger = json.load(f)
+            if isinstance(ledger, dict):
+                return ledger
+        except (OSError, ValueError):
+            pass
+        ledger = self._scan()
+        self._save_ledger(ledger)
+        return ledger
+
+    def _save_ledger(self, ledger: dict[str, list[int]]):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self._ledger_path()}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(ledger, f)
+        os.replace(tmp, self._ledger_path())
+        self._totals(ledger)
+
+    def _job_key(self, path: str) -> str:
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        return parts[0] if len(parts) > 1 else LOOSE_KEY
+
+    @contextmanager
+    def _quota_lock(self):
+        """trava entre threads (e, com fcntl, entre processos) pra conferir+reservar junto."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, LOCK_NAME), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def reserve(self, path: str, nbytes: int):
+        """
+        Confere a cota e já cria `path` com nbytes (o espaço fica reservado pra
+        quem vier depois); devolve o arquivo aberto no início pra gravar.
+        """
+        key = self._job_key(path)
+        with self._quota_lock():
+            ledger = self._load_ledger()
+            if self.quota_bytes > 0:
+                _, used = self._totals(ledger)
+                if used + nbytes > self.quota_bytes:
+                    self.quota_rejections += 1
+                    raise ScratchQuotaExceeded("sem espaço temporário agora, tenta de novo daqui a pouco")
+            files, used_by_job = ledger.get(key, (0, 0))
+            ledger[key] = [files + 1, used_by_job + nbytes]
+            self._save_ledger(ledger)
+            f = open(path, "wb")
+            try:
+                f.truncate(nbytes)
+            except BaseException:
+                f.close()
+                raise
+        return f
+
+    def release(self, job_dir: str):
+        """tira do livro-caixa o que o job reservou (a pasta já foi apagada)."""
+        key = os.path.basename(job_dir)
+        with self._quota_lock():
+            ledger = self._load_ledger()
+            if ledger.pop(key, None) is not None:
+                self._save_ledger(ledger)
+
+    def record_rejection(self, e: ScratchQuotaExceeded):
+        """conta no /cache uma recusa que aconteceu num worker do pool."""
+        if e.pid != os.getpid():
+            self.quota_rejections += 1
+
+    @contextmanager
+    def job(self, prefix: str = "job_"):
+        os.makedirs(self.root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+        self.jobs += 1
+        try:
+            yield ScratchJob(self, path)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+            self.release(path)
+
+    @asynccontextmanager
+    async def job_async(self, prefix: str = "job_"):
+        """igual ao job(), mas criando e apagando a pasta fora do loop (asyncio.to_thread)."""
+        await asyncio.to_thread(os.makedirs, self.root, exist_ok=True)
+        path = await asyncio.to_thread(tempfile.mkdtemp, prefix=prefix, dir=self.root)
+        self.jobs += 1
+        try:
+            yield ScratchJob(self, path)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, path, ignore_errors=True)
+            await asyncio.to_thread(self.release, path)
+
+    def sweep(self, max_age: float | None = None) -> int:
+        """
+        Apaga entradas (arquivos e pastas de job) mais velhas que max_age segundos
+        e acerta o livro-caixa com o uso real. devolve quantas apagou.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        cutoff = time.time() - max_age
+        removed = 0
+        for root in {self.root, LEGACY_DIR}:
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                if _internal(entry.name):
+                    continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+        self.swept += removed
+        self.reconcile()
+        return removed
+
+    def reconcile(self):
+        """
+        Acerta o livro-caixa pelo que está na pasta: job que já não existe sai,
+        job vivo fica com o maior entre o reservado e o real (saída do ffmpeg não
+        passa pela reserva). percorre a pasta fora da trava.
+        """
+        found = self._scan()
+        with self._quota_lock():
+            ledger = self._load_ledger()
+            fixed = {}
+            for key in set(ledger) | set(found):
+                if key == LOOSE_KEY:
+                    if key in found:
+                        fixed[key] = found[key]
+                elif os.path.isdir(os.path.join(self.root, key)):
+                    reserved, real = ledger.get(key, (0, 0)), found.get(key, (0, 0))
+                    fixed[key] = [max(reserved[0], real[0]), max(reserved[1], real[1])]
+            self._save_ledger(fixed)
+
+    def stats(self) -> dict:
+        files, used = self.usage()
+        return {
+            "root": self.root,
+            "in_ram": self.in_ram,
+            "files": files,
+            "bytes": used,
+            "quota_bytes": self.quota_bytes,
+            "jobs": self.jobs,
+            "swept": self.swept,
+            "quota_rejections": self.quota_rejections,
+        }
+
+
+async def janitor(space: ScratchSpace, interval: float = SCRATCH_JANITOR_SECONDS):
+    """faxina ao iniciar e depois a cada `interval` segundos (task do bot)."""
+    while True:
+        removed = await asyncio.to_thread(space.sweep)
+        if removed:
+            print(f"scratch: {removed} sobra(s) de job apagada(s) em {space.root}")
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+
+# um por processo (bot e cada worker do pool)
+SCRATCH = ScratchSpace.from_env()
@@ -0,0 +1,81 @@
+import os
+import re
+from typing import Mapping, NamedTuple
+
+# como o bot recebe os updates: polling (padrão) ou webhook, tudo pelo .env.
+# só lê e valida as configurações (não importa o telegram nem precisa de BOT_TOKEN).
+
+# só o que os handlers usam: comandos (message) e entrada/saída do bot em grupos
+ALLOWED_UPDATES = ["message", "my_chat_member"]
+
+_SECRET_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+
+class ServeSettings(NamedTuple):
+    webhook: bool
+    concurrent_updates: int
+    listen: str = "127.0.0.1"
+    port: int = 8443
+    url_path: str = "telegram"
+    webhook_url: str | None = None
+    secret_token: str | None = None
+    drop_pending_updates: bool = False
+    allowed_updates: tuple[str, ...] = tuple(ALLOWED_UPDATES)
+
+
+def _flag(value: str | None) -> bool:
+    return (value or "").strip().lower() in {"1", "true", "yes", "sim", "on"}
+
+
+def load_serve_settings(env: Mapping[str, str] | None = None) -> ServeSettings:
+    """
+    Monta as configurações a partir do ambiente (ou de um dict, pra teste).
+
+    WEBHOOK_URL definido = modo webhook. A URL pública final é WEBHOOK_URL com
+    WEBHOOK_PATH no fim (se ainda não tiver). WEBHOOK_SECRET vira o secret_token
+    que o Telegram manda no header X-Telegram-Bot-Api-Secret-Token.
+    """
+    env = os.environ if env is None else env
+    concurrent = int(env.get("CONCURRENT_UPDATES", "16") or 1)
+    if concurrent < 1:
+        raise ValueError("CONCURRENT_UPDATES precisa ser >= 1")
+    drop_pending = _flag(env.get("DROP_PENDING_UPDATES"))
+
+    base_url = (env.get("WEBHOOK_URL") or "").strip()
+    if not base_url:
+        return ServeSettings(webhook=False, concurrent_updates=concurrent, drop_pending_updates=drop_pending)
+
+    if not base_url.startswith("https://"):
+        raise ValueError("WEBHOOK_URL precisa ser https:// (o Telegram só chama webhook com TLS)")
+    url_path = (env.get("WEBHOOK_PATH") or "telegram").strip().strip("/")
+    webhook_url = base_url.rstrip("/")
+    if not webhook_url.endswith("/" + url_path):
+        webhook_url = f"{webhook_url}/{url_path}"
+
+    secret = (env.get("WEBHOOK_SECRET") or "").strip() or None
+    if secret is not None and not _SECRET_RE.match(secret):
+        raise ValueError("WEBHOOK_SECRET só pode ter A-Z, a-z, 0-9, _ e - (até 256 caracteres)")
+
+    return ServeSettings(
+        webhook=True,
+        concurrent_updates=concurrent,
+        listen=(env.get("WEBHOOK_LISTEN") or "127.0.0.1").strip(),
+        port=int(env.get("WEBHOOK_PORT") or 8443),
+        url_path=url_path,
+        webhook_url=webhook_url,
+        secret_token=secret,
+        drop_pending_updates=drop_pending,
+    )
+
+
+def webhook_kwargs(settings: ServeSettings) -> dict:
+    """argumentos de Application.run_webhook / Updater.start_webhook pro modo webhook."""
+    return {
+        "listen": settings.listen,
+        "port": settings.port,
+        "url_path": settings.url_path,
+        "webhook_url": settings.webhook_url,
+        "secret_token": settings.secret_token,
+        "allowed_updates": list(settings.allowed_updates),
+        "drop_pending_updates": settings.drop_pending_updates,
+    }
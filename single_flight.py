@@ -0,0 +1,72 @@
+import asyncio
+
+# junta pedidos iguais que chegam ao mesmo tempo (vários /fig na mesma mídia):
+# o primeiro roda o trabalho, os outros esperam o mesmo resultado.
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Registro de trabalhos em andamento por chave.
+
+    - `await sf.run(key, factory)`: se já tem um trabalho com essa chave rodando,
+      espera ele; senão cria a task com `factory()`;
+    - erro do trabalho chega igual pra todo mundo que estava esperando;
+    - cancelar um dos que esperam não cancela o trabalho dos outros; o trabalho
+      só é cancelado quando não sobra ninguém esperando;
+    - a chave sai do registro assim que o trabalho termina (não é cache).
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.started = 0
+        self.joined = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    def running(self, key) -> bool:
+        return key in self._calls
+
+    def _forget(self, key, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def run(self, key, factory):
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            self.started += 1
+            call.task.add_done_callback(lambda t, k=key, c=call: self._on_done(k, c))
+        else:
+            self.joined += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.task.cancelled():
+                # o trabalho foi cancelado de verdade (não só quem esperava)
+                raise
+            if call.waiters == 1 and not call.task.done():
+                # último interessado desistiu: cancela e tira do registro já,
+                # pra um pedido novo não pegar carona num trabalho morrendo
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _on_done(self, key, call: _Call):
+        self._forget(key, call)
+        # evita "Task exception was never retrieved" quando todo mundo já desistiu
+        if not call.task.cancelled():
+            call.task.exception()
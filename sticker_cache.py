@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# cache das figurinhas já convertidas, endereçado pelo conteúdo:
+# chave = sha256(bytes de entrada) + sha256(parâmetros da conversão)
+# - 1º nível: LRU em memória (limitado em bytes)
+# - 2º nível: arquivos em disco (limitado em bytes, despejo pelo menos usado)
+
+
+class StickerCache:
+    def __init__(self, disk_dir: str, mem_max_bytes: int = 32 * 1024 * 1024, disk_max_bytes: int = 256 * 1024 * 1024):
+        self.disk_dir = disk_dir
+        self.mem_max_bytes = mem_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        self._mem: OrderedDict[str, bytes] = OrderedDict()
+        self._mem_bytes = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()  # chave -> tamanho, do mais antigo pro mais recente
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(disk_dir, exist_ok=True)
+        self._load_disk_index()
+
+    @classmethod
+    def from_env(cls, disk_dir: str) -> "StickerCache":
+        """lê STICKER_CACHE_MEM_MB / STICKER_CACHE_DISK_MB do ambiente (.env)."""
+        mem_mb = float(os.getenv("STICKER_CACHE_MEM_MB", "32"))
+        disk_mb = float(os.getenv("STICKER_CACHE_DISK_MB", "256"))
+        return cls(disk_dir, int(mem_mb * 1024 * 1024), int(disk_mb * 1024 * 1024))
+
+    @staticmethod
+    def make_key(input_bytes: bytes, params: dict) -> str:
+        """hash da entrada + hash dos parâmetros (tipo, tamanho, fps, bitrate, encoder...)."""
+        data_h = hashlib.sha256(input_bytes).hexdigest()
+        params_h = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return f"{data_h[:40]}_{params_h[:16]}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".bin")
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                return data
+
+            if key in self._disk:
+                try:
+                    with open(self._path(key), "rb") as f:
+                        data = f.read()
+                    os.utime(self._path(key))
+                except OSError:
+                    self._drop_disk(key)
+                    data = None
+                if data is not None:
+                    self._disk.move_to_end(key)
+                    self._put_mem(key, data)
+                    self.hits_disk += 1
+                    return data
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._put_mem(key, data)
+            if key in self._disk or len(data) > self.disk_max_bytes:
+                return
+            tmp = self._path(key) + ".tmp"
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, self._path(key))
+            except OSError:
+                return
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._evict_disk()
+
+    def _put_mem(self, key: str, data: bytes):
+        if len(data) > self.mem_max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old)
+        self._mem[key] = data
+        self._mem_bytes += len(data)
+        while self._mem_bytes > self.mem_max_bytes and self._mem:
+            _, dropped = self._mem.popitem(last=False)
+            self._mem_bytes -= len(dropped)
+            self.evictions += 1
+
+    def _drop_disk(self, key: str):
+        size = self._disk.pop(key, 0)
+        self._disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key = next(iter(self._disk))
+            self._drop_disk(key)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_mem + self.hits_disk + self.misses
+            return {
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_mem + self.hits_disk) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "mem_items": len(self._mem),
+                "mem_bytes": self._mem_bytes,
+                "disk_items": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
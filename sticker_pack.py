@@ -0,0 +1,297 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, NamedTuple
+
+from telegram import InputFile, InputSticker
+from telegram.error import BadRequest, RetryAfter
+
+# /pack: monta (ou completa) o pacote de figurinhas do usuário a partir de um
+# álbum ou de várias mídias seguidas:
+# - as mídias que passam pelo chat ficam um tempo em RecentMedia (o Bot API não
+#   deixa buscar mensagem antiga, então o álbum tem que ser lembrado na chegada);
+# - as conversões rodam em paralelo (até PACK_CONCURRENCY por /pack) e, enquanto
+#   as próximas convertem, as prontas já vão subindo pro pacote, na ordem do álbum;
+# - respeita o limite de figurinhas por pacote e espera o RetryAfter do Telegram.
+#
+# build_pack só usa get_sticker_set / create_new_sticker_set / add_sticker_to_set
+# do bot, então dá pra testar com um bot falso.
+
+# limite do Telegram por pacote de figurinhas comum (estáticas e de vídeo misturadas)
+PACK_MAX_STICKERS = int(os.getenv("PACK_MAX_STICKERS", "120"))
+# no máximo quantas mídias por /pack
+PACK_MAX_ITEMS = int(os.getenv("PACK_MAX_ITEMS", "50"))
+# conversões simultâneas de um /pack (o resto espera a vez dele)
+PACK_CONCURRENCY = int(os.getenv("PACK_CONCURRENCY", "3"))
+# quanto tempo (s) uma mídia fica lembrada e o intervalo máximo entre mídias de uma "rajada"
+PACK_MEDIA_TTL = float(os.getenv("PACK_MEDIA_TTL", "900"))
+PACK_BURST_SECONDS = float(os.getenv("PACK_BURST_SECONDS", "20"))
+# emoji de cada figurinha no pacote
+PACK_EMOJI = os.getenv("PACK_EMOJI", "🙂").strip() or "🙂"
+# cada item do /pack gasta uma ficha do limite de /fig do chat/usuário; espera no
+# máximo isso (s) por uma ficha antes de desistir do item
+PACK_RATE_MAX_WAIT = float(os.getenv("PACK_RATE_MAX_WAIT", "600"))
+# quantas vezes tenta de novo depois de um RetryAfter (flood control)
+PACK_RETRIES = int(os.getenv("PACK_RETRIES", "5"))
+# teto de espera de um RetryAfter; acima disso desiste
+PACK_MAX_RETRY_WAIT = float(os.getenv("PACK_MAX_RETRY_WAIT", "120"))
+
+TITLE_MAX = 64
+NAME_MAX = 64
+
+
+class PackError(RuntimeError):
+    """o pacote não pôde ser montado; a mensagem já é pro usuário."""
+
+
+class PackBusy(PackError):
+    """já tem um /pack em andamento pro mesmo pacote."""
+
+
+class PackResult(NamedTuple):
+    name: str
+    created: bool              # o pacote foi criado agora
+    added: int                 # figurinhas que entraram
+    failed: list[tuple[int, str]]  # (posição no álbum, motivo)
+    skipped: int               # ficaram de fora pelo limite do pacote
+    total: int                 # figurinhas no pacote ao final
+    retries: int               # RetryAfter esperados
+
+
+# ---------------------------------------------------------------- mídias recentes
+
+class _Seen(NamedTuple):
+    message_id: int
+    user_id: int | None
+    when: float
+    group_id: str | None
+    item: object
+
+
+class RecentMedia:
+    """últimas mídias de cada chat (por message_id), pra achar o álbum/rajada no /pack."""
+
+    def __init__(self, ttl: float = PACK_MEDIA_TTL, per_chat: int = 200):
+        self.ttl = ttl
+        self.per_chat = per_chat
+        self._chats: dict[int, OrderedDict[int, _Seen]] = {}
+
+    def __len__(self):
+        return sum(len(c) for c in self._chats.values())
+
+    def _prune(self, chat_id: int, now: float):
+        seen = self._chats.get(chat_id)
+        if seen is None:
+            return
+        while seen and (len(seen) > self.per_chat or next(iter(seen.values())).when < now - self.ttl):
+            seen.popitem(last=False)
+        if not seen:
+            del self._chats[chat_id]
+
+    def add(self, chat_id: int, message_id: int, user_id: int | None, when: float, group_id: str | None, item):
+        self._chats.setdefault(chat_id, OrderedDict())[message_id] = _Seen(message_id, user_id, when, group_id, item)
+        self._prune(chat_id, time.time())
+
+    def album(self, chat_id: int, group_id: str) -> list:
+        """itens do álbum (media_group_id), na ordem das mensagens."""
+        self._prune(chat_id, time.time())
+        seen = self._chats.get(chat_id, {})
+        return [s.item for s in sorted(seen.values()) if s.group_id == group_id]
+
+    def burst(self, chat_id: int, message_id: int, window: float = PACK_BURST_SECONDS) -> list:
+        """
+        Mídias seguidas do mesmo usuário em volta de message_id, com no máximo
+        `window` segundos entre uma e outra. Vazio se message_id não foi visto.
+        """
+        self._prune(chat_id, time.time())
+        entries = sorted(self._chats.get(chat_id, {}).values())
+        pos = next((i for i, s in enumerate(entries) if s.message_id == message_id), None)
+        if pos is None:
+            return []
+        user = entries[pos].user_id
+        lo = hi = pos
+        while lo > 0 and entries[lo - 1].user_id == user and entries[lo].when - entries[lo - 1].when <= window:
+            lo -= 1
+        while hi + 1 < len(entries) and entries[hi + 1].user_id == user and entries[hi + 1].when - entries[hi].when <= window:
+            hi += 1
+        return [s.item for s in entries[lo:hi + 1]]
+
+
+# ---------------------------------------------------------------- nome / título
+
+def pack_name(user_id: int, bot_username: str) -> str:
+    """nome (link t.me/addstickers/...) do pacote do usuário; o Telegram exige o sufixo _by_<bot>."""
+    name = f"dina{abs(user_id)}_by_{bot_username}"
+    if len(name) > NAME_MAX or not re.fullmatch(r"[A-Za-z][A-Za-z0-9_]*", name) or "__" in name:
+        raise PackError(f"não dá pra montar um nome de pacote válido com o bot @{bot_username}")
+    return name
+
+
+def pack_title(text: str | None, fallback: str) -> str:
+    title = " ".join((text or "").split()) or fallback
+    return title[:TITLE_MAX]
+
+
+# ---------------------------------------------------------------- chamadas ao Bot API
+
+def _retry_seconds(e: RetryAfter) -> float:
+    wait = e.retry_after
+    return float(wait.total_seconds() if hasattr(wait, "total_seconds") else wait)
+
+
+async def with_retry(call: Callable[[], Awaitable], *, retries: int = PACK_RETRIES, on_retry=None):
+    """`await call()`; em RetryAfter espera o tempo pedido e tenta de novo (até `retries` vezes)."""
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except RetryAfter as e:
+            wait = _retry_seconds(e)
+            if attempt >= retries or wait > PACK_MAX_RETRY_WAIT:
+                raise PackError(f"o Telegram pediu pra esperar {wait:.0f}s, tenta o /pack de novo depois") from e
+            attempt += 1
+            if on_retry is not None:
+                on_retry(wait)
+            await asyncio.sleep(wait + 0.5)
+
+
+def _user_problem(e: BadRequest) -> bool:
+    """erro do usuário/pacote (não da figurinha): não adianta tentar com a próxima."""
+    text = (e.message or "").lower()
+    return any(k in text for k in ("peer_id_invalid", "user not found", "bot was blocked", "user_is_bot"))
+
+
+def _friendly(e: BadRequest) -> str:
+    text = (e.message or "").lower()
+    if _user_problem(e):
+        return "me chama no privado e manda /start primeiro (o Telegram só cria pacote de quem já falou comigo)"
+    if "stickers_too_much" in text:
+        return "o pacote já está cheio"
+    if "sticker_video_long" in text or "sticker_video_big" in text:
+        return "vídeo longo ou grande demais pra figurinha"
+    return e.message
+
+
+async def sticker_set_count(bot, name: str) -> int | None:
+    """quantas figurinhas o pacote tem (None se ainda não existe)."""
+    try:
+        sticker_set = await with_retry(lambda: bot.get_sticker_set(name))
+    except BadRequest as e:
+        if "invalid" in (e.message or "").lower() or "not found" in (e.message or "").lower():
+            return None
+        raise PackError(_friendly(e)) from e
+    return len(sticker_set.stickers)
+
+
+# ---------------------------------------------------------------- montagem
+
+# pacotes com /pack em andamento (dois ao mesmo tempo brigariam pra criar o mesmo)
+_BUILDING: set[str] = set()
+
+
+def _input_sticker(data: bytes, animated: bool, emoji: str) -> InputSticker:
+    filename = "sticker.webm" if animated else "sticker.webp"
+    return InputSticker(
+        sticker=InputFile(bytes(data), filename=filename),
+        emoji_list=[emoji],
+        format="video" if animated else "static",
+    )
+
+
+async def build_pack(
+    bot,
+    user_id: int,
+    name: str,
+    title: str,
+    items: list,
+    convert: Callable[[object], Awaitable[tuple[bytes, bool]]],
+    *,
+    emoji: str = PACK_EMOJI,
+    concurrency: int = PACK_CONCURRENCY,
+    max_stickers: int = PACK_MAX_STICKERS,
+    on_progress: Callable[[int, int], Awaitable] | None = None,
+) -> PackResult:
+    """
+    Converte `items` (convert(item) -> (bytes, animada)) e coloca no pacote `name`,
+    criando se ainda não existir. Sobe na ordem de `items`, mas sem esperar todas
+    as conversões: a i-ésima sobe enquanto as seguintes ainda convertem.
+    on_progress(processadas, total) é chamado depois de cada item. Se o Telegram
+    desistir no meio (flood control longo, usuário bloqueou o bot) depois de alguma
+    já ter entrado, para ali e devolve o pacote parcial com o resto em `failed`.
+    """
+    if name in _BUILDING:
+        raise PackBusy("já tô montando esse pacote, espera terminar")
+    _BUILDING.add(name)
+    try:
+        existing = await sticker_set_count(bot, name)
+        room = max_stickers - (existing or 0)
+        if room <= 0:
+            raise PackError(f"o pacote já tem {existing} figurinhas (o limite do Telegram é {max_stickers})")
+        todo = items[:room]
+        skipped = len(items) - len(todo)
+
+        retries = 0
+
+        def _count_retry(_wait: float):
+            nonlocal retries
+            retries += 1
+
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def _convert(item):
+            async with sem:
+                return await convert(item)
+
+        tasks = [asyncio.ensure_future(_convert(item)) for item in todo]
+        created = False
+        added = 0
+        failed: list[tuple[int, str]] = []
+        try:
+            for pos, task in enumerate(tasks, start=1):
+                try:
+                    data, animated = await task
+                except Exception as e:
+                    failed.append((pos, str(e) or type(e).__name__))
+                else:
+                    sticker = _input_sticker(data, animated, emoji)
+                    try:
+                        if existing is None:
+                            await with_retry(
+                                lambda: bot.create_new_sticker_set(user_id, name, title, [sticker]),
+                                on_retry=_count_retry,
+                            )
+                            existing = 0
+                            created = True
+                        else:
+                            await with_retry(
+                                lambda: bot.add_sticker_to_set(user_id, name, sticker),
+                                on_retry=_count_retry,
+                            )
+                        added += 1
+                    except BadRequest as e:
+                        if not _user_problem(e):
+                            # figurinha recusada: segue (sem pacote ainda, a próxima tenta criar)
+                            failed.append((pos, _friendly(e)))
+                        elif not added:
+                            raise PackError(_friendly(e)) from e
+                        else:
+                            failed.extend((p, _friendly(e)) for p in range(pos, len(tasks) + 1))
+                            break
+                    except PackError as e:
+                        # desistiu no meio (flood control longo): o que já subiu fica no resultado
+                        if not added:
+                            raise
+                        failed.extend((p, str(e)) for p in range(pos, len(tasks) + 1))
+                        break
+                if on_progress is not None:
+                    await on_progress(pos, len(tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return PackResult(name, created, added, failed, skipped, (existing or 0) + added, retries)
+    finally:
+        _BUILDING.discard(name)
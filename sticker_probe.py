@@ -0,0 +1,203 @@
+import struct
+from typing import NamedTuple
+
+from converter import STICKER_SIZE, WEBM_FPS, WEBM_MAX_BYTES, WEBM_SECONDS
+from webp_encoder import WEBP_MAX_BYTES
+
+# confere só pelo cabeçalho (sem decodificar nada) se a mídia já é uma figurinha
+# válida pro Telegram; aí o /fig manda como veio (ou só remuxa sem áudio) em vez
+# de passar pelo Pillow/ffmpeg de novo.
+#
+# regras do Telegram:
+# - estática: WebP não animado, um lado com 512 px e o outro <= 512, até 512 KB;
+# - vídeo: WebM VP9, um lado com 512 px e o outro <= 512, até 3s, até 30 fps,
+#   sem áudio, até 256 KB.
+
+
+class ProbeInfo(NamedTuple):
+    kind: str              # "webp" | "webm"
+    width: int
+    height: int
+    animated: bool = False
+    codec: str = ""
+    duration: float | None = None   # segundos
+    fps: float | None = None
+    has_audio: bool = False
+
+
+# ---------------------------------------------------------------- WebP
+
+def probe_webp(data: bytes) -> ProbeInfo | None:
+    """lê as dimensões do WebP pelo 1º chunk (VP8 / VP8L / VP8X)."""
+    if len(data) < 30 or data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        return None
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        # frame header: start code 9d 01 2a, depois largura/altura (14 bits cada)
+        if data[23:26] != b"\x9d\x01\x2a":
+            return None
+        w, h = struct.unpack("<HH", data[26:30])
+        return ProbeInfo("webp", w & 0x3FFF, h & 0x3FFF)
+    if chunk == b"VP8L":
+        if data[20] != 0x2F:
+            return None
+        bits = int.from_bytes(data[21:25], "little")
+        return ProbeInfo("webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b"VP8X":
+        animated = bool(data[20] & 0x02)
+        w = int.from_bytes(data[24:27], "little") + 1
+        h = int.from_bytes(data[27:30], "little") + 1
+        return ProbeInfo("webp", w, h, animated=animated)
+    return None
+
+
+# ---------------------------------------------------------------- WebM (EBML)
+
+_EBML = 0x1A45DFA3
+_DOCTYPE = 0x4282
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_TYPE = 0x83
+_CODEC_ID = 0x86
+_DEFAULT_DURATION = 0x23E383
+_VIDEO = 0xE0
+_PIXEL_WIDTH = 0xB0
+_PIXEL_HEIGHT = 0xBA
+_CLUSTER = 0x1F43B675
+
+_UNKNOWN = -1
+
+
+def _vint(data: bytes, pos: int, keep_marker: bool) -> tuple[int, int]:
+    """lê um inteiro de tamanho variável do EBML. devolve (valor, nova posição)."""
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise ValueError("vint inválido")
+    value = first if keep_marker else first & (mask - 1)
+    for b in data[pos + 1:pos + length]:
+        value = (value << 8) | b
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = _UNKNOWN
+    return value, pos + length
+
+
+def _elements(data: bytes, pos: int, end: int):
+    """percorre os elementos filhos entre pos e end: (id, início do conteúdo, fim)."""
+    while pos < end:
+        eid, pos = _vint(data, pos, keep_marker=True)
+        size, pos = _vint(data, pos, keep_marker=False)
+        stop = end if size == _UNKNOWN else min(end, pos + size)
+        yield eid, pos, stop
+        pos = stop
+
+
+def _uint(data: bytes, a: int, b: int) -> int:
+    return int.from_bytes(data[a:b], "big")
+
+
+def _float(data: bytes, a: int, b: int) -> float:
+    return struct.unpack(">f" if b - a == 4 else ">d", data[a:b])[0]
+
+
+def probe_webm(data: bytes) -> ProbeInfo | None:
+    """lê codec, dimensões, duração, fps e se tem áudio do cabeçalho do WebM (para no 1º Cluster)."""
+    if data[:4] != b"\x1a\x45\xdf\xa3":
+        return None
+    try:
+        doctype = ""
+        timecode_scale = 1_000_000
+        duration = None
+        video = None   # (codec, w, h, default_duration_ns)
+        has_audio = False
+
+        for eid, a, b in _elements(data, 0, len(data)):
+            if eid == _EBML:
+                for cid, ca, cb in _elements(data, a, b):
+                    if cid == _DOCTYPE:
+                        doctype = data[ca:cb].decode("ascii", "replace").rstrip("\0")
+            elif eid == _SEGMENT:
+                for sid, sa, sb in _elements(data, a, b):
+                    if sid == _CLUSTER:
+                        break
+                    if sid == _INFO:
+                        for iid, ia, ib in _elements(data, sa, sb):
+                            if iid == _TIMECODE_SCALE:
+                                timecode_scale = _uint(data, ia, ib)
+                            elif iid == _DURATION:
+                                duration = _float(data, ia, ib)
+                    elif sid == _TRACKS:
+                        for tid, ta, tb in _elements(data, sa, sb):
+                            if tid != _TRACK_ENTRY:
+                                continue
+                            ttype, codec, dd, w, h = None, "", None, 0, 0
+                            for fid, fa, fb in _elements(data, ta, tb):
+                                if fid == _TRACK_TYPE:
+                                    ttype = _uint(data, fa, fb)
+                                elif fid == _CODEC_ID:
+                                    codec = data[fa:fb].decode("ascii", "replace").rstrip("\0")
+                                elif fid == _DEFAULT_DURATION:
+                                    dd = _uint(data, fa, fb)
+                                elif fid == _VIDEO:
+                                    for vid, va, vb in _elements(data, fa, fb):
+                                        if vid == _PIXEL_WIDTH:
+                                            w = _uint(data, va, vb)
+                                        elif vid == _PIXEL_HEIGHT:
+                                            h = _uint(data, va, vb)
+                            if ttype == 1 and video is None:
+                                video = (codec, w, h, dd)
+                            elif ttype == 2:
+                                has_audio = True
+                break
+    except (ValueError, IndexError, struct.error):
+        return None
+
+    if doctype != "webm" or video is None:
+        return None
+    codec, w, h, dd = video
+    seconds = duration * timecode_scale / 1e9 if duration is not None else None
+    fps = 1e9 / dd if dd else None
+    return ProbeInfo("webm", w, h, animated=True, codec=codec, duration=seconds, fps=fps, has_audio=has_audio)
+
+
+# ---------------------------------------------------------------- decisão
+
+def _fits_box(info: ProbeInfo) -> bool:
+    return max(info.width, info.height) == STICKER_SIZE and min(info.width, info.height) >= 1
+
+
+def passthrough_action(data: bytes, animated: bool) -> str | None:
+    """
+    "as_is": já é figurinha válida, manda os bytes como vieram;
+    "remux": vídeo válido mas com áudio, basta copiar o vídeo sem a faixa de áudio;
+    None: precisa converter.
+    Na dúvida (cabeçalho sem duração/fps) devolve None.
+    """
+    if not animated:
+        info = probe_webp(data)
+        if info and not info.animated and _fits_box(info) and len(data) <= WEBP_MAX_BYTES:
+            return "as_is"
+        return None
+
+    info = probe_webm(data)
+    if (
+        info is None
+        or info.codec != "V_VP9"
+        or not _fits_box(info)
+        or info.duration is None
+        or info.duration > WEBM_SECONDS
+        or info.fps is None
+        or info.fps > WEBM_FPS + 0.01
+    ):
+        return None
+    if info.has_audio:
+        return "remux"
+    return "as_is" if len(data) <= WEBM_MAX_BYTES else None
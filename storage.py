@@ -0,0 +1,250 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# banco do bot (data/groups.db):
+# - uma conexão só, aberta uma vez, em modo WAL;
+# - todo acesso roda numa thread dedicada (nunca bloqueia o loop do bot) e em
+#   série, então a conexão nunca é usada por duas threads ao mesmo tempo;
+# - schema versionado pelo PRAGMA user_version (MIGRATIONS, em ordem);
+# - chats permitidos ficam na tabela allowed_chats e num set em memória; se
+#   outro processo mexer no banco (sqlite3 na mão, script), o PRAGMA data_version
+#   muda e o set é recarregado.
+
+RELOAD_SECONDS = float(os.getenv("ALLOWLIST_RELOAD_SECONDS", "5"))
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _migration_1(conn: sqlite3.Connection, seed_chat_ids):
+    # tabelas que já existiam antes do versionamento (IF NOT EXISTS adota o banco antigo)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS groups (
+            chat_id INTEGER PRIMARY KEY,
+            title TEXT,
+            chat_type TEXT,
+            joined_at TEXT
+        )
+    """)
+    # figurinhas já enviadas: file_unique_id da mídia original + opções -> file_id do sticker
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sticker_ids (
+            source_unique_id TEXT NOT NULL,
+            options TEXT NOT NULL,
+            sticker_file_id TEXT NOT NULL,
+            created_at TEXT,
+            PRIMARY KEY (source_unique_id, options)
+        )
+    """)
+
+
+def _migration_2(conn: sqlite3.Connection, seed_chat_ids):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS allowed_chats (
+            chat_id INTEGER PRIMARY KEY,
+            note TEXT,
+            added_by INTEGER,
+            added_at TEXT
+        )
+    """)
+    conn.executemany(
+        "INSERT OR IGNORE INTO allowed_chats (chat_id, note, added_by, added_at) VALUES (?, ?, NULL, ?)",
+        [(chat_id, note, _now()) for chat_id, note in seed_chat_ids.items()],
+    )
+
+
+MIGRATIONS = [_migration_1, _migration_2]
+
+
+class Storage:
+    def __init__(self, path: str, seed_chat_ids: dict[int, str] | None = None):
+        self.path = path
+        self.seed_chat_ids = dict(seed_chat_ids or {})
+        self._conn: sqlite3.Connection | None = None
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._allowed: frozenset[int] = frozenset()
+        self._data_version: int | None = None
+        self._watcher: asyncio.Task | None = None
+
+    # ------------------------------------------------------------ abrir / fechar
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self._conn = conn
+        self._migrate()
+        self._allowed = self._load_allowed()
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def open(self):
+        """abre o banco e aplica as migrações pendentes (bloqueante; chamar antes do loop)."""
+        if self._conn is None:
+            self._thread.submit(self._open).result()
+
+    def _migrate(self):
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS, start=1):
+            if number <= version:
+                continue
+            # cada migração numa transação, junto com o user_version novo
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                migration(self._conn, self.seed_chat_ids)
+                self._conn.execute(f"PRAGMA user_version = {number}")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            print(f"banco migrado pra versão {number}")
+
+    @property
+    def schema_version(self) -> int:
+        return len(MIGRATIONS)
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._thread, fn, *args)
+
+    async def start(self):
+        """liga o recarregamento automático da lista de chats (post_init)."""
+        self.open()
+        if self._watcher is None and RELOAD_SECONDS > 0:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+
+    # ------------------------------------------------------------ chats permitidos
+
+    def _load_allowed(self) -> frozenset[int]:
+        return frozenset(r[0] for r in self._conn.execute("SELECT chat_id FROM allowed_chats"))
+
+    def is_allowed(self, chat_id: int) -> bool:
+        """consulta só o set em memória (sem I/O)."""
+        return chat_id in self._allowed
+
+    @property
+    def allowed_chat_ids(self) -> frozenset[int]:
+        return self._allowed
+
+    def _reload_if_changed(self) -> frozenset[int] | None:
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return None
+        self._data_version = version
+        return self._load_allowed()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(RELOAD_SECONDS)
+            try:
+                fresh = await self._call(self._reload_if_changed)
+            except Exception as e:
+                print(f"erro ao recarregar chats permitidos: {e}")
+                continue
+            if fresh is not None and fresh != self._allowed:
+                self._allowed = fresh
+                print(f"chats permitidos recarregados: {len(fresh)}")
+
+    def _allow(self, chat_id: int, note: str, added_by: int | None):
+        self._conn.execute("""
+            INSERT INTO allowed_chats (chat_id, note, added_by, added_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET note=excluded.note
+        """, (chat_id, note, added_by, _now()))
+        return self._load_allowed()
+
+    def _block(self, chat_id: int):
+        cur = self._conn.execute("DELETE FROM allowed_chats WHERE chat_id = ?", (chat_id,))
+        return cur.rowcount > 0, self._load_allowed()
+
+    async def allow_chat(self, chat_id: int, note: str = "", added_by: int | None = None):
+        self._allowed = await self._call(self._allow, chat_id, note, added_by)
+
+    async def block_chat(self, chat_id: int) -> bool:
+        """tira o chat da lista; False se ele não estava lá."""
+        removed, self._allowed = await self._call(self._block, chat_id)
+        return removed
+
+    def _list_allowed(self):
+        return self._conn.execute(
+            "SELECT chat_id, note FROM allowed_chats ORDER BY note COLLATE NOCASE, chat_id"
+        ).fetchall()
+
+    async def list_allowed(self) -> list[tuple[int, str]]:
+        return await self._call(self._list_allowed)
+
+    # ------------------------------------------------------------ grupos
+
+    def _upsert_group(self, chat_id: int, title: str, chat_type: str):
+        self._conn.execute("""
+            INSERT INTO groups (chat_id, title, chat_type, joined_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                title=excluded.title,
+                chat_type=excluded.chat_type
+        """, (chat_id, title or "", chat_type or "", _now()))
+
+    async def upsert_group(self, chat_id: int, title: str, chat_type: str):
+        await self._call(self._upsert_group, chat_id, title, chat_type)
+
+    def _delete_group(self, chat_id: int):
+        self._conn.execute("DELETE FROM groups WHERE chat_id = ?", (chat_id,))
+
+    async def delete_group(self, chat_id: int):
+        await self._call(self._delete_group, chat_id)
+
+    def _list_groups(self):
+        return self._conn.execute(
+            "SELECT chat_id, title, chat_type FROM groups ORDER BY title COLLATE NOCASE"
+        ).fetchall()
+
+    async def list_groups(self) -> list[tuple[int, str, str]]:
+        return await self._call(self._list_groups)
+
+    # ------------------------------------------------------------ file_id das figurinhas
+
+    def _get_sticker_file_id(self, source_unique_id: str, options: str) -> str | None:
+        row = self._conn.execute(
+            "SELECT sticker_file_id FROM sticker_ids WHERE source_unique_id = ? AND options = ?",
+            (source_unique_id, options),
+        ).fetchone()
+        return row[0] if row else None
+
+    async def get_sticker_file_id(self, source_unique_id: str, options: str) -> str | None:
+        """file_id da figurinha já enviada pra essa mídia + opções do /fig (se houver)."""
+        return await self._call(self._get_sticker_file_id, source_unique_id, options)
+
+    def _save_sticker_file_id(self, source_unique_id: str, options: str, sticker_file_id: str):
+        self._conn.execute("""
+            INSERT INTO sticker_ids (source_unique_id, options, sticker_file_id, created_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(source_unique_id, options) DO UPDATE SET
+                sticker_file_id=excluded.sticker_file_id,
+                created_at=excluded.created_at
+        """, (source_unique_id, options, sticker_file_id, _now()))
+
+    async def save_sticker_file_id(self, source_unique_id: str, options: str, sticker_file_id: str):
+        await self._call(self._save_sticker_file_id, source_unique_id, options, sticker_file_id)
+
+    def _delete_sticker_file_id(self, source_unique_id: str, options: str):
+        self._conn.execute(
+            "DELETE FROM sticker_ids WHERE source_unique_id = ? AND options = ?", (source_unique_id, options)
+        )
+
+    async def delete_sticker_file_id(self, source_unique_id: str, options: str):
+        await self._call(self._delete_sticker_file_id, source_unique_id, options)
@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+import sticker_pack
+from sticker_pack import PackError, build_pack
+
+
+class FakeBot:
+    """
+    Bot falso com só o que o build_pack usa. `fail` mapeia o número da chamada
+    de upload (1 = primeira figurinha enviada) pra exceção que ela levanta;
+    pode ser uma lista, consumida uma por tentativa.
+    """
+
+    def __init__(self, existing: int | None = None, fail: dict | None = None):
+        self.stickers = None if existing is None else [object()] * existing
+        self.fail = {k: list(v) if isinstance(v, list) else [v] for k, v in (fail or {}).items()}
+        self.calls: list[tuple[str, int]] = []
+        self._uploads = 0
+
+    async def get_sticker_set(self, name):
+        if self.stickers is None:
+            raise BadRequest("Stickerset_invalid")
+        return SimpleNamespace(name=name, stickers=list(self.stickers))
+
+    def _upload(self, method: str):
+        pending = self.fail.get(self._uploads + 1)
+        self.calls.append((method, self._uploads + 1))
+        if pending:
+            raise pending.pop(0)
+        self._uploads += 1
+
+    async def create_new_sticker_set(self, user_id, name, title, stickers):
+        assert self.stickers is None
+        self._upload("create")
+        self.stickers = list(stickers)
+
+    async def add_sticker_to_set(self, user_id, name, sticker):
+        assert self.stickers is not None
+        self._upload("add")
+        self.stickers.append(sticker)
+
+
+async def _convert(item):
+    if isinstance(item, Exception):
+        raise item
+    return b"RIFF....WEBP", False
+
+
+def _build(bot, items, **kw):
+    return asyncio.run(build_pack(bot, 1, "dina1_by_teste_bot", "Teste", items, _convert, **kw))
+
+
+@pytest.fixture
+def waits(monkeypatch):
+    """troca o sleep do RetryAfter por um que só anota quanto ia esperar."""
+    waited = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(seconds, *a, **kw):
+        waited.append(seconds)
+        await real_sleep(0)
+
+    monkeypatch.setattr(sticker_pack.asyncio, "sleep", fake_sleep)
+    return waited
+
+
+def test_cria_no_primeiro_e_adiciona_nos_outros():
+    bot = FakeBot()
+    result = _build(bot, ["a", "b", "c"])
+    assert [c[0] for c in bot.calls] == ["create", "add", "add"]
+    assert result.created and result.added == 3 and result.total == 3
+    assert result.failed == [] and result.skipped == 0
+
+
+def test_pacote_existente_so_adiciona():
+    bot = FakeBot(existing=4)
+    result = _build(bot, ["a", "b"])
+    assert [c[0] for c in bot.calls] == ["add", "add"]
+    assert not result.created and result.total == 6
+
+
+def test_retry_after_espera_e_tenta_de_novo(waits):
+    bot = FakeBot(fail={2: [RetryAfter(3), RetryAfter(1)]})
+    result = _build(bot, ["a", "b", "c"])
+    assert bot.calls == [("create", 1), ("add", 2), ("add", 2), ("add", 2), ("add", 3)]
+    assert waits == [3.5, 1.5]
+    assert result.added == 3 and result.retries == 2 and result.failed == []
+
+
+def test_limite_de_figurinhas_do_pacote():
+    bot = FakeBot(existing=118)
+    result = _build(bot, ["a", "b", "c", "d"], max_stickers=120)
+    assert len(bot.calls) == 2
+    assert result.added == 2 and result.skipped == 2 and result.total == 120
+
+    with pytest.raises(PackError):
+        _build(FakeBot(existing=120), ["a"], max_stickers=120)
+
+
+def test_falha_no_meio_devolve_o_pacote_parcial(waits):
+    # o item 2 não converte, o 4 é recusado pelo Telegram e no 6 ele pede uma
+    # espera longa demais: o que já entrou (1, 3 e 5) tem que vir no resultado
+    too_long = RetryAfter(int(sticker_pack.PACK_MAX_RETRY_WAIT) + 1)
+    bot = FakeBot(fail={3: BadRequest("Sticker_png_dimensions"), 4: too_long})
+    items = ["a", RuntimeError("quebrou"), "c", "d", "e", "f", "g"]
+    result = _build(bot, items)
+
+    assert result.created and result.added == 3 and result.total == 3
+    assert [pos for pos, _ in result.failed] == [2, 4, 6, 7]
+    assert result.failed[0][1] == "quebrou"
+    assert result.failed[1][1] == "Sticker_png_dimensions"
+    assert "esperar" in result.failed[2][1]
+    assert waits == []
+
+
+def test_falha_antes_de_qualquer_figurinha_vira_erro():
+    bot = FakeBot(fail={1: BadRequest("PEER_ID_INVALID")})
+    with pytest.raises(PackError, match="/start"):
+        _build(bot, ["a", "b"])
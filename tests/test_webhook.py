@@ -0,0 +1,125 @@
+import asyncio
+import os
+import socket
+
+import pytest
+
+pytest.importorskip("tornado")  # python-telegram-bot[webhooks]
+import httpx
+from telegram import User
+from telegram.ext import ApplicationHandlerStop, ExtBot, TypeHandler
+
+os.environ.setdefault("BOT_TOKEN", "123456:TESTE")
+import bot as dinabot
+from serve_config import load_serve_settings, webhook_kwargs
+
+SECRET = "segredo-de-teste_123"
+
+UPDATE = {
+    "update_id": 4242,
+    "message": {
+        "message_id": 7,
+        "date": 1700000000,
+        "chat": {"id": -100123, "type": "supergroup", "title": "teste"},
+        "from": {"id": 99, "is_bot": False, "first_name": "Fulano"},
+        "text": "/ping",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+    },
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def offline_bot(monkeypatch):
+    """sem rede: get_me e set_webhook viram chamadas anotadas."""
+    calls = []
+
+    async def fake_get_me(self, *args, **kwargs):
+        calls.append(("get_me", kwargs))
+        self._bot_user = User(id=123456, first_name="dina", is_bot=True, username="dina_teste_bot")
+        return self._bot_user
+
+    async def fake_set_webhook(self, *args, **kwargs):
+        calls.append(("set_webhook", kwargs))
+        return True
+
+    monkeypatch.setattr(ExtBot, "get_me", fake_get_me)
+    monkeypatch.setattr(ExtBot, "set_webhook", fake_set_webhook)
+    return calls
+
+
+async def _serve_and_post(settings, posts: list[dict]) -> tuple[list, list[int]]:
+    """sobe o app do bot em modo webhook, faz os POSTs e devolve (updates tratados, status HTTP)."""
+    app = dinabot.build_application("123456:TESTE", settings)
+    seen = []
+
+    async def record(update, context):
+        seen.append(update)
+        # não deixa chegar nos handlers de verdade (eles precisam do banco)
+        raise ApplicationHandlerStop
+
+    app.add_handler(TypeHandler(object, record), group=-100)
+
+    statuses = []
+    url = f"http://127.0.0.1:{settings.port}/{settings.url_path}"
+    async with app:
+        await app.start()
+        await app.updater.start_webhook(**webhook_kwargs(settings))
+        try:
+            async with httpx.AsyncClient() as client:
+                for headers in posts:
+                    r = await client.post(url, json=UPDATE, headers=headers)
+                    statuses.append(r.status_code)
+            for _ in range(50):
+                if app.update_queue.empty():
+                    break
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.05)
+        finally:
+            await app.updater.stop()
+            await app.stop()
+    return seen, statuses
+
+
+def _settings():
+    return load_serve_settings({
+        "WEBHOOK_URL": "https://exemplo.com.br/",
+        "WEBHOOK_PATH": "tg-hook",
+        "WEBHOOK_SECRET": SECRET,
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "WEBHOOK_PORT": str(_free_port()),
+        "CONCURRENT_UPDATES": "4",
+    })
+
+
+def test_webhook_entrega_update_com_secret(offline_bot):
+    settings = _settings()
+    assert settings.webhook and settings.secret_token == SECRET
+
+    seen, statuses = asyncio.run(_serve_and_post(settings, [
+        {"X-Telegram-Bot-Api-Secret-Token": SECRET},
+    ]))
+
+    assert statuses == [200]
+    assert [u.update_id for u in seen] == [4242]
+    assert seen[0].effective_message.text == "/ping"
+
+    set_webhook = [kw for name, kw in offline_bot if name == "set_webhook"]
+    assert set_webhook and set_webhook[0]["url"] == "https://exemplo.com.br/tg-hook"
+    assert set_webhook[0]["secret_token"] == SECRET
+    assert set_webhook[0]["allowed_updates"] == ["message", "my_chat_member"]
+
+
+def test_webhook_recusa_secret_errado_ou_ausente(offline_bot):
+    seen, statuses = asyncio.run(_serve_and_post(_settings(), [
+        {"X-Telegram-Bot-Api-Secret-Token": "outro-segredo"},
+        {},
+    ]))
+
+    assert statuses == [403, 403]
+    assert seen == []
@@ -0,0 +1,81 @@
+import io
+from typing import NamedTuple
+
+from PIL import Image
+
+from metrics import stage
+
+# escolhe as configurações do WebP por imagem em vez de sempre method=6/quality=95
+# (o modo mais lento do libwebp, ~10x mais lento que method=2-4 com tamanho parecido)
+
+# limite do Telegram pra figurinha estática
+WEBP_MAX_BYTES = 512 * 1024
+# até isso de cores (fundo chapado + texto com antialias, logo) sem perdas sai menor e mais rápido
+PALETTE_MAX_COLORS = 1024
+# abaixo disso é arte sintética (bolha de quote, print, logo): preset rápido
+FLAT_MAX_COLORS = 8192
+# menor qualidade que a escada de tamanho aceita
+MIN_QUALITY = 50
+
+
+class WebpProfile(NamedTuple):
+    name: str
+    lossless: bool
+    method: int
+    quality: int
+
+
+PROFILES = {
+    # poucas cores (quote sem foto, logo, pixel art): sem perdas sai pequeno e rápido
+    "lossless": WebpProfile("lossless", True, 1, 20),
+    # arte chapada com alguma foto (quote com avatar, print): lossy rápido
+    "flat": WebpProfile("flat", False, 2, 90),
+    # foto: um pouco mais de esforço, ainda longe do method=6
+    "photo": WebpProfile("photo", False, 4, 90),
+    # o preset antigo (mais lento), só pra comparação/benchmark
+    "max": WebpProfile("max", False, 6, 95),
+}
+
+
+def pick_profile(img: Image.Image) -> WebpProfile:
+    """classifica a imagem pela contagem de cores (getcolors para cedo se passar do limite)."""
+    if img.getcolors(PALETTE_MAX_COLORS) is not None:
+        return PROFILES["lossless"]
+    if img.getcolors(FLAT_MAX_COLORS) is not None:
+        return PROFILES["flat"]
+    return PROFILES["photo"]
+
+
+def _save(img: Image.Image, lossless: bool, method: int, quality: int) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format="WEBP", lossless=lossless, method=method, quality=quality)
+    return out.getvalue()
+
+
+def encode_webp(img: Image.Image, profile: WebpProfile | str | None = None, *, max_bytes: int = WEBP_MAX_BYTES) -> bytes:
+    """
+    Codifica em WebP com o perfil dado (ou escolhido pela imagem).
+
+    Se passar de max_bytes: sem perdas cai pro lossy do perfil "photo", e o
+    lossy vai baixando a qualidade de 10 em 10 até MIN_QUALITY.
+    """
+    with stage("encode"):
+        return _encode_webp(img, profile, max_bytes)
+
+
+def _encode_webp(img: Image.Image, profile: WebpProfile | str | None, max_bytes: int) -> bytes:
+    if isinstance(profile, str):
+        profile = PROFILES[profile]
+    profile = profile or pick_profile(img)
+
+    data = _save(img, profile.lossless, profile.method, profile.quality)
+    if len(data) <= max_bytes:
+        return data
+
+    lossy = PROFILES["photo"] if profile.lossless else profile
+    quality = lossy.quality
+    while True:
+        data = _save(img, False, lossy.method, quality)
+        if len(data) <= max_bytes or quality <= MIN_QUALITY:
+            return data
+        quality = max(MIN_QUALITY, quality - 10)